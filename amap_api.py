@@ -1,21 +1,46 @@
 # amap_api.py
-import requests
 from config import AMAP_KEY
+from http_client import get_client
+import metrics
 
 BASE_URL = "https://restapi.amap.com/v3/traffic/status/road"
+RECTANGLE_URL = "https://restapi.amap.com/v3/traffic/status/rectangle"
 
-def get_traffic_status(city, road_name):
+def get_traffic_status(city, road_name, key=None, on_retry=None):
     """
     调用高德交通路况API
     :param city: 城市名，例如 "福州市"
     :param road_name: 道路名，例如 "五四路"
+    :param key: 使用的 API Key，默认取 config.AMAP_KEY
+    :param on_retry: 每次重试前调用，见 AmapClient.get_json
     :return: JSON 数据
     """
     params = {
-        "key": AMAP_KEY,
+        "key": key or AMAP_KEY,
         "city": city,
         "name": road_name,
         "extensions": "all"
     }
-    response = requests.get(BASE_URL, params=params, timeout=10)
-    return response.json()
+    with metrics.timer("amap_request_seconds", api="traffic_status"):
+        data = get_client().get_json(BASE_URL, params, on_retry)
+    metrics.record_response("traffic_status", data)
+    return data
+
+
+def get_traffic_rectangle(rectangle, key=None, on_retry=None):
+    """
+    调用高德矩形区域交通态势API
+    :param rectangle: 矩形区域 "左下经度,左下纬度;右上经度,右上纬度"，对角线不能超过10公里
+    :param key: 使用的 API Key，默认取 config.AMAP_KEY
+    :param on_retry: 每次重试前调用，见 AmapClient.get_json
+    :return: JSON 数据，trafficinfo.roads 为区域内的全部路段
+    """
+    params = {
+        "key": key or AMAP_KEY,
+        "rectangle": rectangle,
+        "extensions": "all"
+    }
+    with metrics.timer("amap_request_seconds", api="traffic_rectangle"):
+        data = get_client().get_json(RECTANGLE_URL, params, on_retry)
+    metrics.record_response("traffic_rectangle", data)
+    return data
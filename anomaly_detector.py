@@ -0,0 +1,151 @@
+# anomaly_detector.py
+# 在线异常检测：每条道路、每个"星期几+小时"一个指数加权均值/方差，采集时逐条道路比较本次延时指数，偏离过大时报警；
+# 状态大小只与道路数 × 168 有关，与样本数无关，保存在本地文件中，重启后无需从历史数据重新训练
+import json
+import math
+import os
+from datetime import datetime
+
+from config import (ANOMALY_ALPHA, ANOMALY_Z_THRESHOLD, ANOMALY_MIN_SAMPLES, ANOMALY_MIN_STD, ANOMALY_STATE_FILE,
+                    ANOMALY_ALERT_FILE)
+import metrics
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def hour_of_week(timestamp):
+    """0 表示周一 0 点，167 表示周日 23 点"""
+    return timestamp.weekday() * 24 + timestamp.hour
+
+
+def load_state(path=ANOMALY_STATE_FILE):
+    """
+    读取检测状态，文件不存在时返回空状态
+    :return: {"roads": {道路: {星期小时: [均值, 方差, 样本数]}}}
+    """
+    if not os.path.exists(path):
+        return {"roads": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state, path=ANOMALY_STATE_FILE):
+    """原子写入检测状态，先写临时文件再替换"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _accumulate(sums, records):
+    """按记录的 road_name 累加各路段的延时指数：{道路: (总和, 路段数)}，error 记录不计入"""
+    for record in records:
+        if record.get("road_name") and record.get("status") != "error" and record.get("delay_index") is not None:
+            total, count = sums.get(record["road_name"], (0.0, 0))
+            sums[record["road_name"]] = (total + float(record["delay_index"]), count + 1)
+    return sums
+
+
+class AnomalyDetector:
+    """
+    按 (道路, 星期几+小时) 维护延时指数的指数加权均值和方差（EWMA），作为采集的 observer 逐条道路检测：
+    - 先用已有状态计算 z = (x - 均值) / 标准差，样本数不少于 min_samples 且 |z| 超过 z_threshold 时报警
+    - 再更新状态；样本数达到 min_samples 后，更新时把观测值截断到 均值 ± z_threshold × 标准差，单次异常不会把基线拉偏
+      （样本不足时标准差还不可靠，截断会把早期样本都拉向第一个值，使基线偏低、方差偏小）
+    - 样本数少于 1/alpha 时按样本数取权重（等价于普通均值/方差），之后固定为 alpha
+    用法:
+        detector = AnomalyDetector()
+        iter_fuzhou_traffic(roads, observer=detector)
+        detector.commit()   # 保存状态、追加报警记录
+    :param now: 快照时间，决定使用哪个星期几+小时的基线，默认取创建检测器的时间
+    :param alpha: EWMA 权重，越大越快适应最近的数据
+    :param min_std: 标准差下限，避免数据一直不变时微小波动也报警
+    """
+
+    def __init__(self, path=ANOMALY_STATE_FILE, alert_file=ANOMALY_ALERT_FILE, now=None, alpha=ANOMALY_ALPHA,
+                 z_threshold=ANOMALY_Z_THRESHOLD, min_samples=ANOMALY_MIN_SAMPLES, min_std=ANOMALY_MIN_STD):
+        self.path = path
+        self.alert_file = alert_file
+        self.now = now or datetime.now()
+        self.bucket = str(hour_of_week(self.now))
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.min_std = min_std
+        self.state = load_state(path)
+        self.alerts = []
+        self._seen = set()
+
+    @property
+    def observed(self):
+        return len(self._seen)
+
+    def observe(self, road, value):
+        """
+        检测并更新一条道路本次的观测值，同一快照中同一道路只计一次
+        :return: 报警记录，未报警时为 None
+        """
+        if road in self._seen:
+            return None
+        self._seen.add(road)
+        buckets = self.state["roads"].setdefault(road, {})
+        entry = buckets.get(self.bucket)
+        if entry is None:
+            buckets[self.bucket] = [value, 0.0, 1]
+            return None
+        mean, var, count = entry
+        std = max(math.sqrt(var), self.min_std)
+        z = (value - mean) / std
+        alert = None
+        if count >= self.min_samples and abs(z) > self.z_threshold:
+            alert = {
+                "timestamp": self.now.strftime(TIME_FORMAT),
+                "road_name": road,
+                "hour_of_week": int(self.bucket),
+                "delay_index": round(value, 4),
+                "mean": round(mean, 4),
+                "std": round(std, 4),
+                "z": round(z, 2),
+                "direction": "high" if z > 0 else "low",
+            }
+            self.alerts.append(alert)
+            metrics.inc("anomaly_alerts_total", direction=alert["direction"])
+        # 基线建立后截断再更新，异常值只按阈值边界计入基线
+        clipped = value
+        if count >= self.min_samples:
+            clipped = min(max(value, mean - self.z_threshold * std), mean + self.z_threshold * std)
+        weight = max(self.alpha, 1.0 / (count + 1))
+        diff = clipped - mean
+        mean += weight * diff
+        var = (1 - weight) * (var + weight * diff * diff)
+        buckets[self.bucket] = [mean, var, count + 1]
+        return alert
+
+    def __call__(self, road, records):
+        """
+        observer 接口：检测该道路本次的记录，原样返回
+        一次查询可能返回多个道路名的路段，与 observe_batches 一样按记录的 road_name 分别检测
+        """
+        for name, (total, count) in _accumulate({}, records).items():
+            self.observe(name, total / count)
+        return records
+
+    def observe_batches(self, batches):
+        """
+        检测一批批记录（用于矩形区域采集等没有逐条道路回调的场景），原样返回每一批
+        同一道路的路段可能分散在多批中，先按道路累加，全部批次返回后再逐条道路检测
+        """
+        sums = {}
+        for batch in batches:
+            _accumulate(sums, batch)
+            yield batch
+        for road, (total, count) in sums.items():
+            self.observe(road, total / count)
+
+    def commit(self):
+        """快照保存成功后调用：写入检测状态，并向报警文件追加本次的报警（JSON Lines）"""
+        save_state(self.state, self.path)
+        if self.alerts and self.alert_file:
+            with open(self.alert_file, "a", encoding="utf-8") as f:
+                for alert in self.alerts:
+                    f.write(json.dumps(alert, ensure_ascii=False) + "\n")
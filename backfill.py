@@ -0,0 +1,233 @@
+# backfill.py
+# 历史数据回填：修改 FREE_FLOW_SPEEDS 后，按新配置重新计算全部历史记录的 free_flow_speed 和 delay_index
+import argparse
+import glob
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import (LOADER_CHUNK_SIZE, ROLLUP_FILE, CUBE_DIR, DASHBOARD_DIR, CITY_JOBS, CITY_DATA_DIR, STORAGE_BACKEND,
+                    TRAFFIC_CSV_FILE, PARQUET_DIR, SQLITE_FILE, DELTA_DIR)
+from csv_utils import csv_lock, recover_csv, store_lock
+from free_flow import FreeFlowResolver
+from congestion_cube import build_cube
+from dashboard import build_dashboard
+from multi_city import job_paths
+from rollup_store import RollupStore
+import delta_store
+import sqlite_store
+from storage import (BACKFILL_BACKUP_SUFFIX, BACKFILL_STAGING_SUFFIX, default_data_path, load_traffic, to_typed_frame,
+                     is_sqlite, list_partitions, recover_backfill, recover_compaction)
+from traffic_fetcher import calculate_delay_index_batch
+
+
+def recompute(df, resolver):
+    """
+    按当前配置重新计算一批记录的 free_flow_speed 和 delay_index（原地修改并返回）
+    """
+    free_flow = resolver.resolve_many(df["road_name"])
+    df["delay_index"] = calculate_delay_index_batch(df["speed"], df["status"], free_flow)
+    # 配置中的速度都是整数时保持整数格式，与采集时写入的格式一致
+    if np.all(np.mod(free_flow.to_numpy(), 1) == 0):
+        free_flow = free_flow.astype("int64")
+    df["free_flow_speed"] = free_flow.to_numpy()
+    return df
+
+
+def backfill_csv(path, resolver, chunksize=LOADER_CHUNK_SIZE):
+    """
+    分块回填CSV文件：写入同目录下的临时文件，全部完成后再替换原文件
+    其余列按原始文本读写，不改变格式
+    :return: 处理的记录数
+    """
+    tmp_path = path + ".backfill.tmp"
+    total = 0
+    # 回填期间持有写锁，采集进程的快照会等待回填完成后再追加；先回滚上次中途崩溃的快照
+    with csv_lock(path):
+        recover_csv(path)
+        try:
+            chunks = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize)
+            for i, chunk in enumerate(chunks):
+                recompute(chunk, resolver)
+                chunk.to_csv(tmp_path, mode="w" if i == 0 else "a", header=(i == 0), index=False, encoding="utf-8")
+                total += len(chunk)
+            with open(tmp_path, "rb+") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return total
+
+
+def _swap_in(root, staging):
+    """用回填生成的新目录替换原目录，中途中断时由 storage.recover_backfill 完成或撤销"""
+    backup = root + BACKFILL_BACKUP_SUFFIX
+    os.rename(root, backup)
+    os.rename(staging, root)
+    shutil.rmtree(backup)
+
+
+def backfill_partitions(root, resolver):
+    """
+    回填分区存储：在临时目录中生成完整的新数据，全部完成后与原目录交换
+    回填期间持有存储目录的写锁，采集进程的快照会等待回填完成后再写入，不会写进即将被替换的目录
+    :return: 处理的记录数
+    """
+    root = os.path.normpath(root)
+    staging = root + BACKFILL_STAGING_SUFFIX
+    total = 0
+    with store_lock(root):
+        recover_backfill(root)
+        try:
+            for directory in list_partitions(root):
+                recover_compaction(directory)
+                for path in sorted(glob.glob(os.path.join(directory, "*.parquet"))):
+                    df = to_typed_frame(recompute(pd.read_parquet(path), resolver))
+                    target = os.path.join(staging, os.path.relpath(path, root))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    df.to_parquet(target, index=False)
+                    total += len(df)
+            _swap_in(root, staging)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    return total
+
+
+def backfill_delta(root, resolver):
+    """
+    回填变化编码存储：逐天还原、重算后重新编码到临时目录，全部完成后与原目录交换
+    与分区存储一样持有存储目录的写锁，save_delta_snapshot 会等待回填完成
+    :return: 处理的记录数
+    """
+    root = os.path.normpath(root)
+    staging = root + BACKFILL_STAGING_SUFFIX
+    total = 0
+    with store_lock(root):
+        recover_backfill(root)
+        try:
+            for df in delta_store.iter_days(root):
+                delta_store.write_frame(recompute(df, resolver), staging)
+                total += len(df)
+            _swap_in(root, staging)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    return total
+
+
+def backfill_sqlite(path, resolver, chunksize=LOADER_CHUNK_SIZE):
+    """
+    回填 SQLite 数据库：按 rowid 分块读取、批量更新，全部在一个事务中完成，中途失败不会留下一半新一半旧的数据
+    :return: 处理的记录数
+    """
+    conn = sqlite_store.connect(path)
+    total = 0
+    last_rowid = 0
+    try:
+        with conn:
+            while True:
+                chunk = pd.read_sql_query(
+                    "SELECT rowid, road_name, speed, status FROM traffic WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    conn, params=[last_rowid, chunksize])
+                if chunk.empty:
+                    break
+                recompute(chunk, resolver)
+                conn.executemany("UPDATE traffic SET delay_index = ?, free_flow_speed = ? WHERE rowid = ?",
+                                 zip(chunk["delay_index"].astype(float), chunk["free_flow_speed"].astype(float),
+                                     chunk["rowid"].astype(int)))
+                total += len(chunk)
+                last_rowid = int(chunk["rowid"].iloc[-1])
+    finally:
+        conn.close()
+    return total
+
+
+def _data_paths(csv_path, parquet_dir, sqlite_path, delta_dir):
+    return {os.path.normpath(p) for p in (csv_path, parquet_dir, sqlite_path, delta_dir)}
+
+
+def aggregate_targets(path, jobs=None, root=CITY_DATA_DIR):
+    """
+    数据路径对应的汇总统计位置和自由流速度配置：
+    - 单城市采集的数据：全局的 ROLLUP_FILE、CUBE_DIR、DASHBOARD_DIR 和 config.FREE_FLOW_SPEEDS
+    - 多城市采集的城市数据（root/<name>/...）：该城市目录下的统计文件（多城市采集不生成看板）和任务的 free_flow_speeds
+    :param jobs: 城市任务列表，默认取 config.CITY_JOBS
+    :return: {"rollup", "cube", "dashboard", "speeds"}（不需要的项为 None）；其他路径返回 None
+    """
+    path = os.path.normpath(path)
+    if path in _data_paths(TRAFFIC_CSV_FILE, PARQUET_DIR, SQLITE_FILE, DELTA_DIR):
+        return {"rollup": ROLLUP_FILE, "cube": CUBE_DIR, "dashboard": DASHBOARD_DIR, "speeds": None}
+    for job in CITY_JOBS if jobs is None else jobs:
+        paths = job_paths(job, root)
+        if path in _data_paths(paths["csv"], paths["parquet"], paths["sqlite"], paths["delta"]):
+            return {"rollup": paths["rollup"], "cube": paths["cube"], "dashboard": None,
+                    "speeds": job.get("free_flow_speeds")}
+    return None
+
+
+def backfill(path=None, chunksize=LOADER_CHUNK_SIZE, speeds=None, targets=None):
+    """
+    回填历史数据，并重建属于该数据的汇总统计（已存在的才重建）
+    :param path: CSV 文件、分区存储目录、变化编码存储目录或 SQLite 数据库
+    :param speeds: 自由流速度配置，默认取 targets 中的配置（城市任务的 free_flow_speeds），再默认 config.FREE_FLOW_SPEEDS
+    :param targets: 需要重建的汇总统计位置，格式见 aggregate_targets，默认按 path 推断；
+                    无法推断时只回填数据，不重建任何统计，避免用其他数据覆盖全局统计
+    :return: (记录数, 耗时秒)
+    """
+    path = path or default_data_path()
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"数据文件 {path} 不存在")
+    targets = aggregate_targets(path) if targets is None else targets
+    if speeds is None and targets is not None:
+        speeds = targets.get("speeds")
+    resolver = FreeFlowResolver(speeds)
+    start = time.perf_counter()
+    if delta_store.is_delta(path):
+        total = backfill_delta(path, resolver)
+    elif os.path.isdir(path):
+        total = backfill_partitions(path, resolver)
+    elif is_sqlite(path):
+        total = backfill_sqlite(path, resolver, chunksize)
+    else:
+        total = backfill_csv(path, resolver, chunksize)
+    elapsed = time.perf_counter() - start
+
+    # 历史数据变化后，增量统计需要重建
+    targets = targets or {}
+    if targets.get("rollup") and os.path.exists(targets["rollup"]):
+        df = load_traffic(path, columns=["timestamp", "road_name", "delay_index", "speed"])
+        RollupStore.from_frame(df, targets["rollup"]).save()
+    if targets.get("cube") and os.path.isdir(targets["cube"]):
+        build_cube(path, targets["cube"])
+    if targets.get("dashboard") and os.path.isdir(targets["dashboard"]):
+        build_dashboard(path, targets["dashboard"])
+    return total, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按当前自由流速度配置回填历史数据")
+    parser.add_argument("--data", default=None, help="CSV 文件、分区存储目录、变化编码存储目录或 SQLite 数据库，默认取当前存储后端")
+    parser.add_argument("--city", default=None, help="回填多城市采集中该任务名（CITY_JOBS 的 name）的数据")
+    parser.add_argument("--chunksize", type=int, default=LOADER_CHUNK_SIZE, help="CSV 每块的行数")
+    args = parser.parse_args()
+
+    data = args.data
+    if args.city is not None:
+        job = next((job for job in CITY_JOBS if job["name"] == args.city), None)
+        if job is None:
+            parser.error(f"CITY_JOBS 中没有任务 {args.city}")
+        paths = job_paths(job)
+        data = data or default_data_path(STORAGE_BACKEND, paths["csv"], paths["parquet"], paths["sqlite"],
+                                         paths["delta"])
+    if aggregate_targets(data or default_data_path()) is None:
+        print(f"{data} 不是采集程序使用的数据位置，只回填数据，不重建汇总统计")
+    total, elapsed = backfill(data, args.chunksize)
+    rate = total / elapsed if elapsed > 0 else float("inf")
+    print(f"已回填 {total} 条记录，耗时 {elapsed:.2f} 秒，吞吐 {rate:,.0f} 行/秒")
+
+
+if __name__ == "__main__":
+    main()
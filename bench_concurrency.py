@@ -0,0 +1,51 @@
+# bench_concurrency.py
+# 并发采集基准测试：在本地模拟高德服务上测量不同线程数下单次快照的耗时
+import time
+
+import amap_api
+from fake_amap_server import FakeAmapServer
+from traffic_fetcher import fetch_fuzhou_traffic
+
+
+def run_benchmark(road_count=200, latency=0.05, worker_counts=(1, 2, 4, 8, 16, 32), qps=0):
+    """
+    :param road_count: 模拟的道路数量
+    :param latency: 模拟服务每个请求的延迟（秒）
+    :param worker_counts: 需要测试的线程数列表
+    :param qps: 限流QPS，0 表示不限流
+    :return: [(线程数, 耗时秒, 记录数)]
+    """
+    roads = [f"测试路{i}" for i in range(road_count)]
+    results = []
+    with FakeAmapServer(latency=latency) as fake:
+        amap_api.BASE_URL = f"{fake.url}/v3/traffic/status/road"
+        baseline = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            records = fetch_fuzhou_traffic(roads, workers=workers, qps=qps)
+            elapsed = time.perf_counter() - start
+            # 检查输出顺序与输入一致
+            names = list(dict.fromkeys(r["road_name"] for r in records))
+            assert names == roads, "输出顺序与输入道路顺序不一致"
+            if baseline is None:
+                baseline = records
+            else:
+                assert records == baseline, "并发结果与顺序结果不一致"
+            results.append((workers, elapsed, len(records)))
+    return results
+
+
+def main():
+    road_count, latency = 200, 0.05
+    print(f"道路数: {road_count}, 模拟延迟: {latency * 1000:.0f}ms")
+    for label, qps in (("不限流", 0), ("限流 50 QPS", 50)):
+        print(f"\n[{label}]")
+        print(f"{'线程数':>6} {'耗时(s)':>10} {'加速比':>8} {'记录数':>8}")
+        results = run_benchmark(road_count, latency, qps=qps)
+        base = results[0][1]
+        for workers, elapsed, count in results:
+            print(f"{workers:>6} {elapsed:>10.2f} {base / elapsed:>8.1f} {count:>8}")
+
+
+if __name__ == "__main__":
+    main()
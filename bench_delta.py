@@ -0,0 +1,60 @@
+# bench_delta.py
+# 变化编码存储基准测试：对比 CSV、分区列式存储和变化编码存储的磁盘占用、读取耗时，并校验还原数据与 CSV 完全一致
+import argparse
+import os
+import shutil
+import time
+
+import delta_store
+from storage import load_traffic, migrate_csv
+from synthetic_data import generate_csv
+
+ANALYSIS_COLUMNS = ["timestamp", "road_name", "delay_index", "speed"]
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def run_benchmark(road_count=1000, days=7, hold_rate=0.8, workdir="bench_delta_data"):
+    """
+    :param hold_rate: 每个道路/方向沿用上一次快照数值的概率
+    :return: {存储: {"bytes", "load_all", "load_columns"}}
+    """
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    csv_path = os.path.join(workdir, "traffic.csv")
+    parquet_dir = os.path.join(workdir, "traffic_data")
+    delta_dir = os.path.join(workdir, "traffic_delta")
+    rows = generate_csv(csv_path, road_count=road_count, days=days, hold_rate=hold_rate)
+    print(f"{road_count} 条道路 × {days} 天，沿用概率 {hold_rate}，共 {rows} 条记录")
+    migrate_csv(csv_path, parquet_dir)
+    seconds, _ = _timed(lambda: delta_store.migrate_csv(csv_path, delta_dir))
+    print(f"转换为变化编码存储 {seconds:.1f}s")
+
+    results = {}
+    for name, path in (("csv", csv_path), ("parquet", parquet_dir), ("delta", delta_dir)):
+        load_all, _ = _timed(lambda: load_traffic(path))
+        load_columns, _ = _timed(lambda: load_traffic(path, columns=ANALYSIS_COLUMNS))
+        results[name] = {"bytes": delta_store.disk_usage(path), "load_all": load_all, "load_columns": load_columns}
+        print(f"{name:<8} {results[name]['bytes'] / 1e6:>8.1f} MB  全部列 {load_all:>6.2f}s  分析列 {load_columns:>6.2f}s")
+
+    seconds, problems = _timed(lambda: delta_store.verify(csv_path, delta_dir))
+    print(f"校验 {seconds:.1f}s: " + ("; ".join(problems) if problems else "还原数据与CSV完全一致"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="变化编码存储基准测试")
+    parser.add_argument("--roads", type=int, default=1000, help="道路数")
+    parser.add_argument("--days", type=int, default=7, help="天数")
+    parser.add_argument("--hold-rate", type=float, default=0.8, help="沿用上一次快照数值的概率")
+    parser.add_argument("--workdir", default="bench_delta_data", help="临时数据目录")
+    args = parser.parse_args()
+    run_benchmark(args.roads, args.days, args.hold_rate, args.workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# bench_http_client.py
+# HTTP客户端基准测试：对比每次新建连接的 requests.get 与共享连接池客户端
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_amap_server import FakeAmapServer
+from http_client import AmapClient
+
+
+def _bare_get(url, params):
+    """改造前的调用方式：每次请求新建连接，失败不重试"""
+    return requests.get(url, params=params, timeout=10).json()
+
+
+def run_case(fetch, url, roads, workers):
+    """
+    :return: (耗时秒, 失败道路数)
+    """
+    def one(road):
+        try:
+            data = fetch(url, {"city": "福州市", "name": road, "extensions": "all"})
+            return data.get("status") == "1"
+        except Exception:
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        ok = list(executor.map(one, roads))
+    return time.perf_counter() - start, ok.count(False)
+
+
+def main(road_count=300, workers=8, latency=0.005):
+    roads = [f"测试路{i}" for i in range(road_count)]
+    print(f"道路数: {road_count}, 线程数: {workers}, 模拟延迟: {latency * 1000:.0f}ms")
+    print(f"{'故障率':>6} {'客户端':>10} {'耗时(s)':>9} {'失败数':>6} {'重试数':>6} {'新建连接':>8} {'复用连接':>8}")
+    for fail_rate, throttle_rate in ((0.0, 0.0), (0.05, 0.05)):
+        label = f"{(fail_rate + throttle_rate) * 100:.0f}%"
+        with FakeAmapServer(latency=latency, fail_rate=fail_rate, throttle_rate=throttle_rate) as fake:
+            url = f"{fake.url}/v3/traffic/status/road"
+            elapsed, failed = run_case(_bare_get, url, roads, workers)
+            print(f"{label:>6} {'requests':>10} {elapsed:>9.2f} {failed:>6} {0:>6} {road_count:>8} {0:>8}")
+
+            client = AmapClient(backoff_base=0.05, backoff_max=0.5)
+            elapsed, failed = run_case(client.get_json, url, roads, workers)
+            stats = client.stats()
+            print(f"{label:>6} {'pooled':>10} {elapsed:>9.2f} {failed:>6} {stats['retries']:>6} "
+                  f"{stats['connections_opened']:>8} {stats['connections_reused']:>8}")
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
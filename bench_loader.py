@@ -0,0 +1,81 @@
+# bench_loader.py
+# 数据读取基准测试：对比原始的 pd.read_csv 全量读取与分块流式聚合的峰值内存和耗时
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from synthetic_data import generate_csv
+
+
+def _peak_rss_mb():
+    # Linux 下 ru_maxrss 的单位是 KB，macOS 下是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(mode, path):
+    """在当前进程中执行一种读取方式，返回耗时和峰值内存"""
+    start = time.perf_counter()
+    if mode == "baseline":
+        # 改造前 load_data 的做法：推断类型、读取全部列
+        df = pd.read_csv(path)
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+        road_delay = df.groupby("road_name")["delay_index"].sum()
+        df["hour"] = df["timestamp"].dt.hour
+        hourly = df.groupby("hour")["delay_index"].sum()
+        rows = len(df)
+    else:
+        from streaming_loader import aggregate_traffic
+        aggregator = aggregate_traffic(path)
+        road_delay = aggregator.road_sum
+        hourly = aggregator.hour_sum
+        rows = aggregator.rows
+    return {
+        "mode": mode,
+        "rows": rows,
+        "seconds": round(time.perf_counter() - start, 2),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "road_total": round(float(road_delay.sum()), 2),
+        "hour_total": round(float(hourly.sum()), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据读取基准测试")
+    parser.add_argument("--file", default="bench_traffic.csv", help="测试用CSV文件，不存在时自动生成")
+    parser.add_argument("--roads", type=int, default=1000, help="生成数据的道路数")
+    parser.add_argument("--days", type=int, default=14, help="生成数据的天数")
+    parser.add_argument("--mode", choices=["baseline", "streaming"], help="只运行一种方式（内部使用）")
+    args = parser.parse_args()
+
+    if args.mode:
+        # 子进程：单独测量一种方式，保证峰值内存互不影响
+        print(json.dumps(run_mode(args.mode, args.file)))
+        return
+
+    if not os.path.exists(args.file):
+        print(f"正在生成合成数据 {args.file} ...")
+        rows = generate_csv(args.file, road_count=args.roads, days=args.days)
+        print(f"已生成 {rows} 条记录，文件大小 {os.path.getsize(args.file) / 1024 / 1024:.0f} MB")
+
+    results = []
+    for mode in ("baseline", "streaming"):
+        output = subprocess.run([sys.executable, __file__, "--file", args.file, "--mode", mode],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'方式':>10} {'记录数':>10} {'耗时(s)':>8} {'峰值内存(MB)':>12}")
+    for r in results:
+        print(f"{r['mode']:>10} {r['rows']:>10} {r['seconds']:>8} {r['peak_rss_mb']:>12}")
+    if results[0]["road_total"] != results[1]["road_total"] or results[0]["hour_total"] != results[1]["hour_total"]:
+        print("警告: 两种方式的统计结果不一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# bench_multi_city.py
+# 多城市、多 Key 采集基准测试：在本地模拟高德服务上测量城市数和 Key 数增加时的吞吐量，以及 Key 配额用完后的表现
+import os
+import tempfile
+import time
+
+import amap_api
+import road_fetcher
+from fake_amap_server import FakeAmapServer
+from multi_city import run_jobs
+
+
+def _use_fake_server(url):
+    """子进程初始化：把请求地址指向模拟服务"""
+    amap_api.BASE_URL = f"{url}/v3/traffic/status/road"
+    road_fetcher.BASE_URL = f"{url}/v3/place/text"
+
+
+def run_case(url, cities, keys, qps, daily_quota=None):
+    """
+    每个城市的道路数等于模拟服务的 total_roads（道路目录默认检索 ROAD_FETCH_PAGES 页）
+    :return: (耗时秒, 成功记录数, error 记录数)
+    """
+    jobs = [{"name": f"city{i}", "city": f"测试市{i}", "free_flow_speeds": None} for i in range(cities)]
+    key_list = [f"bench-key-{i}" for i in range(keys)]
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        summaries = run_jobs(jobs, key_list, processes=cities, qps=qps, daily_quota=daily_quota,
+                             usage_file=os.path.join(workdir, "key_usage.json"), backend="csv", root=workdir,
+                             initializer=_use_fake_server, initargs=(url,))
+        elapsed = time.perf_counter() - start
+    failed = [s for s in summaries if "error" in s]
+    assert not failed, failed
+    records = sum(s["records"] for s in summaries)
+    errors = sum(s["errors"] for s in summaries)
+    return elapsed, records - errors, errors
+
+
+def main():
+    roads_per_city, latency, qps = 500, 0.02, 50
+    print(f"每个城市 {roads_per_city} 条道路, 模拟延迟 {latency * 1000:.0f}ms, 每个 Key 限流 {qps} QPS")
+    with FakeAmapServer(latency=latency, segments=1, total_roads=roads_per_city) as fake:
+        print(f"\n{'城市数':>6} {'Key数':>6} {'耗时(s)':>9} {'成功记录':>8} {'记录/秒':>9} {'扩展比':>7}")
+        base = None
+        for cities, keys in ((1, 1), (2, 2), (4, 4), (4, 2)):
+            elapsed, ok, errors = run_case(fake.url, cities, keys, qps)
+            rate = ok / elapsed
+            base = base or rate
+            print(f"{cities:>6} {keys:>6} {elapsed:>9.2f} {ok:>8} {rate:>9.1f} {rate / base:>7.2f}")
+
+    # 每个 Key 只剩 300 次配额：模拟服务在 Key 超额后返回 10003，Key 池应停用该 Key 并转向其他 Key
+    with FakeAmapServer(latency=latency, segments=1, total_roads=roads_per_city, key_quota=300) as fake:
+        elapsed, ok, errors = run_case(fake.url, 2, 3, qps)
+        print(f"\n[Key 配额 300 次/Key, 2 个城市, 3 个 Key] 耗时 {elapsed:.2f}s, 成功 {ok}, error {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# bench_parallel.py
+# 并行分析基准测试：在合成数据上对比单进程分块聚合与多进程分片聚合的耗时，并校验合并结果与单进程完全一致
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+
+from parallel_analysis import aggregate_parallel, plan_shards
+from storage import migrate_csv
+from streaming_loader import aggregate_traffic
+from synthetic_data import generate_csv
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def check_same(expected, actual):
+    """
+    比较两个聚合器：记录数必须完全相同，总和允许浮点加法顺序带来的舍入差异
+    :return: 不一致的说明列表，一致时为空
+    """
+    problems = []
+    if expected.rows != actual.rows:
+        problems.append(f"记录数 {expected.rows} != {actual.rows}")
+    for name in ("road_sum", "road_count", "hour_sum", "hour_count", "time_sum"):
+        a, b = getattr(expected, name), getattr(actual, name)
+        if not a.index.equals(b.index):
+            b = b.reindex(a.index)
+        if name.endswith("_count"):
+            same = (a.to_numpy() == b.to_numpy()).all()
+        else:
+            same = np.allclose(a.to_numpy(), b.to_numpy(), rtol=1e-12, atol=1e-9)
+        if not same:
+            problems.append(f"{name} 不一致")
+    return problems
+
+
+def run_benchmark(road_count=1000, days=30, worker_counts=(1, 2, 4, 8, 16, 32), split_mb=64,
+                  workdir="bench_parallel_data"):
+    """
+    :param worker_counts: 需要测试的进程数，超过CPU核数的会跳过
+    :param split_mb: CSV 分片大小（MB）
+    :return: {存储: [(进程数, 耗时秒, 加速比)]}，进程数 0 表示现有的单进程分块聚合
+    """
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    csv_path = os.path.join(workdir, "traffic.csv")
+    parquet_dir = os.path.join(workdir, "traffic_data")
+    rows = generate_csv(csv_path, road_count=road_count, days=days)
+    migrate_csv(csv_path, parquet_dir)
+    cpus = os.cpu_count() or 1
+    print(f"{road_count} 条道路 × {days} 天，共 {rows} 条记录，CSV {os.path.getsize(csv_path) / 1e6:.0f} MB，CPU {cpus} 核")
+
+    split_bytes = split_mb * 1024 * 1024
+    results = {}
+    for name, path in (("csv", csv_path), ("parquet", parquet_dir)):
+        baseline_seconds, expected = _timed(lambda: aggregate_traffic(path))
+        shards = len(plan_shards(path, split_bytes=split_bytes))
+        print(f"\n[{name}] {shards} 个分片")
+        print(f"{'进程数':>6} {'耗时(s)':>10} {'加速比':>8}")
+        print(f"{'单进程':>6} {baseline_seconds:>10.2f} {1.0:>8.1f}")
+        results[name] = [(0, baseline_seconds, 1.0)]
+        for workers in worker_counts:
+            if workers > cpus:
+                continue
+            seconds, actual = _timed(lambda: aggregate_parallel(path, workers, split_bytes=split_bytes))
+            problems = check_same(expected, actual)
+            assert not problems, f"{name} {workers} 进程结果与单进程不一致: {problems}"
+            results[name].append((workers, seconds, baseline_seconds / seconds))
+            print(f"{workers:>6} {seconds:>10.2f} {baseline_seconds / seconds:>8.1f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行分析基准测试")
+    parser.add_argument("--roads", type=int, default=1000, help="道路数")
+    parser.add_argument("--days", type=int, default=30, help="天数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="需要测试的进程数")
+    parser.add_argument("--split-mb", type=int, default=64, help="CSV 分片大小（MB）")
+    parser.add_argument("--workdir", default="bench_parallel_data", help="临时数据目录")
+    args = parser.parse_args()
+    run_benchmark(args.roads, args.days, args.workers, args.split_mb, args.workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# bench_snapshot_memory.py
+# 快照内存基准测试：对比字典列表与 SnapshotFrame 保存同一批记录占用的内存（tracemalloc 统计），以及转换为 DataFrame 的耗时
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from fake_amap_server import fake_traffic_response
+from snapshot_frame import SnapshotFrame, new_pools
+from traffic_fetcher import parse_traffic_response
+
+
+def iter_records(count, segments=2):
+    """按采集时的方式生成记录：模拟响应经过 JSON 编码、解码后再解析，每条记录的字符串都是独立对象"""
+    produced = 0
+    road = 0
+    while produced < count:
+        data = json.loads(json.dumps(fake_traffic_response(f"测试路{road}", segments), ensure_ascii=False))
+        for record in parse_traffic_response(f"测试路{road}", data)[:count - produced]:
+            yield record
+            produced += 1
+        road += 1
+
+
+def retained_bytes(build):
+    """build() 返回的对象在垃圾回收后仍占用的内存（字节）"""
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return size, result
+
+
+def run_benchmark(count=10000, segments=2, snapshots=3):
+    """
+    :param count: 每次快照的记录数
+    :param snapshots: 快照数，驻留表只在第一次快照时增长，之后每次快照只占用数组
+    :return: {"dicts": 每次快照字节数, "frame": 首次快照字节数, "frame_next": 之后每次快照字节数, ...}
+    """
+    dict_bytes, records = retained_bytes(lambda: list(iter_records(count, segments)))
+    pools = new_pools()
+    frame_bytes, frame = retained_bytes(lambda: SnapshotFrame.from_records(iter_records(count, segments), pools))
+    next_bytes = [retained_bytes(lambda: SnapshotFrame.from_records(iter_records(count, segments), pools))[0]
+                  for _ in range(snapshots - 1)]
+
+    start = time.perf_counter()
+    SnapshotFrame.from_records(records, new_pools())
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    frame.to_frame()
+    frame_seconds = time.perf_counter() - start
+
+    per_10k = 10000 / count
+    return {
+        "records": count,
+        "dicts_bytes_per_10k": round(dict_bytes * per_10k),
+        "frame_bytes_per_10k": round(frame_bytes * per_10k),
+        "frame_next_bytes_per_10k": round(sum(next_bytes) / len(next_bytes) * per_10k) if next_bytes else None,
+        "array_bytes_per_10k": round(frame.nbytes * per_10k),
+        "build_seconds": round(build_seconds, 4),
+        "to_frame_seconds": round(frame_seconds, 6),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="快照内存基准测试")
+    parser.add_argument("--records", type=int, default=10000, help="每次快照的记录数")
+    parser.add_argument("--segments", type=int, default=2, help="每条道路的路段数")
+    parser.add_argument("--snapshots", type=int, default=3, help="共享驻留表的快照数")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.records, args.segments, args.snapshots)
+    dicts = result["dicts_bytes_per_10k"]
+    print("每 10000 条记录:")
+    print(f"  字典列表                  {dicts / 1024:>10.1f} KB")
+    print(f"  SnapshotFrame（首次快照）  {result['frame_bytes_per_10k'] / 1024:>10.1f} KB"
+          f"  节省 {1 - result['frame_bytes_per_10k'] / dicts:.0%}")
+    if result["frame_next_bytes_per_10k"] is not None:
+        print(f"  SnapshotFrame（之后每次）  {result['frame_next_bytes_per_10k'] / 1024:>10.1f} KB"
+              f"  节省 {1 - result['frame_next_bytes_per_10k'] / dicts:.0%}")
+    print(f"  其中类型数组               {result['array_bytes_per_10k'] / 1024:>10.1f} KB")
+    print(f"从字典列表构建 {result['build_seconds']:.3f} s，转换为 DataFrame {result['to_frame_seconds'] * 1000:.2f} ms")
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# bench_sqlite.py
+# SQLite 查询基准测试：在千万级合成数据上对比单条道路查询、时间窗口查询与 CSV 全量扫描的耗时
+import argparse
+import math
+import os
+import time
+
+import pandas as pd
+
+from sqlite_store import import_csv
+from streaming_loader import iter_chunks
+from synthetic_data import generate_csv, road_names
+from traffic_query import road_series, window_ranking, hourly_aggregate
+
+
+def _timed(fn, repeat=3):
+    """重复执行取最短耗时"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def csv_road_series(path, road, start, end):
+    """CSV 基线：分块扫描全部数据，筛选单条道路"""
+    parts = [chunk[chunk["road_name"] == road]
+             for chunk in iter_chunks(path, ["timestamp", "road_name", "direction", "speed", "status", "delay_index"],
+                                      start=start, end=end)]
+    return pd.concat(parts, ignore_index=True)
+
+
+def csv_window_ranking(path, start, end, n):
+    """CSV 基线：分块扫描全部数据，按道路求平均后排名"""
+    sums = None
+    counts = None
+    for chunk in iter_chunks(path, ["timestamp", "road_name", "delay_index"], start=start, end=end):
+        grouped = chunk.groupby(chunk["road_name"].astype("object"))["delay_index"]
+        sums = grouped.sum() if sums is None else sums.add(grouped.sum(), fill_value=0)
+        counts = grouped.count() if counts is None else counts.add(grouped.count(), fill_value=0)
+    return (sums / counts).nlargest(n)
+
+
+def csv_hourly(path, start, end):
+    """CSV 基线：分块扫描全部数据，按小时求和"""
+    total = None
+    for chunk in iter_chunks(path, ["timestamp", "delay_index"], start=start, end=end):
+        part = chunk.groupby(chunk["timestamp"].dt.hour)["delay_index"].sum()
+        total = part if total is None else total.add(part, fill_value=0)
+    return total
+
+
+def run_benchmark(rows=10_000_000, road_count=1000, workdir="bench_sqlite_data", start_day="2024-05-01", repeat=3):
+    """
+    :param rows: 目标记录数，按每条道路2个方向、每10分钟一次快照折算为天数
+    :param workdir: 存放合成CSV和数据库的目录，已存在时直接复用
+    :return: [(查询, CSV耗时, SQLite耗时, 返回行数)]
+    """
+    os.makedirs(workdir, exist_ok=True)
+    csv_path = os.path.join(workdir, "traffic.csv")
+    db_path = os.path.join(workdir, "traffic.db")
+    days = math.ceil(rows / (road_count * 2 * 144))
+    if not os.path.exists(csv_path):
+        started = time.perf_counter()
+        total = generate_csv(csv_path, road_count=road_count, days=days, start=start_day)
+        print(f"生成 {total} 条记录 {time.perf_counter() - started:.1f}s, CSV {os.path.getsize(csv_path) / 1e6:.0f} MB")
+    if not os.path.exists(db_path):
+        started = time.perf_counter()
+        total = import_csv(csv_path, db_path)
+        print(f"导入 SQLite {total} 条记录 {time.perf_counter() - started:.1f}s, "
+              f"数据库 {os.path.getsize(db_path) / 1e6:.0f} MB")
+
+    road = road_names(road_count)[road_count // 2]
+    first = pd.Timestamp(start_day)
+    day_start, day_end = first + pd.Timedelta(days=days // 2), first + pd.Timedelta(days=days // 2 + 1)
+    hour_start, hour_end = day_start + pd.Timedelta(hours=8), day_start + pd.Timedelta(hours=9)
+    week_end = day_start + pd.Timedelta(days=7)
+
+    cases = [
+        ("单条道路全部历史", lambda: csv_road_series(csv_path, road, None, None),
+         lambda: road_series(road, db=db_path)),
+        ("单条道路一天", lambda: csv_road_series(csv_path, road, day_start, day_end),
+         lambda: road_series(road, day_start, day_end, db=db_path)),
+        ("1小时窗口排名 TOP10", lambda: csv_window_ranking(csv_path, hour_start, hour_end, 10),
+         lambda: window_ranking(hour_start, hour_end, 10, db=db_path)),
+        ("一周按小时统计", lambda: csv_hourly(csv_path, day_start, week_end),
+         lambda: hourly_aggregate(day_start, week_end, db=db_path)),
+    ]
+    results = []
+    for name, csv_fn, sqlite_fn in cases:
+        # CSV 扫描每次耗时都很长，只执行一次
+        csv_seconds, _ = _timed(csv_fn, repeat=1)
+        sqlite_seconds, result = _timed(sqlite_fn, repeat=repeat)
+        results.append((name, csv_seconds, sqlite_seconds, len(result)))
+        print(f"{name:<20} CSV {csv_seconds:>8.2f}s  SQLite {sqlite_seconds * 1000:>9.1f}ms  "
+              f"({csv_seconds / sqlite_seconds:,.0f}x, {len(result)} 行)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 查询基准测试")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="目标记录数")
+    parser.add_argument("--roads", type=int, default=1000, help="道路数")
+    parser.add_argument("--workdir", default="bench_sqlite_data", help="数据目录（已存在时复用）")
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.roads, args.workdir)
+
+
+if __name__ == "__main__":
+    main()
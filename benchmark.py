@@ -0,0 +1,188 @@
+# benchmark.py
+# 全流程基准测试：用合成数据和本地模拟高德服务，对每个环节计时（可选 cProfile），结果输出为 JSON
+import argparse
+import cProfile
+import json
+import os
+import platform
+import pstats
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import amap_api
+import road_fetcher
+from csv_utils import save_to_csv
+from fake_amap_server import FakeAmapServer
+from road_delay_analysis import calculate_total_delay_index, create_minimalist_bar_chart, create_top_n_bar_chart
+from road_delay_analysis import load_data
+from synthetic_data import generate_csv
+from traffic_fetcher import fetch_fuzhou_traffic
+from traffic_trend_analysis import calculate_hourly_traffic_index, create_traffic_trend_chart, find_peak_hours
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class StageTimer:
+    """
+    对每个环节重复执行并计时
+    :param repeat: 每个环节的重复次数
+    :param profile_dir: 不为空时，对每个环节的第一次执行做 cProfile，并保存 .prof 文件
+    """
+
+    def __init__(self, repeat=3, profile_dir=None):
+        self.repeat = repeat
+        self.profile_dir = profile_dir
+        self.results = {}
+
+    def run(self, name, fn, setup=None, rows=None):
+        """
+        :param name: 环节名称
+        :param fn: 被测函数，返回值会传给 rows（用于统计处理的记录数）
+        :param setup: 每次执行前调用的准备函数（不计时）
+        :param rows: 根据 fn 的返回值计算记录数的函数
+        :return: 最后一次执行的返回值
+        """
+        timings = []
+        result = None
+        for i in range(self.repeat):
+            if setup is not None:
+                setup()
+            profiler = cProfile.Profile() if (self.profile_dir and i == 0) else None
+            start = time.perf_counter()
+            if profiler is not None:
+                profiler.enable()
+            result = fn()
+            if profiler is not None:
+                profiler.disable()
+            timings.append(time.perf_counter() - start)
+            if profiler is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+        entry = {
+            "seconds_min": round(min(timings), 4),
+            "seconds_median": round(statistics.median(timings), 4),
+            "runs": len(timings),
+        }
+        if rows is not None:
+            count = rows(result)
+            entry["rows"] = count
+            entry["rows_per_second"] = round(count / min(timings), 1) if min(timings) > 0 else None
+        if self.profile_dir:
+            stats = pstats.Stats(os.path.join(self.profile_dir, f"{name}.prof"))
+            entry["top_functions"] = [
+                f"{func[0]}:{func[1]}({func[2]}) {stat[3]:.4f}s"
+                for func, stat in sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:5]
+            ]
+        self.results[name] = entry
+        print(f"{name:<32} min {entry['seconds_min']:>9.4f}s  median {entry['seconds_median']:>9.4f}s")
+        return result
+
+
+def run_benchmark(roads=300, days=7, latency=0.02, workers=8, repeat=3, profile_dir=None, seed=0):
+    """
+    执行全部环节的基准测试
+    :param roads: 道路数 N
+    :param days: 合成历史数据的天数 D
+    :param latency: 模拟高德服务的延迟（秒）
+    :param workers: 采集并发线程数
+    :return: 结果字典
+    """
+    timer = StageTimer(repeat, profile_dir)
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeAmapServer(latency=latency, total_roads=roads) as fake:
+        amap_api.BASE_URL = f"{fake.url}/v3/traffic/status/road"
+        road_fetcher.BASE_URL = f"{fake.url}/v3/place/text"
+        pages = (roads + 49) // 50
+
+        road_list = timer.run("road_discovery", lambda: road_fetcher.fetch_roads_in_fuzhou(pages=pages), rows=len)
+        snapshot = timer.run("traffic_fetch", lambda: fetch_fuzhou_traffic(road_list, workers=workers, qps=0),
+                             rows=len)
+
+        append_path = os.path.join(workdir, "append.csv")
+
+        def reset_append():
+            if os.path.exists(append_path):
+                os.remove(append_path)
+
+        timer.run("csv_append", lambda: save_to_csv([dict(r) for r in snapshot], append_path),
+                  setup=reset_append, rows=lambda _: len(snapshot))
+
+        history_path = os.path.join(workdir, "history.csv")
+        total_rows = generate_csv(history_path, road_count=roads, days=days, seed=seed)
+        df = timer.run("load_data", lambda: load_data(history_path), rows=len)
+        road_delay = timer.run("calculate_total_delay_index", lambda: calculate_total_delay_index(df),
+                               rows=lambda _: len(df))
+        hourly = timer.run("calculate_hourly_traffic_index", lambda: calculate_hourly_traffic_index(df.copy()),
+                           rows=lambda _: len(df))
+
+        render_dir = os.path.join(workdir, "charts")
+        os.makedirs(render_dir, exist_ok=True)
+
+        def render_all():
+            create_minimalist_bar_chart(road_delay).render(os.path.join(render_dir, "full.html"))
+            create_top_n_bar_chart(road_delay, 10).render(os.path.join(render_dir, "top10.html"))
+            create_traffic_trend_chart(hourly, find_peak_hours(hourly, 3)).render(
+                os.path.join(render_dir, "trend.html"))
+            return sum(os.path.getsize(os.path.join(render_dir, f)) for f in os.listdir(render_dir))
+
+        html_bytes = timer.run("render", render_all)
+        timer.results["render"]["html_bytes"] = html_bytes
+
+    return {
+        "meta": {
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {"roads": roads, "days": days, "history_rows": total_rows, "latency": latency,
+                       "workers": workers, "repeat": repeat, "seed": seed},
+        },
+        "stages": timer.results,
+    }
+
+
+def compare(result, baseline_path):
+    """与之前保存的结果逐环节比较，打印耗时变化"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n与 {baseline_path}（{baseline['meta'].get('git_revision')}）比较:")
+    for name, entry in result["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None or not old["seconds_min"]:
+            continue
+        ratio = entry["seconds_min"] / old["seconds_min"]
+        print(f"{name:<32} {old['seconds_min']:>9.4f}s -> {entry['seconds_min']:>9.4f}s  ({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全流程基准测试")
+    parser.add_argument("--roads", type=int, default=300, help="道路数")
+    parser.add_argument("--days", type=int, default=7, help="合成历史数据天数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟高德服务延迟（秒）")
+    parser.add_argument("--workers", type=int, default=8, help="采集并发线程数")
+    parser.add_argument("--repeat", type=int, default=3, help="每个环节的重复次数")
+    parser.add_argument("--seed", type=int, default=0, help="合成数据随机种子")
+    parser.add_argument("--profile", default=None, help="保存 cProfile 结果的目录")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果JSON文件")
+    parser.add_argument("--baseline", default=None, help="用于比较的历史结果JSON文件")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.roads, args.days, args.latency, args.workers, args.repeat, args.profile, args.seed)
+    if args.baseline:
+        compare(result, args.baseline)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存至: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# chart_render.py
+# 大数据量图表渲染：长尾合并、分页、时间序列降采样（LTTB），以及基于内容哈希跳过重复渲染
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import RENDER_CACHE_FILE
+
+OTHERS_LABEL = "其他"
+
+
+def cap_top_n(df, n, value_column="delay_index", label_column="road_name", others_label=OTHERS_LABEL):
+    """
+    只保留数值最大的前 n 项，其余合并为一个"其他"项
+    :param df: 已按数值从高到低排序的 DataFrame
+    :param n: 保留的项数
+    :return: 最多 n + 1 行的 DataFrame
+    """
+    if n is None or len(df) <= n:
+        return df
+    head = df.head(n)
+    others = pd.DataFrame({label_column: [f"{others_label}({len(df) - n}条)"],
+                           value_column: [df[value_column].iloc[n:].sum()]})
+    return pd.concat([head[[label_column, value_column]], others], ignore_index=True)
+
+
+def paginate(df, page_size):
+    """
+    将 DataFrame 按固定行数分页
+    :return: [(页码(从1开始), 该页 DataFrame)]
+    """
+    return [(i // page_size + 1, df.iloc[i:i + page_size]) for i in range(0, len(df), page_size)]
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样，保留时间序列的峰谷形状
+    :param x: 横坐标（单调递增的数值数组，时间需先转为数值）
+    :param y: 纵坐标数组
+    :param threshold: 降采样后的点数
+    :return: 被保留的点的下标数组（包含首尾两点）
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    selected = np.empty(threshold, dtype="int64")
+    selected[0] = 0
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 下一个桶的平均点，作为三角形的第三个顶点
+        avg_start = int(np.floor((i + 1) * every)) + 1
+        avg_end = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+
+        # 当前桶内选出与上一个选中点、下一个桶平均点构成的三角形面积最大的点
+        start = int(np.floor(i * every)) + 1
+        end = int(np.floor((i + 1) * every)) + 1
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def downsample_series(df, x_column, y_column, max_points):
+    """
+    对 DataFrame 形式的时间序列做 LTTB 降采样
+    :param df: 按 x_column 排序的 DataFrame
+    :param max_points: 最多保留的点数
+    """
+    if max_points is None or len(df) <= max_points:
+        return df
+    x = df[x_column]
+    if pd.api.types.is_datetime64_any_dtype(x):
+        x = x.astype("int64")
+    return df.iloc[lttb(x.to_numpy(), df[y_column].to_numpy(), max_points)].reset_index(drop=True)
+
+
+def content_hash(*parts):
+    """
+    计算图表输入的内容哈希，DataFrame 按内容哈希，其他参数按 repr 哈希
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+            columns = part.columns if isinstance(part, pd.DataFrame) else [part.name]
+            digest.update(repr(list(columns)).encode("utf-8"))
+        else:
+            digest.update(repr(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load_cache(cache_file):
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_cache(cache, cache_file):
+    tmp_path = cache_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, cache_file)
+
+
+def render_if_changed(build_chart, output_file, *inputs, cache_file=RENDER_CACHE_FILE):
+    """
+    输入数据与上次渲染相同且输出文件仍存在时跳过渲染
+    :param build_chart: 无参函数，返回 pyecharts 图表对象（只在需要渲染时调用）
+    :param output_file: 输出的 HTML 文件
+    :param inputs: 决定图表内容的数据和参数，用于计算内容哈希
+    :return: True 表示重新渲染，False 表示跳过
+    """
+    key = content_hash(getattr(build_chart, "__name__", ""), *inputs)
+    cache = _load_cache(cache_file)
+    if cache.get(output_file) == key and os.path.exists(output_file):
+        return False
+    build_chart().render(output_file)
+    cache[output_file] = key
+    _save_cache(cache, cache_file)
+    return True
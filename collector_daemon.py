@@ -0,0 +1,97 @@
+# collector_daemon.py
+# 常驻采集进程：按整点对齐的时间间隔触发快照，上一次快照未结束时跳过或排队，收到 SIGTERM 后安全退出
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from config import COLLECT_INTERVAL_MINUTES, DAEMON_OVERLAP_POLICY
+
+
+def log(message):
+    """带时间戳输出日志，flush 保证重定向到文件时能及时看到"""
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+class CollectorDaemon:
+    """
+    :param snapshot_fn: 执行一次快照的函数
+    :param interval_minutes: 采集间隔（分钟），触发时间对齐到整点，例如 10 分钟间隔在 :00 :10 :20 ... 触发
+    :param overlap_policy: 上一次快照还在运行时新的触发如何处理: "skip" 跳过; "queue" 排队，结束后立即补采（最多排队一次）
+    """
+
+    def __init__(self, snapshot_fn, interval_minutes=COLLECT_INTERVAL_MINUTES, overlap_policy=DAEMON_OVERLAP_POLICY):
+        if overlap_policy not in ("skip", "queue"):
+            raise ValueError(f"未知的 overlap_policy: {overlap_policy}")
+        self.snapshot_fn = snapshot_fn
+        self.interval = interval_minutes * 60
+        self.overlap_policy = overlap_policy
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pending_tick = None
+        self.stats = {"ticks": 0, "snapshots": 0, "skipped": 0, "queued": 0, "failed": 0}
+
+    def next_tick(self, now=None):
+        """下一个对齐的触发时间（Unix 时间戳）"""
+        now = time.time() if now is None else now
+        return (int(now // self.interval) + 1) * self.interval
+
+    def stop(self, signum=None, frame=None):
+        if not self._stop.is_set():
+            log(f"收到退出信号 {signum}，等待当前快照完成后退出")
+        self._stop.set()
+
+    def _run_snapshot(self, tick):
+        while True:
+            started = time.time()
+            log(f"开始快照 tick={datetime.fromtimestamp(tick).strftime('%H:%M:%S')} 延迟 {started - tick:.2f}s")
+            try:
+                self.snapshot_fn()
+                self.stats["snapshots"] += 1
+                status = "完成"
+            except Exception as e:
+                self.stats["failed"] += 1
+                status = f"失败: {e}"
+                traceback.print_exc()
+            duration = time.time() - started
+            log(f"快照{status}，耗时 {duration:.2f}s（采集间隔 {self.interval}s）")
+            with self._lock:
+                # 运行期间有排队的触发，且尚未收到退出信号，则立即补采一次
+                tick, self._pending_tick = self._pending_tick, None
+                if tick is None or self._stop.is_set():
+                    self._worker = None
+                    return
+
+    def _on_tick(self, tick):
+        self.stats["ticks"] += 1
+        with self._lock:
+            if self._worker is not None:
+                if self.overlap_policy == "queue" and self._pending_tick is None:
+                    self._pending_tick = tick
+                    self.stats["queued"] += 1
+                    log("上一次快照仍在运行，本次触发已排队")
+                else:
+                    self.stats["skipped"] += 1
+                    log("上一次快照仍在运行，跳过本次触发")
+                return
+            self._worker = threading.Thread(target=self._run_snapshot, args=(tick,), name="snapshot")
+            self._worker.start()
+
+    def run(self):
+        """主循环，阻塞直到收到 SIGTERM/SIGINT"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        log(f"采集守护进程启动，间隔 {self.interval}s，重叠策略 {self.overlap_policy}")
+        while not self._stop.is_set():
+            tick = self.next_tick()
+            # Event.wait 在收到信号时会被 stop() 唤醒，无需等到下一次触发
+            if self._stop.wait(max(tick - time.time(), 0)):
+                break
+            self._on_tick(tick)
+
+        worker = self._worker
+        if worker is not None:
+            worker.join()
+        log(f"采集守护进程已退出，统计: {self.stats}")
@@ -24,3 +24,168 @@ FREE_FLOW_SPEEDS = {
     # 默认值
     "default": 50
 }
+
+# 并发采集配置
+# 同时请求交通路况的线程数，设为1则退化为逐条顺序请求
+FETCH_WORKERS = 8
+# 单个Key的QPS配额（请按高德控制台中的实际配额填写），设为 0 或 None 表示不限流
+AMAP_QPS = 50
+
+# HTTP客户端配置
+# 单次请求超时（秒）
+HTTP_TIMEOUT = 10
+# 连接池大小，应不小于 FETCH_WORKERS
+HTTP_POOL_SIZE = 32
+# 超时、5xx、限流类错误的最大重试次数
+HTTP_MAX_RETRIES = 3
+# 指数退避的基数和上限（秒），实际等待时间在 [0, min(上限, 基数*2^n)] 内随机
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 8
+# 单次快照的总耗时预算（秒），需小于定时任务间隔，防止多次运行堆积
+SNAPSHOT_DEADLINE = 540
+# 采集结果每凑满多少条道路就交给写入器写入一批，采集过程中内存里只保留少量未写入的结果
+SNAPSHOT_BATCH_SIZE = 200
+
+# 道路目录缓存配置
+# 道路名称缓存文件，采集时直接读取，避免每次都重新检索POI
+ROAD_CATALOG_FILE = "road_catalog.json"
+# 缓存有效期（小时），过期后下次采集会自动刷新
+ROAD_CATALOG_TTL_HOURS = 24 * 7
+# 刷新目录时检索的POI页数（每页最多50条）
+ROAD_FETCH_PAGES = 10
+# 是否合并指向同一条道路的POI名称（出入口、分段、括号说明等），每条道路每次快照只请求一次
+ROAD_DEDUP = True
+# 根据响应判定为重复的名称，超过此时间（小时）后重新请求一次以确认仍然重复
+ROAD_DEDUP_RECHECK_HOURS = 24
+
+# 按矩形区域采集（python main.py --tiles，见 tile_collector.py）配置
+# 采集模式: "road" 按道路名逐条请求; "tile" 用矩形网格覆盖 TILE_BBOX，每个矩形一次请求返回区域内全部路段
+COLLECT_MODE = "road"
+# 采集范围（左下经度, 左下纬度, 右上经度, 右上纬度），默认覆盖福州主城区
+TILE_BBOX = (119.15, 25.95, 119.45, 26.15)
+# 单个矩形对角线长度上限（公里），高德矩形区域接口限制为10公里
+TILE_MAX_DIAGONAL_KM = 10
+# 接口以参数错误拒绝矩形时四等分后重试，最多再分的层数
+TILE_MAX_SPLIT_DEPTH = 2
+
+# 数据存储配置
+# 存储后端: "csv" 追加写入单个CSV文件; "parquet" 按日期分区写入列式文件; "sqlite" 写入带索引的 SQLite 数据库;
+# "delta" 按日期分区、只写入数值有变化的记录
+STORAGE_BACKEND = "csv"
+# CSV 数据文件
+TRAFFIC_CSV_FILE = "fuzhou_traffic.csv"
+# 分区存储根目录，每天一个子目录 date=YYYY-MM-DD
+PARQUET_DIR = "traffic_data"
+# SQLite 数据库文件，以及每次 executemany 写入的行数
+SQLITE_FILE = "fuzhou_traffic.db"
+SQLITE_BATCH_SIZE = 5000
+# 变化编码存储根目录；每隔多少次快照写入一次完整的关键帧（每天第一次快照总是关键帧）；分区文件的压缩算法
+DELTA_DIR = "traffic_delta"
+DELTA_KEYFRAME_EVERY = 36
+DELTA_COMPRESSION = "zstd"
+
+# 增量汇总统计文件，采集时每次保存快照后更新，分析脚本优先读取
+ROLLUP_FILE = "traffic_rollup.json"
+
+# 拥堵立方体目录，按 (道路, 方向, 星期, 小时, 日期) 预先聚合，采集时增量更新，每天一个文件
+CUBE_DIR = "traffic_cube"
+
+# 分析脚本分块读取CSV时每块的行数，越小峰值内存越低
+LOADER_CHUNK_SIZE = 500000
+
+# 并行分析（见 parallel_analysis.py）配置
+# 扫描历史数据时的进程数，None 表示CPU核数，1 表示在当前进程中逐个分片计算
+ANALYSIS_WORKERS = None
+# CSV 按该字节数切分为分片；分区存储、变化编码存储和 SQLite 按天切分
+ANALYSIS_SPLIT_BYTES = 64 * 1024 * 1024
+
+# 常驻采集（python main.py --daemon）配置
+# 采集间隔（分钟），触发时间对齐到整点
+COLLECT_INTERVAL_MINUTES = 10
+# 上一次快照未结束时新的触发如何处理: "skip" 跳过; "queue" 排队，结束后立即补采
+DAEMON_OVERLAP_POLICY = "skip"
+
+# 在线异常检测（见 anomaly_detector.py）配置
+# 是否在采集时按道路、按星期几+小时检测延时指数异常
+ANOMALY_DETECTION = True
+# 指数加权均值/方差的权重，越大越快适应最近的数据（每个星期几+小时每周约有 60/COLLECT_INTERVAL_MINUTES 个样本）
+ANOMALY_ALPHA = 0.05
+# 偏离均值超过多少个标准差时报警（样本较少时标准差估计偏小，3.5 比 3 误报少很多）
+ANOMALY_Z_THRESHOLD = 3.5
+# 基线样本数达到该值后才开始报警（采集间隔10分钟时约3周）
+ANOMALY_MIN_SAMPLES = 18
+# 标准差下限，避免数据一直不变时微小波动也报警
+ANOMALY_MIN_STD = 0.05
+# 每条道路每个星期几+小时的均值、方差和样本数
+ANOMALY_STATE_FILE = "anomaly_state.json"
+# 报警记录，每次报警追加一行 JSON
+ANOMALY_ALERT_FILE = "anomaly_alerts.jsonl"
+
+# 实时拥堵排行榜（见 live_leaderboard.py）配置
+# 滑动窗口长度（分钟），每个窗口输出一个排行榜
+LEADERBOARD_WINDOWS = [30, 60]
+# 每个窗口输出平均延时指数最高的道路数
+LEADERBOARD_TOP_K = 10
+# 每次快照后覆盖写入的排行榜文件，设为 None 表示不输出
+LEADERBOARD_JSON_FILE = "leaderboard.json"
+LEADERBOARD_HTML_FILE = "leaderboard.html"
+# 窗口内的样本，定时任务每次启动新进程时从该文件接上之前的窗口
+LEADERBOARD_STATE_FILE = "leaderboard_state.json"
+
+# 数据看板（见 dashboard.py）配置
+# 看板目录：页面 index.html 和按需加载的 JSON 分片，设为 None 表示采集时不更新看板
+DASHBOARD_DIR = "dashboard"
+# 每天的道路排名每页的道路数
+DASHBOARD_PAGE_SIZE = 50
+
+# 自适应轮询配置（见 poll_scheduler.py）
+# 开启后每条道路按各自的间隔请求，未到时间的道路沿用上一次的数据（记录中带 sampled_at）
+POLL_ADAPTIVE = False
+# 请求间隔的上限（分钟），下限为采集间隔 COLLECT_INTERVAL_MINUTES
+POLL_MAX_INTERVAL_MINUTES = 60
+# 道路平均延时指数与上一次请求相比变化超过该值时，请求间隔减半
+POLL_CHANGE_THRESHOLD = 0.2
+# 任一路段 status 不低于该值（3=拥堵）时，请求间隔减半
+POLL_CONGESTED_STATUS = 3
+# 每天最多的请求次数，None 表示 AMAP_DAILY_QUOTA × Key 数
+POLL_DAILY_BUDGET = None
+# 每条道路的请求间隔和最近一次请求到的数据
+POLL_STATE_FILE = "poll_state.json"
+
+# 采集指标（python main.py --metrics）配置
+# 是否记录各环节耗时、请求延迟直方图、infocode 计数等指标，关闭时埋点几乎没有开销
+METRICS_ENABLED = False
+# 每次快照结束后覆盖写入的 Prometheus 文本文件（可供 node_exporter textfile collector 采集）
+METRICS_PROM_FILE = "metrics/collector.prom"
+# 每次快照追加一行 JSON 的文件
+METRICS_JSONL_FILE = "metrics/runs.jsonl"
+# 不为 None 时对每个环节做 cProfile，结果保存到该目录（python main.py --profile-stages DIR）
+METRICS_PROFILE_DIR = None
+# 请求延迟直方图的桶上界（秒）
+METRICS_LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# 图表渲染配置
+# 条形图最多显示的道路数，其余道路合并为"其他"
+CHART_MAX_BARS = 100
+# 完整道路列表分页渲染时每页的道路数
+CHART_PAGE_SIZE = 100
+# 时间序列折线图最多显示的点数，超出时按 LTTB 降采样
+CHART_MAX_POINTS = 2000
+# 记录每个图表上次渲染时输入内容的哈希，内容未变化时跳过渲染
+RENDER_CACHE_FILE = ".render_cache.json"
+
+# 多城市采集（python multi_city.py）配置
+# 多个 Key 组成的 Key 池，请求在各 Key 之间轮换，每个 Key 单独按 AMAP_QPS 限流；为空时只使用 AMAP_KEY
+AMAP_KEYS = []
+# 单个 Key 每日可调用的交通态势次数（请按高德控制台中的实际配额填写），设为 0 或 None 表示不统计
+AMAP_DAILY_QUOTA = 5000
+# 记录每个 Key 当日已用次数的文件，跨天自动清零
+KEY_USAGE_FILE = "key_usage.json"
+# 城市采集任务，每个城市使用独立的道路目录、自由流速度配置和数据目录（CITY_DATA_DIR/name/）
+# free_flow_speeds 为 None 时使用 FREE_FLOW_SPEEDS
+CITY_JOBS = [
+    {"name": "fuzhou", "city": "福州市", "free_flow_speeds": None},
+]
+CITY_DATA_DIR = "cities"
+# 同时采集的城市数（进程数）
+CITY_WORKERS = 4
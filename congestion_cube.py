@@ -0,0 +1,391 @@
+# congestion_cube.py
+# 拥堵立方体：按 (道路, 方向, 星期, 小时, 日期) 预先聚合 delay_index 和 speed，采集时增量更新，查询时无需读取原始数据
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import CUBE_DIR
+from storage import TIME_FORMAT, default_data_path, partition_dir, _write_parquet_atomic
+from streaming_loader import iter_chunks
+
+KEY_COLUMNS = ["date", "road_name", "direction", "weekday", "hour"]
+# 不区分日期时的键，用于把多天的单元合并为 (道路, 方向, 星期, 小时) 的典型周画像
+PROFILE_COLUMNS = ["road_name", "direction", "weekday", "hour"]
+# 原始数据中需要的列
+SOURCE_COLUMNS = ["timestamp", "road_name", "direction", "delay_index", "speed"]
+
+# p95 用定宽直方图估算，直方图可以跨单元直接相加，任意切片都能得到 p95，误差不超过一个桶宽
+# 桶 i 覆盖 [edges[i-1], edges[i])，第一个桶为小于 edges[0] 的值，最后一个桶为不小于 edges[-1] 的值
+BIN_EDGES = {
+    "delay_index": np.round(np.arange(1.0, 4.0001, 0.05), 2),
+    "speed": np.arange(0.0, 120.0001, 5.0),
+}
+METRICS = list(BIN_EDGES)
+WEEKDAY_NAMES = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+
+
+def _hist_columns(metric):
+    return [f"{metric}_h{i:02d}" for i in range(len(BIN_EDGES[metric]) + 1)]
+
+
+def _sum_columns():
+    columns = []
+    for metric in METRICS:
+        columns += [f"{metric}_count", f"{metric}_sum"] + _hist_columns(metric)
+    return columns
+
+
+def _empty_cells(keys=KEY_COLUMNS):
+    columns = keys + _sum_columns() + [f"{m}_{s}" for m in METRICS for s in ("min", "max")]
+    return pd.DataFrame(columns=columns)
+
+
+def _aggregate(cells, keys, metrics=METRICS):
+    """
+    按键分组合并单元：计数、总和、直方图相加，最小/最大值取极值
+    先按分组编号排序，再用 numpy reduceat 对整块数组一次性归约，避免 pandas 逐列分组
+    :param keys: 分组键，空列表表示全部合并为一行
+    """
+    sum_columns = [c for m in metrics for c in [f"{m}_count", f"{m}_sum"] + _hist_columns(m)]
+    min_columns = [f"{m}_min" for m in metrics]
+    max_columns = [f"{m}_max" for m in metrics]
+    if keys:
+        codes = cells.groupby(keys, observed=True, sort=False).ngroup().to_numpy()
+    else:
+        codes = np.zeros(len(cells), dtype="int64")
+    if len(cells) == 0:
+        return pd.DataFrame(columns=keys + sum_columns + min_columns + max_columns)
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+
+    result = cells[keys].iloc[order[starts]].reset_index(drop=True)
+
+    def reduce(ufunc, columns):
+        # 转置成按列连续存放，reduceat 沿连续内存归约更快
+        values = np.ascontiguousarray(cells[columns].to_numpy("float64")[order].T)
+        return ufunc.reduceat(values, starts, axis=1)
+
+    # fmin/fmax 忽略 NaN（某个单元没有速度数据时最小/最大值为 NaN）
+    reduced = np.vstack([reduce(np.add, sum_columns), reduce(np.fmin, min_columns), reduce(np.fmax, max_columns)])
+    values = pd.DataFrame(reduced.T, columns=sum_columns + min_columns + max_columns)
+    return pd.concat([result, values], axis=1)
+
+
+def cells_from_frame(df):
+    """
+    将原始记录聚合为立方体单元
+    :param df: 至少包含 SOURCE_COLUMNS 的 DataFrame 或记录列表，timestamp 可以是字符串
+    :return: 每个 (日期, 道路, 方向, 星期, 小时) 一行的 DataFrame
+    """
+    df = df if isinstance(df, pd.DataFrame) else pd.DataFrame(list(df), columns=SOURCE_COLUMNS)
+    if df.empty:
+        return _empty_cells()
+    timestamp = df["timestamp"]
+    if not pd.api.types.is_datetime64_any_dtype(timestamp):
+        timestamp = pd.to_datetime(timestamp, format=TIME_FORMAT)
+    keys = pd.DataFrame({
+        "date": timestamp.dt.strftime("%Y-%m-%d").to_numpy(),
+        # 请求失败的记录没有方向，用空字符串作为方向键
+        "road_name": df["road_name"].astype("object").fillna("").to_numpy(),
+        "direction": df["direction"].astype("object").fillna("").to_numpy(),
+        "weekday": timestamp.dt.weekday.to_numpy(),
+        "hour": timestamp.dt.hour.to_numpy(),
+    })
+
+    parts = []
+    for metric in METRICS:
+        values = pd.to_numeric(df[metric], errors="coerce").to_numpy("float64")
+        valid = ~np.isnan(values)
+        frame = keys[valid].assign(v=values[valid], bin=np.searchsorted(BIN_EDGES[metric], values[valid], "right"))
+        stats = frame.groupby(KEY_COLUMNS, sort=False)["v"].agg(["count", "sum", "min", "max"])
+        stats.columns = [f"{metric}_{name}" for name in stats.columns]
+        hist = frame.groupby(KEY_COLUMNS + ["bin"], sort=False).size().unstack("bin", fill_value=0)
+        hist = hist.reindex(columns=range(len(BIN_EDGES[metric]) + 1), fill_value=0)
+        hist.columns = _hist_columns(metric)
+        parts.append(stats.join(hist))
+
+    cells = pd.concat(parts, axis=1)
+    return _downcast(cells.reset_index())
+
+
+def _downcast(cells):
+    """计数和直方图用 int32 保存，单元数很多时内存占用减半"""
+    dtypes = {}
+    for metric in METRICS:
+        for column in [f"{metric}_count"] + _hist_columns(metric):
+            dtypes[column] = "int32"
+        dtypes[f"{metric}_sum"] = "float64"
+    filled = cells.fillna({column: 0 for column in dtypes})
+    return filled.astype(dtypes)
+
+
+def combine_cells(frames, keys=KEY_COLUMNS):
+    """合并多份单元，相同键的计数、总和、直方图相加，最小/最大值取极值"""
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return _empty_cells(keys)
+    if len(frames) == 1 and list(frames[0].columns[:len(keys)]) == keys:
+        return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    df["road_name"] = df["road_name"].astype("object")
+    df["direction"] = df["direction"].astype("object")
+    return _downcast(_aggregate(df, keys))
+
+
+def _cube_file(root, day):
+    return os.path.join(partition_dir(root, day), "cube.parquet")
+
+
+def read_day(root, day):
+    """读取某一天的单元，不存在时返回空表"""
+    path = _cube_file(root, day)
+    if not os.path.exists(path):
+        return _empty_cells()
+    return pd.read_parquet(path)
+
+
+def write_cells(cells, root=CUBE_DIR):
+    """按日期写入单元，每天一个文件，覆盖原有内容"""
+    for day, group in cells.groupby("date", sort=True):
+        os.makedirs(partition_dir(root, day), exist_ok=True)
+        group = group.reset_index(drop=True)
+        group["road_name"] = group["road_name"].astype("object")
+        group["direction"] = group["direction"].astype("object")
+        _write_parquet_atomic(group, _cube_file(root, day))
+
+
+def build_cube(data_path=None, root=CUBE_DIR):
+    """
+    从原始数据完整重建立方体（分块读取，内存占用取决于单元数而不是记录数）
+    :return: 处理的记录数
+    """
+    cells = _empty_cells()
+    rows = 0
+    for chunk in iter_chunks(data_path or default_data_path(), SOURCE_COLUMNS):
+        cells = combine_cells([cells, cells_from_frame(chunk)])
+        rows += len(chunk)
+    for path in glob.glob(os.path.join(root, "date=*", "cube.parquet")):
+        os.remove(path)
+    write_cells(cells, root)
+    return rows
+
+
+class CubeUpdate:
+    """
+    一次快照的立方体增量：每批记录保存后调用 add 聚合为单元并入增量，快照提交后调用 commit 合并到对应日期的文件
+    增量的行数只与本次快照涉及的 (道路, 方向) 数有关；快照保存失败时不调用 commit，立方体保持不变
+    :param root: 立方体目录
+    """
+
+    def __init__(self, root=CUBE_DIR):
+        self.root = root
+        self.cells = _empty_cells()
+
+    def add(self, records):
+        """聚合一批已保存（带 timestamp）的记录"""
+        self.cells = combine_cells([self.cells, cells_from_frame(records)])
+
+    def commit(self, data_path=None):
+        """
+        合并到对应日期的单元；立方体目录不存在而历史数据已存在时，先从历史数据重建一次（本次快照已包含在内）
+        :param data_path: 原始数据路径，用于首次重建
+        """
+        if not os.path.isdir(self.root):
+            data_path = data_path or default_data_path()
+            if os.path.exists(data_path):
+                build_cube(data_path, self.root)
+                return
+        for day, group in self.cells.groupby("date", sort=True):
+            write_cells(combine_cells([read_day(self.root, day), group]), self.root)
+
+
+def update_cube(records, data_path=None, root=CUBE_DIR):
+    """
+    保存一次快照后调用，把本次记录合并到对应日期的单元中（边采集边保存时用 CubeUpdate 逐批聚合）
+    :param records: 本次快照（已保存、带 timestamp）的记录
+    """
+    update = CubeUpdate(root)
+    update.add(records)
+    update.commit(data_path)
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def histogram_quantile(hist, edges, q, low, high):
+    """
+    按直方图估算分位数，桶内线性插值，并限制在观测到的最小/最大值之间
+    :param hist: (组数, 桶数) 计数数组
+    :param edges: 桶边界
+    :param low: 每组的最小值，用于第一个桶的下界
+    :param high: 每组的最大值，用于最后一个桶的上界
+    :return: 每组的分位数估计，没有数据的组为 NaN
+    """
+    hist = np.asarray(hist, dtype="float64")
+    counts = hist.sum(axis=1)
+    cumulative = np.cumsum(hist, axis=1)
+    rank = q * counts
+    index = np.minimum((cumulative < rank[:, None]).sum(axis=1), hist.shape[1] - 1)
+    rows = np.arange(len(hist))
+    lower = np.concatenate([[np.nan], edges])[index]
+    upper = np.concatenate([edges, [np.nan]])[index]
+    lower = np.where(np.isnan(lower), low, lower)
+    upper = np.where(np.isnan(upper), high, upper)
+    before = np.where(index > 0, cumulative[rows, np.maximum(index - 1, 0)], 0.0)
+    in_bin = hist[rows, index]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(in_bin > 0, (rank - before) / in_bin, 1.0)
+        estimate = np.clip(lower + (upper - lower) * fraction, low, high)
+    return np.where(counts > 0, estimate, np.nan)
+
+
+class CongestionCube:
+    """
+    载入内存的拥堵立方体，支持按任意维度筛选和分组
+    :param cells: 单元 DataFrame（见 cells_from_frame）
+    """
+
+    def __init__(self, cells=None):
+        cells = _empty_cells() if cells is None else cells
+        cells = cells.reset_index(drop=True)
+        for column in ("date", "road_name", "direction"):
+            if column in cells.columns:
+                cells[column] = cells[column].astype("category")
+        for column in ("weekday", "hour"):
+            cells[column] = cells[column].astype("int8")
+        self.cells = cells
+
+    @classmethod
+    def load(cls, root=CUBE_DIR, start=None, end=None, keep_dates=True):
+        """
+        载入日期范围内的单元
+        :param start: 起始日期（含）
+        :param end: 结束日期（不含）
+        :param keep_dates: False 时逐天合并为 (道路, 方向, 星期, 小时) 单元，内存占用与历史天数无关，但不能再按日期筛选
+        """
+        start_day = pd.Timestamp(start).strftime("%Y-%m-%d") if start is not None else None
+        end_day = pd.Timestamp(end).strftime("%Y-%m-%d") if end is not None else None
+        frames = []
+        pending = []
+        for path in sorted(glob.glob(os.path.join(root, "date=*", "cube.parquet"))):
+            day = os.path.basename(os.path.dirname(path))[len("date="):]
+            if (start_day is None or day >= start_day) and (end_day is None or day < end_day):
+                pending.append(pd.read_parquet(path))
+                if not keep_dates and len(pending) >= 7:
+                    # 每读入一周合并一次，内存中最多保留一周的按日单元
+                    frames = [combine_cells(frames + pending, PROFILE_COLUMNS)]
+                    pending = []
+        if not keep_dates and pending:
+            frames = [combine_cells(frames + pending, PROFILE_COLUMNS)]
+        elif keep_dates:
+            frames = pending
+        if not frames:
+            return cls(_empty_cells(KEY_COLUMNS if keep_dates else PROFILE_COLUMNS))
+        return cls(pd.concat(frames, ignore_index=True))
+
+    def _select(self, road=None, direction=None, weekday=None, hour=None, start=None, end=None):
+        cells = self.cells
+        mask = np.ones(len(cells), dtype=bool)
+        for column, value in (("road_name", road), ("direction", direction), ("weekday", weekday), ("hour", hour)):
+            values = _as_list(value)
+            if values is not None:
+                mask &= cells[column].isin(values).to_numpy()
+        if (start is not None or end is not None) and "date" not in cells.columns:
+            raise ValueError("立方体载入时已合并日期（keep_dates=False），不能按日期筛选")
+        if start is not None:
+            mask &= (cells["date"].astype("object") >= pd.Timestamp(start).strftime("%Y-%m-%d")).to_numpy()
+        if end is not None:
+            mask &= (cells["date"].astype("object") < pd.Timestamp(end).strftime("%Y-%m-%d")).to_numpy()
+        return cells[mask]
+
+    def query(self, metric="delay_index", by=("hour",), q=0.95, **filters):
+        """
+        切片查询
+        :param metric: "delay_index" 或 "speed"
+        :param by: 分组维度，取自 date（keep_dates=True 时）/road_name/direction/weekday/hour，空表示汇总为一行
+        :param q: 分位数
+        :param filters: road、direction、weekday、hour（单个值或列表），start、end（日期范围，end 不含）
+        :return: DataFrame，列为分组维度和 count、sum、mean、p95、min、max
+        """
+        by = list(by)
+        cells = self._select(**filters)
+        hist_columns = _hist_columns(metric)
+        sums = _aggregate(cells, by, [metric])
+        if by:
+            sums = sums.sort_values(by)
+        sums = sums[sums[f"{metric}_count"] > 0]
+
+        result = sums[by].reset_index(drop=True)
+        count = sums[f"{metric}_count"].to_numpy("float64")
+        total = sums[f"{metric}_sum"].to_numpy("float64")
+        low = sums[f"{metric}_min"].to_numpy("float64")
+        high = sums[f"{metric}_max"].to_numpy("float64")
+        result["count"] = count.astype("int64")
+        result["sum"] = total
+        result["mean"] = total / count
+        result[f"p{int(round(q * 100))}"] = histogram_quantile(
+            sums[hist_columns].to_numpy(), BIN_EDGES[metric], q, low, high)
+        result["min"] = low
+        result["max"] = high
+        return result
+
+    def road_delay(self, stat="sum", **filters):
+        """与 calculate_total_delay_index 结果一致（stat="sum"）：每条道路的拥堵指数，从高到低排序"""
+        df = self.query("delay_index", by=["road_name"], **filters)
+        df = df[["road_name", stat]].rename(columns={stat: "delay_index"})
+        df["road_name"] = df["road_name"].astype("object")
+        return df.sort_values("delay_index", ascending=False).reset_index(drop=True)
+
+    def hourly_delay(self, stat="sum", **filters):
+        """与 calculate_hourly_traffic_index 结果一致（stat="sum"）：每小时的拥堵指数，按小时排序"""
+        df = self.query("delay_index", by=["hour"], **filters)
+        df = df[["hour", stat]].rename(columns={stat: "delay_index"})
+        df["hour"] = df["hour"].astype(int)
+        return df.reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="拥堵立方体管理与查询")
+    parser.add_argument("command", choices=["rebuild", "query"], help="rebuild: 从原始数据重建; query: 切片查询")
+    parser.add_argument("--data", default=None, help="原始数据路径（CSV文件、分区目录或SQLite数据库）")
+    parser.add_argument("--root", default=CUBE_DIR, help="立方体目录")
+    parser.add_argument("--metric", default="delay_index", choices=METRICS, help="查询的指标")
+    parser.add_argument("--by", default="hour", help="分组维度，逗号分隔，例如 weekday,hour；为空表示汇总")
+    parser.add_argument("--road", action="append", default=None, help="道路名（可重复）")
+    parser.add_argument("--direction", action="append", default=None, help="方向（可重复）")
+    parser.add_argument("--weekday", type=int, action="append", default=None, help="星期，0=周一（可重复）")
+    parser.add_argument("--hour", type=int, action="append", default=None, help="小时（可重复）")
+    parser.add_argument("--start", default=None, help="起始日期（含）")
+    parser.add_argument("--end", default=None, help="结束日期（不含）")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        started = time.perf_counter()
+        rows = build_cube(args.data, args.root)
+        print(f"已从 {rows} 条记录重建立方体 {args.root}，耗时 {time.perf_counter() - started:.2f}s")
+        return
+
+    started = time.perf_counter()
+    by = [column for column in args.by.split(",") if column]
+    keep_dates = "date" in by or args.start is not None or args.end is not None
+    cube = CongestionCube.load(args.root, keep_dates=keep_dates)
+    loaded = time.perf_counter()
+    result = cube.query(args.metric, by=by, road=args.road, direction=args.direction, weekday=args.weekday,
+                        hour=args.hour, start=args.start, end=args.end)
+    finished = time.perf_counter()
+    if "weekday" in result.columns:
+        result["weekday"] = [WEEKDAY_NAMES[day] for day in result["weekday"]]
+    print(result.to_string(index=False))
+    print(f"\n载入 {len(cube.cells)} 个单元 {loaded - started:.3f}s，查询 {(finished - loaded) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
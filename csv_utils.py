@@ -1,21 +1,312 @@
 # csv_utils.py
+# CSV 文件写入：每次快照整体提交，整次快照使用同一个时间戳；写入中途崩溃时自动回滚，读取方看不到写了一半的快照
 import csv
+import fcntl
+import io
+import json
 import os
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
 
-def save_to_csv(data, filename="fuzhou_traffic.csv"):
+import metrics
+
+# CSV 字段列表，delay_index、free_flow_speed 和 sampled_at 为后续新增字段
+# sampled_at 为该记录实际请求到的时间，为空表示就是本次快照请求的（见 poll_scheduler）
+FIELDNAMES = ["timestamp", "road_name", "direction", "speed", "status", "description", "delay_index", "free_flow_speed",
+              "sampled_at"]
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# 写入缓冲区大小，一次快照通常只在提交时落盘一次
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def journal_path(filename):
+    """快照写入期间存在的日志文件，记录写入前的文件长度"""
+    return filename + ".journal"
+
+
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def committed_size(filename):
+    """
+    已提交数据的字节数：有快照正在写入（或上次写入中途崩溃）时为写入前的长度，否则为 None（整个文件都已提交）
+    """
+    try:
+        with open(journal_path(filename), encoding="utf-8") as f:
+            return json.load(f)["offset"]
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError):
+        # 日志本身是先写临时文件再重命名的，不会出现写了一半的日志；格式不对时按未提交处理
+        return 0
+
+
+@contextmanager
+def csv_lock(filename):
+    """
+    CSV 文件的写锁，同一个文件同时只允许一个快照写入（或回填），否则回滚时会截掉另一方写入的数据
+    也用作分区存储、变化编码存储目录的写锁（见 store_lock）
+    """
+    with open(filename + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def store_lock(root):
+    """
+    分区存储、变化编码存储目录的写锁，锁文件在目录旁边（<目录>.lock），回填交换目录时锁仍然有效
+    写入快照、合并小文件、回填都需要持有；同一进程内不能嵌套获取
+    """
+    return csv_lock(os.path.normpath(root))
+
+
+def read_header(filename):
+    """CSV 文件的表头，文件不存在或为空时返回 None"""
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return None
+    with open(filename, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), None)
+
+
+def upgrade_csv(filename):
+    """
+    为旧CSV文件补上后续新增的字段（追加到表头末尾，已有记录的新字段为空），写入临时文件后替换原文件
+    :return: 补上的字段列表
+    """
+    with csv_lock(filename):
+        recover_csv(filename)
+        return _upgrade_locked(filename)
+
+
+def _upgrade_locked(filename):
+    """upgrade_csv 的实现，调用方需持有写锁并已回滚未完成的快照"""
+    header = read_header(filename)
+    missing = [name for name in FIELDNAMES if header is not None and name not in header]
+    if not missing:
+        return []
+    tmp_path = filename + ".upgrade.tmp"
+    try:
+        with open(filename, newline="", encoding="utf-8") as src, \
+                open(tmp_path, "w", newline="", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst)
+            writer.writerow(next(reader) + missing)
+            padding = [""] * len(missing)
+            for row in reader:
+                writer.writerow(row + padding)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, filename)
+        _fsync_dir(filename)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return missing
+
+
+def recover_csv(filename):
+    """
+    回滚上次中途崩溃的快照：截断到写入前的长度并删除日志（需持有写锁）
+    :return: 是否进行了回滚
+    """
+    offset = committed_size(filename)
+    if offset is None:
+        return False
+    if os.path.exists(filename) and os.path.getsize(filename) > offset:
+        with open(filename, "r+b") as f:
+            f.truncate(offset)
+            os.fsync(f.fileno())
+    os.remove(journal_path(filename))
+    _fsync_dir(filename)
+    return True
+
+
+def _committed_limit(f, filename):
+    """
+    已打开的文件 f 中可以读取的字节数：文件长度与快照写入前长度中较小的一个
+    先取长度、后读日志时，取长度时正在写入、读日志前已提交的快照会被当作已提交，长度中可能含有它写了一半的数据；
+    因此在取长度的前后各读一次日志：取长度时正在写入的快照在此之前已写好日志，由第一次发现；
+    之后才开始的写入由第二次发现，它的写入前长度不小于取到的文件长度
+    文件先打开再取长度，补表头等整体替换文件的操作不会让读取方读到新旧两个文件拼起来的内容
+    """
+    before = committed_size(filename)
+    size = os.fstat(f.fileno()).st_size
+    after = committed_size(filename)
+    return min([size] + [offset for offset in (before, after) if offset is not None])
+
+
+class _RangeReader(io.RawIOBase):
+    """只读取已打开的二进制文件 f 从 start 开始的 limit 个字节，关闭时一起关闭 f"""
+
+    def __init__(self, f, limit, start=0):
+        self._file = f
+        self._file.seek(start)
+        self._remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        data = self._file.read(size)
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_committed(filename):
+    """
+    以二进制方式打开CSV文件，只能读到已提交的快照，供 pandas.read_csv 使用
+    """
+    f = open(filename, "rb")
+    try:
+        limit = _committed_limit(f, filename)
+    except BaseException:
+        f.close()
+        raise
+    return io.BufferedReader(_RangeReader(f, limit))
+
+
+def open_range(filename, byte_range):
+    """以二进制方式打开CSV文件的 [start, end) 字节范围（由 split_csv 给出，不含表头），供并行读取"""
+    start, end = byte_range
+    return io.BufferedReader(_RangeReader(open(filename, "rb"), end - start, start))
+
+
+def split_csv(filename, split_bytes):
+    """
+    把CSV文件中已提交的数据按大约 split_bytes 字节切分为多个范围，每个范围都从行首开始、不含表头
+    按换行符对齐，要求字段中没有换行（采集写入的字段都不含换行）
+    :return: [(start, end)]，文件只有表头时为空列表
+    """
+    ranges = []
+    with open(filename, "rb") as f:
+        size = _committed_limit(f, filename)
+        f.readline()
+        position = min(f.tell(), size)
+        while position < size:
+            f.seek(min(position + max(split_bytes, 1), size))
+            if f.tell() < size:
+                # 切分点落在行中间时移动到下一行行首
+                f.seek(f.tell() - 1)
+                f.readline()
+            end = min(f.tell(), size)
+            ranges.append((position, end))
+            position = end
+    return ranges
+
+
+class CsvSnapshotWriter:
+    """
+    一次快照的CSV写入器，记录可以分批写入，提交时统一落盘
+    写入前先记录文件长度到日志（fsync），提交时 flush + fsync 数据后再删除日志；
+    中途异常或进程崩溃时，文件会被截断回写入前的长度（异常时立即回滚，崩溃时由下一次写入回滚）
+    用法:
+        with CsvSnapshotWriter("fuzhou_traffic.csv") as writer:
+            for batch in batches:
+                writer.write(batch)
+    :param filename: CSV 文件
+    :param timestamp: 快照时间戳，默认取创建写入器的时间，整次快照的所有记录使用同一个值
+    """
+
+    def __init__(self, filename="fuzhou_traffic.csv", timestamp=None):
+        self.filename = filename
+        self.timestamp = timestamp or datetime.now().strftime(TIME_FORMAT)
+        self.snapshot_id = datetime.strptime(self.timestamp, TIME_FORMAT).strftime("%Y%m%d%H%M%S")
+        self.rows = 0
+        # open 时为旧文件补上的字段
+        self.upgraded = []
+        self._locked = None
+        self._file = None
+        self._writer = None
+        self._offset = 0
+
+    def open(self):
+        """获取写锁并写入日志；中途出错时释放写锁，已写入的日志由下一次写入回滚"""
+        with ExitStack() as stack:
+            stack.enter_context(csv_lock(self.filename))
+            recover_csv(self.filename)
+            # 旧文件缺少后续新增的字段（如 sampled_at）时先补上表头，否则这些字段会被静默丢弃
+            self.upgraded = _upgrade_locked(self.filename)
+            self._offset = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+            tmp_path = journal_path(self.filename) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"snapshot_id": self.snapshot_id, "timestamp": self.timestamp, "offset": self._offset}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, journal_path(self.filename))
+            _fsync_dir(self.filename)
+
+            # 已有文件按原表头追加
+            header = read_header(self.filename) if self._offset else None
+            self._file = stack.enter_context(
+                open(self.filename, mode="a", newline="", encoding="utf-8", buffering=WRITE_BUFFER_SIZE))
+            self._writer = csv.DictWriter(self._file, fieldnames=header or FIELDNAMES, extrasaction="ignore")
+            if self._offset == 0:
+                self._writer.writeheader()
+            # 成功后由 commit/rollback 关闭文件、释放写锁
+            self._locked = stack.pop_all()
+        return self
+
+    def write(self, records):
+        """写入一批记录，时间戳统一为快照时间戳（同时写回记录，方便后续统计使用）"""
+        for record in records:
+            record["timestamp"] = self.timestamp
+        self._writer.writerows(records)
+        self.rows += len(records)
+
+    def commit(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        size = os.path.getsize(self.filename)
+        os.remove(journal_path(self.filename))
+        _fsync_dir(self.filename)
+        self._release()
+        if metrics.active() is not None:
+            metrics.inc("storage_rows_written_total", self.rows, backend="csv")
+            metrics.inc("storage_bytes_written_total", size - self._offset, backend="csv")
+
+    def rollback(self):
+        self._file.close()
+        recover_csv(self.filename)
+        self._release()
+
+    def _release(self):
+        self._locked.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+def save_to_csv(data, filename="fuzhou_traffic.csv", timestamp=None):
     """
-    将交通数据保存为 CSV 文件
+    将交通数据保存为 CSV 文件，整次快照使用同一个时间戳
     :param data: 交通数据列表
     :param filename: 输出文件名
+    :param timestamp: 快照时间戳，默认取当前时间
     """
-    file_exists = os.path.isfile(filename)
-    with open(filename, mode="a", newline="", encoding="utf-8") as f:
-        # 更新字段列表，添加delay_index和free_flow_speed
-        fieldnames = ["timestamp", "road_name", "direction", "speed", "status", "description", "delay_index", "free_flow_speed"]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        for row in data:
-            row["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            writer.writerow(row)
\ No newline at end of file
+    with CsvSnapshotWriter(filename, timestamp) as writer:
+        writer.write(data)
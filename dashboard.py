@@ -0,0 +1,437 @@
+# dashboard.py
+# 数据看板：一个静态页面按需加载预先计算好的小 JSON 分片（每天的小时序列、每条道路每月的序列、每天的排名分页），
+# 采集时只更新本次快照涉及的分片，页面加载和更新的开销与历史数据总量无关
+import argparse
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from config import DASHBOARD_DIR, DASHBOARD_PAGE_SIZE
+from storage import TIME_FORMAT, default_data_path
+from streaming_loader import iter_chunks
+
+SOURCE_COLUMNS = ["timestamp", "road_name", "delay_index"]
+INDEX_FILE = "index.json"
+
+
+def _read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_if_changed(path, content):
+    """
+    内容与已有文件相同时不写入，否则先写临时文件再替换
+    :return: 是否写入
+    """
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if f.read() == content:
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _write_json(path, data):
+    return _write_if_changed(path, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+
+
+def day_path(root, day):
+    return os.path.join(root, "days", f"{day}.json")
+
+
+def road_path(root, road_id, month):
+    # 文件名用道路编号，道路名中可能有不能作为文件名的字符
+    return os.path.join(root, "roads", str(road_id), f"{month}.json")
+
+
+def ranking_path(root, day, page):
+    return os.path.join(root, "ranking", day, f"page_{page:03d}.json")
+
+
+def _empty_hours():
+    return [[0.0, 0] for _ in range(24)]
+
+
+def _add(pair, total, count):
+    # 延时指数只有两位小数，总和保留6位即可，分片更小，增量累加与重建的结果也一致
+    pair[0] = round(pair[0] + float(total), 6)
+    pair[1] += int(count)
+
+
+def frame_parts(df):
+    """
+    把一批记录（DataFrame）汇总为各分片的增量，只统计 delay_index 有效的记录（与汇总统计一致）
+    :param df: 包含 timestamp（datetime）、road_name、delay_index 列
+    :return: {"day_hours", "day_roads", "road_hours", "timeline"}，每项为带 sum、count 列的 DataFrame
+    """
+    delay = pd.to_numeric(df["delay_index"], errors="coerce")
+    valid = delay.notna() & df["road_name"].notna()
+    frame = pd.DataFrame({
+        "date": df["timestamp"][valid].dt.strftime("%Y-%m-%d"),
+        "hour": df["timestamp"][valid].dt.hour,
+        "time": df["timestamp"][valid].dt.strftime(TIME_FORMAT),
+        "road": df["road_name"][valid].astype("object"),
+        "delay": delay[valid],
+    })
+
+    def agg(keys):
+        return frame.groupby(keys, sort=False)["delay"].agg(["sum", "count"])
+
+    return {
+        "day_hours": agg(["date", "hour"]),
+        "day_roads": agg(["date", "road"]),
+        "road_hours": agg(["road", "date", "hour"]),
+        "timeline": agg(["date", "time"]),
+    }
+
+
+def _rows(frame):
+    """逐行返回 (索引, 总和, 记录数)，比 iterrows 快得多"""
+    return zip(frame.index, frame["sum"].tolist(), frame["count"].tolist())
+
+
+def _combine(parts_list):
+    """合并多批 frame_parts 的结果"""
+    combined = {}
+    for name in parts_list[0]:
+        frame = pd.concat([parts[name] for parts in parts_list])
+        combined[name] = frame.groupby(level=list(range(frame.index.nlevels)), sort=False).sum()
+    return combined
+
+
+class Dashboard:
+    """
+    看板分片目录：
+        index.json                      日期列表、道路编号表、每天的排名页数、已累加的最后一次快照时间（applied）
+        days/<日期>.json                 每小时 [总和, 记录数]、每次快照 [总和, 记录数]、每条道路当天的 [总和, 记录数]
+        roads/<道路编号>/<年-月>.json      该道路当月每天每小时的 [总和, 记录数]
+        ranking/<日期>/page_NNN.json     当天按拥堵指数总和排名的一页道路
+        index.html                      看板页面（不含数据）
+    """
+
+    def __init__(self, root=DASHBOARD_DIR, page_size=DASHBOARD_PAGE_SIZE):
+        self.root = root
+        self.page_size = page_size
+        self.index = _read_json(os.path.join(root, INDEX_FILE)) or {"updated": None, "applied": None, "days": [],
+                                                                   "roads": [], "pages": {}}
+        self._road_ids = {name: i for i, name in enumerate(self.index["roads"])}
+        self.written = 0
+
+    def road_id(self, name):
+        """道路编号，新道路追加到编号表末尾，已有道路的编号不变"""
+        road_id = self._road_ids.get(name)
+        if road_id is None:
+            road_id = self._road_ids[name] = len(self.index["roads"])
+            self.index["roads"].append(name)
+        return road_id
+
+    def apply(self, parts):
+        """把 frame_parts 的增量累加到对应的分片，只读写涉及的日期和道路"""
+        days = {}
+        for (day, hour), total, count in _rows(parts["day_hours"]):
+            shard = days.get(day)
+            if shard is None:
+                shard = days[day] = _read_json(day_path(self.root, day)) or {
+                    "date": day, "hours": _empty_hours(), "timeline": {}, "roads": {}}
+            _add(shard["hours"][int(hour)], total, count)
+        for (day, time), total, count in _rows(parts["timeline"]):
+            _add(days[day]["timeline"].setdefault(time, [0.0, 0]), total, count)
+        for (day, road), total, count in _rows(parts["day_roads"]):
+            _add(days[day]["roads"].setdefault(str(self.road_id(road)), [0.0, 0]), total, count)
+
+        months = {}
+        for (road, day, hour), total, count in _rows(parts["road_hours"]):
+            key = (self.road_id(road), day[:7])
+            shard = months.get(key)
+            if shard is None:
+                shard = months[key] = _read_json(road_path(self.root, *key)) or {
+                    "road_name": road, "month": key[1], "days": {}}
+            _add(shard["days"].setdefault(day, _empty_hours())[int(hour)], total, count)
+
+        for day, shard in days.items():
+            self.written += _write_json(day_path(self.root, day), shard)
+            self.written += self._write_ranking(day, shard)
+        for (road_id, month), shard in months.items():
+            self.written += _write_json(road_path(self.root, road_id, month), shard)
+
+        self.index["days"] = sorted(set(self.index["days"]) | set(days))
+        if days:
+            latest = max(max(shard["timeline"], default="") for shard in days.values())
+            self.index["updated"] = max(self.index["updated"] or "", latest) or None
+        return self.save()
+
+    def save(self):
+        """写入 index.json 和页面，放在分片之后写，页面不会读到还不存在的分片"""
+        self.written += _write_json(os.path.join(self.root, INDEX_FILE), self.index)
+        self.written += _write_if_changed(os.path.join(self.root, "index.html"), DASHBOARD_HTML)
+        return self
+
+    def _write_ranking(self, day, shard):
+        """重写当天的排名分页，内容未变化的页不写入，多余的旧页删除"""
+        names = self.index["roads"]
+        rows = sorted(((names[int(road_id)], int(road_id), total, count)
+                       for road_id, (total, count) in shard["roads"].items()), key=lambda row: (-row[2], row[0]))
+        pages = max((len(rows) + self.page_size - 1) // self.page_size, 1)
+        written = 0
+        for page in range(1, pages + 1):
+            page_rows = rows[(page - 1) * self.page_size:page * self.page_size]
+            written += _write_json(ranking_path(self.root, day, page), {
+                "date": day, "page": page, "pages": pages,
+                "rows": [{"rank": (page - 1) * self.page_size + i + 1, "road_id": road_id, "road_name": name,
+                          "sum": round(total, 4), "count": count, "mean": round(total / count, 4) if count else None}
+                         for i, (name, road_id, total, count) in enumerate(page_rows)],
+            })
+        old_pages = self.index["pages"].get(day, 0)
+        for page in range(pages + 1, old_pages + 1):
+            path = ranking_path(self.root, day, page)
+            if os.path.exists(path):
+                os.remove(path)
+        self.index["pages"][day] = pages
+        return written
+
+    def update(self, records):
+        """
+        累加一次快照（已保存、带 timestamp）的记录
+        不晚于 index.json 中 applied 的记录已经累加过（重建时已包含本次快照、保存后重复调用等），跳过
+        """
+        if not records:
+            return self
+        df = pd.DataFrame(records, columns=SOURCE_COLUMNS)
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIME_FORMAT)
+        applied = self.index.get("applied")
+        if applied:
+            df = df[df["timestamp"] > pd.Timestamp(applied)]
+        if df.empty:
+            return self
+        self.index["applied"] = df["timestamp"].max().strftime(TIME_FORMAT)
+        return self.apply(frame_parts(df))
+
+
+def load_timeline(root=DASHBOARD_DIR):
+    """
+    从每天的分片读取每次快照的拥堵指数总和，按时间排序
+    :return: DataFrame，列为 timestamp、delay_index；看板不存在时为空
+    """
+    index = _read_json(os.path.join(root, INDEX_FILE)) if root else None
+    points = {}
+    for day in (index or {}).get("days", []):
+        shard = _read_json(day_path(root, day))
+        if shard:
+            points.update(shard["timeline"])
+    times = sorted(points)
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(times, format=TIME_FORMAT),
+        "delay_index": [points[time][0] for time in times],
+    })
+
+
+def build_dashboard(data_path=None, root=DASHBOARD_DIR, page_size=DASHBOARD_PAGE_SIZE):
+    """根据全部历史数据重建看板分片（分块读取，先清空目录）"""
+    data_path = data_path or default_data_path()
+    parts = []
+    applied = None
+    for chunk in iter_chunks(data_path, SOURCE_COLUMNS):
+        parts.append(frame_parts(chunk))
+        latest = chunk["timestamp"].max()
+        if not pd.isna(latest):
+            applied = latest if applied is None else max(applied, latest)
+    shutil.rmtree(root, ignore_errors=True)
+    dashboard = Dashboard(root, page_size)
+    dashboard.index["applied"] = None if applied is None else applied.strftime(TIME_FORMAT)
+    return dashboard.apply(_combine(parts)) if parts else dashboard.save()
+
+
+class DashboardUpdate:
+    """
+    一次快照的看板增量：每批记录保存后调用 add 汇总为分片增量（frame_parts），快照提交后调用 commit 累加到分片
+    增量只与本次快照涉及的道路数有关；快照保存失败时不调用 commit，看板保持不变
+    :param root: 看板目录
+    """
+
+    def __init__(self, root=DASHBOARD_DIR):
+        self.root = root
+        self.parts = None
+        self.latest = None
+
+    def add(self, records):
+        """汇总一批已保存（带 timestamp）的记录"""
+        if not records:
+            return
+        df = pd.DataFrame(records, columns=SOURCE_COLUMNS)
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIME_FORMAT)
+        parts = frame_parts(df)
+        self.parts = parts if self.parts is None else _combine([self.parts, parts])
+        latest = df["timestamp"].max()
+        self.latest = latest if self.latest is None else max(self.latest, latest)
+
+    def commit(self, data_path=None):
+        """
+        累加到本次快照所在日期、所在月份的分片；本次快照不晚于 index.json 中的 applied 时已经累加过，跳过
+        看板目录不存在而历史数据已存在时，先从历史数据重建一次（已包含本次快照）
+        """
+        data_path = data_path or default_data_path()
+        if not os.path.exists(os.path.join(self.root, INDEX_FILE)) and os.path.exists(data_path):
+            return build_dashboard(data_path, self.root)
+        dashboard = Dashboard(self.root)
+        applied = dashboard.index.get("applied")
+        if self.parts is None or (applied and self.latest <= pd.Timestamp(applied)):
+            return dashboard
+        dashboard.index["applied"] = self.latest.strftime(TIME_FORMAT)
+        return dashboard.apply(self.parts)
+
+
+def update_dashboard(records, data_path=None, root=DASHBOARD_DIR):
+    """
+    采集程序在每次保存快照后调用，只更新本次快照所在日期、所在月份的分片（边采集边保存时用 DashboardUpdate 逐批汇总）
+    看板目录不存在而历史数据已存在时，先从历史数据重建一次（已包含本次快照）
+    """
+    data_path = data_path or default_data_path()
+    if not os.path.exists(os.path.join(root, INDEX_FILE)) and os.path.exists(data_path):
+        return build_dashboard(data_path, root)
+    return Dashboard(root).update(records)
+
+
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>福州交通拥堵看板</title>
+<script src="https://assets.pyecharts.org/assets/v5/echarts.min.js"></script>
+<style>
+body{font-family:sans-serif;margin:24px;color:#333}
+.chart{width:100%;max-width:1000px;height:360px}
+table{border-collapse:collapse;min-width:600px}
+th,td{border-bottom:1px solid #ddd;padding:4px 12px;text-align:left}
+th{background:#f5f5f5}
+tr.road{cursor:pointer}
+tr.road:hover{background:#f0f5ff}
+</style>
+</head>
+<body>
+<h2>福州交通拥堵看板</h2>
+<div>日期 <select id="day"></select> 数据更新至 <span id="updated">-</span></div>
+<div id="hourly" class="chart"></div>
+<div id="timeline" class="chart"></div>
+<h3>当天道路拥堵指数排名
+  <button id="prev">上一页</button> <span id="page"></span> <button id="next">下一页</button></h3>
+<table><thead><tr><th>排名</th><th>道路</th><th>拥堵指数总和</th><th>平均</th><th>记录数</th></tr></thead>
+<tbody id="ranking"></tbody></table>
+<h3 id="road-title"></h3>
+<div id="road-hourly" class="chart"></div>
+<div id="road-daily" class="chart"></div>
+<script>
+// 分片只在查看时加载，同一页面内加载过的分片不再重复请求
+const cache = {};
+function load(path, fresh) {
+  if (fresh || !cache[path]) {
+    cache[path] = fetch(path, {cache: fresh ? "no-store" : "default"}).then(function (r) {
+      if (!r.ok) throw new Error(path + " " + r.status);
+      return r.json();
+    });
+  }
+  return cache[path];
+}
+function chart(id) { return echarts.getInstanceByDom(document.getElementById(id)) || echarts.init(document.getElementById(id)); }
+function bar(id, title, labels, values) {
+  chart(id).setOption({title: {text: title}, tooltip: {trigger: "axis"}, xAxis: {type: "category", data: labels},
+                       yAxis: {type: "value"}, series: [{type: "bar", data: values}]}, true);
+}
+function line(id, title, labels, values) {
+  chart(id).setOption({title: {text: title}, tooltip: {trigger: "axis"}, xAxis: {type: "category", data: labels},
+                       yAxis: {type: "value"}, dataZoom: [{type: "inside"}], series: [{type: "line", showSymbol: false, data: values}]}, true);
+}
+const hours = Array.from({length: 24}, function (_, h) { return h + "时"; });
+const round = function (v) { return Math.round(v * 100) / 100; };
+let index = null, day = null, page = 1, road = null;
+
+function showDay() {
+  load("days/" + day + ".json", day === index.days[index.days.length - 1]).then(function (shard) {
+    bar("hourly", day + " 每小时拥堵指数总和", hours, shard.hours.map(function (p) { return round(p[0]); }));
+    const times = Object.keys(shard.timeline).sort();
+    line("timeline", day + " 每次快照拥堵指数总和", times.map(function (t) { return t.slice(11, 16); }),
+         times.map(function (t) { return round(shard.timeline[t][0]); }));
+  });
+  showPage(1);
+  if (road !== null) showRoad(road);
+}
+function showPage(n) {
+  const pages = index.pages[day] || 1;
+  page = Math.min(Math.max(n, 1), pages);
+  document.getElementById("page").textContent = "第 " + page + "/" + pages + " 页";
+  const path = "ranking/" + day + "/page_" + String(page).padStart(3, "0") + ".json";
+  load(path, day === index.days[index.days.length - 1]).then(function (data) {
+    const body = document.getElementById("ranking");
+    body.innerHTML = "";
+    data.rows.forEach(function (row) {
+      const tr = document.createElement("tr");
+      tr.className = "road";
+      [row.rank, row.road_name, round(row.sum), row.mean === null ? "-" : round(row.mean), row.count].forEach(function (v) {
+        const td = document.createElement("td");
+        td.textContent = v;
+        tr.appendChild(td);
+      });
+      tr.onclick = function () { showRoad(row.road_id); };
+      body.appendChild(tr);
+    });
+  });
+}
+function showRoad(id) {
+  road = id;
+  const month = day.slice(0, 7);
+  load("roads/" + id + "/" + month + ".json", month === index.days[index.days.length - 1].slice(0, 7)).then(function (shard) {
+    document.getElementById("road-title").textContent = shard.road_name;
+    const today = shard.days[day] || [];
+    bar("road-hourly", shard.road_name + " " + day + " 每小时拥堵指数总和", hours,
+        hours.map(function (_, h) { return today[h] ? round(today[h][0]) : 0; }));
+    const dates = Object.keys(shard.days).sort();
+    line("road-daily", shard.road_name + " " + month + " 每天拥堵指数总和", dates,
+         dates.map(function (d) { return round(shard.days[d].reduce(function (s, p) { return s + p[0]; }, 0)); }));
+  }).catch(function () {
+    document.getElementById("road-title").textContent = index.roads[id] + "（" + month + " 无数据）";
+  });
+}
+
+load("index.json", true).then(function (data) {
+  index = data;
+  document.getElementById("updated").textContent = index.updated || "-";
+  const select = document.getElementById("day");
+  index.days.slice().reverse().forEach(function (d) {
+    const option = document.createElement("option");
+    option.value = option.textContent = d;
+    select.appendChild(option);
+  });
+  select.onchange = function () { day = select.value; showDay(); };
+  document.getElementById("prev").onclick = function () { showPage(page - 1); };
+  document.getElementById("next").onclick = function () { showPage(page + 1); };
+  if (index.days.length) { day = index.days[index.days.length - 1]; showDay(); }
+});
+</script>
+</body>
+</html>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据看板分片")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="根据全部历史数据重建看板分片")
+    rebuild.add_argument("--data", default=None, help="数据路径，默认按 STORAGE_BACKEND 选择")
+    rebuild.add_argument("--root", default=DASHBOARD_DIR, help="看板目录")
+    args = parser.parse_args()
+
+    dashboard = build_dashboard(args.data, args.root)
+    print(f"已生成 {len(dashboard.index['days'])} 天、{len(dashboard.index['roads'])} 条道路的看板分片"
+          f"（{dashboard.written} 个文件）: {args.root}/index.html")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+# delta_store.py
+# 变化编码存储：每个道路/方向只在数值变化时写入一条记录，定期写入完整的关键帧；
+# 描述文字存入字典表、记录中只保存编号，分区文件使用 zstd 压缩。读取时还原出与 CSV 完全相同的逐快照数据
+import argparse
+import glob
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from config import DELTA_DIR, DELTA_KEYFRAME_EVERY, DELTA_COMPRESSION, TRAFFIC_CSV_FILE
+from csv_utils import FIELDNAMES, open_committed, store_lock
+import storage
+
+DICTIONARY_FILE = "descriptions.parquet"
+STATE_FILE = "state.parquet"
+PART_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+# 同一次快照中道路名和方向都相同的记录（例如同一道路多个方向都请求失败）用 seq 区分
+KEY_COLUMNS = ["road_name", "direction", "seq"]
+# sampled_at 只有沿用的记录才有值（本次快照请求的为空），每次快照都请求的道路不会因此产生变化记录
+VALUE_COLUMNS = ["speed", "status", "description", "delay_index", "free_flow_speed", "sampled_at"]
+# tick 区分同一秒内的多次快照（0 为该秒的第一次），快照由 (timestamp, tick) 确定；旧的 part 文件没有该列，按 0 处理
+EVENT_COLUMNS = ["timestamp", "tick", "kind"] + KEY_COLUMNS + VALUE_COLUMNS
+
+# 事件类型
+KEYFRAME = "K"  # 关键帧：该次快照的全部记录，之前的状态全部作废
+CHANGE = "C"    # 数值变化或新出现的道路/方向
+GONE = "D"      # 该道路/方向在这次快照中不再出现
+SNAPSHOT = "S"  # 快照标记：每次快照一条，即使没有任何变化也记录采集时间
+
+
+def is_delta(path):
+    """目录中有描述字典表时视为变化编码存储"""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, DICTIONARY_FILE))
+
+
+def _write_atomic(df, path):
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, index=False, compression=DELTA_COMPRESSION)
+    os.replace(tmp_path, path)
+
+
+def load_dictionary(root=DELTA_DIR):
+    """读取描述字典表，返回按编号排列的文字列表"""
+    path = os.path.join(root, DICTIONARY_FILE)
+    if not os.path.exists(path):
+        return []
+    return pd.read_parquet(path)["description"].tolist()
+
+
+def encode_descriptions(values, dictionary, root=DELTA_DIR):
+    """
+    把描述文字转换为字典编号，新出现的文字追加到字典表（只追加，已有编号不变）
+    :param values: 描述文字序列
+    :param dictionary: 当前字典（会被原地追加）
+    :return: int32 编号数组，缺失值为 -1
+    """
+    values = pd.Series(values, dtype="string").reset_index(drop=True)
+    present = values.notna().to_numpy()
+    texts = values[present].astype(object)
+    codes = np.full(len(values), -1, dtype="int32")
+    known = pd.Index(dictionary, dtype=object)
+    found = known.get_indexer(texts)
+    new = pd.unique(texts[found < 0])
+    if len(new) or not os.path.exists(os.path.join(root, DICTIONARY_FILE)):
+        dictionary.extend(new)
+        os.makedirs(root, exist_ok=True)
+        _write_atomic(pd.DataFrame({"description": pd.Series(dictionary, dtype="string")}),
+                      os.path.join(root, DICTIONARY_FILE))
+        found = pd.Index(dictionary, dtype=object).get_indexer(texts)
+    codes[present] = found
+    return codes
+
+
+def _with_seq(df):
+    df = df.reset_index(drop=True)
+    df["seq"] = df.groupby(["timestamp", "road_name", "direction"], dropna=False, observed=True).cumcount()
+    df["seq"] = df["seq"].astype("int32")
+    return df
+
+
+def _group_ids(df):
+    """
+    按 (road_name, direction, seq) 编号，编号顺序为首次出现的顺序
+    用 category 编码组合成整数再 factorize，比按多列字符串分组快得多
+    """
+    key = np.zeros(len(df), dtype="int64")
+    for column in ("road_name", "direction"):
+        values = df[column]
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype("category")
+        key = key * (len(values.cat.categories) + 1) + values.cat.codes.to_numpy().astype("int64") + 1
+    seq = df["seq"].to_numpy().astype("int64")
+    key = key * (int(seq.max(initial=0)) + 1) + seq
+    return pd.factorize(key)[0]
+
+
+def _differs(a, b):
+    """逐行比较两组记录的数值列（按位置对齐），两边都缺失视为相同"""
+    differs = np.zeros(len(a), dtype=bool)
+    for column in VALUE_COLUMNS:
+        x = a[column].reset_index(drop=True)
+        y = b[column].reset_index(drop=True)
+        missing = x.isna().to_numpy() & y.isna().to_numpy()
+        if column == "status":
+            same = (x.astype("string") == y.astype("string")).fillna(False).to_numpy(dtype=bool)
+        else:
+            same = x.to_numpy() == y.to_numpy()
+        differs |= ~(same | missing)
+    return differs
+
+
+def _events(df, kind, timestamp=None):
+    """整理为统一列类型的事件表"""
+    events = df.reindex(columns=EVENT_COLUMNS).reset_index(drop=True)
+    if timestamp is not None:
+        events["timestamp"] = timestamp
+    events["timestamp"] = pd.to_datetime(events["timestamp"])
+    if kind is not None:
+        events["kind"] = kind
+    for column in ("kind", "road_name", "direction", "status"):
+        events[column] = events[column].astype("string").astype("category")
+    events["seq"] = events["seq"].fillna(0).astype("int32")
+    events["tick"] = events["tick"].fillna(0).astype("int32")
+    events["description"] = events["description"].fillna(-1).astype("int32")
+    for column in ("speed", "delay_index", "free_flow_speed"):
+        events[column] = events[column].astype("float64")
+    events["sampled_at"] = pd.to_datetime(events["sampled_at"])
+    return events
+
+
+def _part_path(root, timestamp):
+    """
+    :return: (part 文件路径, tick)；同一秒内的第 n 次快照（n 从 0 开始）文件名加后缀 -n，tick 为 n
+    """
+    directory = storage.partition_dir(root, timestamp.strftime("%Y-%m-%d"))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{timestamp.strftime(PART_TIME_FORMAT)}.parquet")
+    tick = 0
+    while os.path.exists(path):
+        # 同一秒内的两次快照
+        tick += 1
+        path = os.path.join(directory, f"part-{timestamp.strftime(PART_TIME_FORMAT)}-{tick}.parquet")
+    return path, tick
+
+
+def _last_snapshot(root):
+    """最新 part 文件的快照时间（从文件名解析，不读取文件内容），没有数据时返回 None"""
+    partitions = storage.list_partitions(root)
+    if not partitions:
+        return None
+    files = sorted(os.path.basename(path) for path in glob.glob(os.path.join(partitions[-1], "part-*.parquet")))
+    if not files:
+        return None
+    return pd.Timestamp(datetime.strptime(files[-1][len("part-"):len("part-") + 14], PART_TIME_FORMAT))
+
+
+def _load_state(root, timestamp):
+    """
+    读取上一次快照的状态
+    状态与最新 part 文件不一致（例如上次写入中途中断）或已跨天时返回 None，本次写入关键帧
+    :return: (状态 DataFrame 或 None, 上次快照距关键帧的快照数)
+    """
+    path = os.path.join(root, STATE_FILE)
+    if not os.path.exists(path):
+        return None, 0
+    state = pd.read_parquet(path)
+    if state.empty:
+        return None, 0
+    if "sampled_at" not in state.columns:
+        state["sampled_at"] = pd.NaT
+    last = state["timestamp"].iloc[0]
+    if last != _last_snapshot(root) or last.date() != timestamp.date():
+        return None, 0
+    return state, int(state["position"].iloc[0])
+
+
+def _save_state(current, root, timestamp, position):
+    state = _events(current, None).drop(columns=["kind", "tick"])
+    state["timestamp"] = pd.Timestamp(timestamp)
+    state["position"] = position
+    _write_atomic(state, os.path.join(root, STATE_FILE))
+
+
+def save_delta_snapshot(records, root=DELTA_DIR, timestamp=None, keyframe_every=DELTA_KEYFRAME_EVERY):
+    """
+    将一次快照写入变化编码存储：与上一次快照相比只写入有变化的记录
+    写入顺序为 字典表 -> part 文件 -> 状态文件，中途中断时下一次快照会自动写入关键帧
+    :param keyframe_every: 每隔多少次快照写入一次关键帧
+    :return: 写入的 part 文件路径
+    """
+    timestamp = timestamp or datetime.now().strftime(storage.TIME_FORMAT)
+    storage.stamp_records(records, timestamp)
+    timestamp = pd.Timestamp(timestamp)
+    current = _with_seq(storage.to_typed_frame(records))
+    # 持有存储目录的写锁，与回填、合并小文件互斥
+    with store_lock(root):
+        storage.recover_backfill(root)
+        return _save_locked(current, root, timestamp, keyframe_every)
+
+
+def _save_locked(current, root, timestamp, keyframe_every):
+    os.makedirs(root, exist_ok=True)
+    current["description"] = encode_descriptions(current["description"], load_dictionary(root), root)
+
+    previous, position = _load_state(root, timestamp)
+    position += 1
+    if previous is None or position >= keyframe_every:
+        position = 0
+        parts = [_events(current, KEYFRAME)]
+    else:
+        merged = current.merge(previous, on=KEY_COLUMNS, how="outer", suffixes=("", "_prev"), indicator=True)
+        both = (merged["_merge"] == "both").to_numpy()
+        previous_values = merged[[f"{column}_prev" for column in VALUE_COLUMNS]]
+        previous_values.columns = VALUE_COLUMNS
+        changed = (merged["_merge"] == "left_only").to_numpy() | (both & _differs(merged, previous_values))
+        gone = (merged["_merge"] == "right_only").to_numpy()
+        parts = [_events(merged[changed], CHANGE, timestamp), _events(merged.loc[gone, KEY_COLUMNS], GONE, timestamp)]
+    parts.insert(0, _events(pd.DataFrame({"timestamp": [timestamp]}), SNAPSHOT))
+
+    path, tick = _part_path(root, timestamp)
+    events = pd.concat(parts, ignore_index=True)
+    events["tick"] = np.int32(tick)
+    _write_atomic(events, path)
+    _save_state(current, root, timestamp, position)
+    return path
+
+
+def _encode_day(df, dictionary, root, keyframe_every):
+    """
+    把一天的逐快照记录批量编码为事件表（迁移和回填使用），结果与逐次调用 save_delta_snapshot 相同
+    :return: (事件表, 最后一次快照的记录, 最后一次快照距关键帧的快照数)
+    """
+    df = _with_seq(df)
+    df["description"] = encode_descriptions(df["description"], dictionary, root)
+    times = df["timestamp"].to_numpy()
+    snapshots = np.unique(times)
+    index = np.searchsorted(snapshots, times)
+    group = _group_ids(df)
+    order = np.lexsort((index, group))
+    df, index, group = df.iloc[order].reset_index(drop=True), index[order], group[order]
+
+    same_group = group[1:] == group[:-1]
+    # 与同一道路/方向的上一条记录是相邻两次快照
+    follows = np.r_[False, same_group & (index[1:] == index[:-1] + 1)]
+    keyframe = index % keyframe_every == 0
+    differs = np.r_[True, _differs(df.iloc[1:], df.iloc[:-1])]
+    emit = keyframe | ~follows | differs
+    # 下一次快照中不再出现，且下一次快照不是关键帧时，需要写入 D
+    gone = ~np.r_[follows[1:], False] & (index + 1 < len(snapshots)) & ((index + 1) % keyframe_every != 0)
+
+    parts = [
+        _events(pd.DataFrame({"timestamp": snapshots}), SNAPSHOT),
+        _events(df[emit], np.where(keyframe[emit], KEYFRAME, CHANGE)),
+        _events(df.loc[gone, KEY_COLUMNS], GONE, snapshots[index[gone] + 1]),
+    ]
+    events = pd.concat(parts, ignore_index=True).sort_values("timestamp", kind="stable").reset_index(drop=True)
+    last = df[index == len(snapshots) - 1]
+    return events, last, (len(snapshots) - 1) % keyframe_every
+
+
+def write_frame(df, root=DELTA_DIR, keyframe_every=DELTA_KEYFRAME_EVERY):
+    """
+    批量写入多天的逐快照记录，每天生成一个 part 文件
+    需按日期顺序调用，同一天的数据要在一次调用中写入
+    :return: 写入的 part 文件路径列表
+    """
+    df = storage.to_typed_frame(df)
+    os.makedirs(root, exist_ok=True)
+    dictionary = load_dictionary(root)
+    paths = []
+    for day, group in df.groupby(df["timestamp"].dt.strftime("%Y-%m-%d"), sort=True):
+        events, last, position = _encode_day(group, dictionary, root, keyframe_every)
+        timestamp = events["timestamp"].iloc[-1]
+        path, _ = _part_path(root, timestamp)
+        _write_atomic(events, path)
+        _save_state(last, root, timestamp, position)
+        paths.append(path)
+    return paths
+
+
+def decode(events, dictionary, columns=None):
+    """
+    把事件表还原为逐快照记录
+    每条 K/C 事件的取值一直有效，直到同一道路/方向的下一条事件或下一个关键帧
+    快照按 (timestamp, tick) 区分，同一秒内的多次快照不会合并
+    :param columns: 需要的列，None 表示全部
+    :return: 与 storage.to_typed_frame 类型相同的 DataFrame，按快照时间排序
+    """
+    if "tick" not in events.columns:
+        events = events.assign(tick=np.int32(0))
+    events = events.sort_values(["timestamp", "tick"], kind="stable").reset_index(drop=True)
+    kind = events["kind"].to_numpy(dtype=object)
+    times = events["timestamp"].to_numpy()
+    # 每条事件所属快照的序号：(timestamp, tick) 排序后的名次
+    _, rank = np.unique(np.c_[times.astype("int64"), events["tick"].to_numpy().astype("int64")], axis=0,
+                        return_inverse=True)
+    rank = rank.reshape(-1)
+    marker = np.flatnonzero(kind == SNAPSHOT)
+    snapshots, first = np.unique(rank[marker], return_index=True)
+    snapshot_times = times[marker[first]]
+    keyframes = np.searchsorted(snapshots, np.unique(rank[kind == KEYFRAME]))
+
+    rows = events[kind != SNAPSHOT].reset_index(drop=True)
+    start = np.searchsorted(snapshots, rank[kind != SNAPSHOT])
+    group = _group_ids(rows)
+    order = np.lexsort((start, group))
+    start, group = start[order], group[order]
+
+    last_of_group = np.r_[group[1:] != group[:-1], True]
+    next_event = np.where(last_of_group, len(snapshots), np.r_[start[1:], 0])
+    next_keyframe = np.r_[keyframes, len(snapshots)][np.searchsorted(keyframes, start, side="right")]
+    end = np.minimum(next_event, next_keyframe)
+    gone = kind[kind != SNAPSHOT][order] == GONE
+    end[gone] = start[gone]
+    counts = end - start
+
+    # 每条事件按有效的快照数重复，再按 (快照, 道路/方向首次出现的顺序) 排列
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    snapshot_index = np.repeat(start, counts) + offsets
+    final = np.lexsort((np.repeat(group, counts), snapshot_index))
+    take = np.repeat(order, counts)[final]
+
+    # 逐列按下标取值，category 列只取编码，避免整表复制和类型转换
+    dense = {"timestamp": snapshot_times[snapshot_index[final]]}
+    for column in FIELDNAMES[1:]:
+        if columns is not None and column not in columns:
+            continue
+        values = rows[column]
+        if column == "description":
+            lookup = pd.array(list(dictionary) + [None], dtype="string")
+            dense[column] = lookup.take(values.to_numpy()[take])
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()[take]
+            dense[column] = pd.Categorical.from_codes(codes, values.cat.categories.astype("string"))
+        else:
+            dense[column] = values.to_numpy()[take]
+    df = pd.DataFrame(dense)
+    return df[list(columns)] if columns is not None else df
+
+
+def _read_partition(directory, dictionary, columns=None):
+    files = sorted(glob.glob(os.path.join(directory, "part-*.parquet")))
+    read_columns = None
+    if columns is not None:
+        read_columns = ["timestamp", "tick", "kind"] + KEY_COLUMNS + [c for c in columns if c in VALUE_COLUMNS]
+    events = pd.concat([storage.read_parquet(path, read_columns) for path in files], ignore_index=True)
+    if (read_columns is None or "sampled_at" in read_columns) and "sampled_at" not in events.columns:
+        # 新增 sampled_at 之前写入的 part 文件
+        events["sampled_at"] = pd.NaT
+    if len(files) > 1:
+        # 合并 part 文件中途中断时可能有重复的事件
+        events = events.drop_duplicates()
+        # 各文件的 category 取值不同，合并后需重新转换
+        events = _events(events, None)[events.columns]
+    return decode(events, dictionary, columns)
+
+
+def iter_days(root=DELTA_DIR, start=None, end=None, columns=None):
+    """
+    按天还原数据，只打开时间范围内的分区
+    :return: DataFrame 生成器，每天一个
+    """
+    dictionary = load_dictionary(root)
+    for directory in storage.list_partitions(root, start, end):
+        df = _read_partition(directory, dictionary, storage.read_columns(columns, start, end))
+        if "sampled_at" in df.columns:
+            df = storage.fill_sampled_at(df)
+        if start is not None:
+            df = df[df["timestamp"] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df["timestamp"] < pd.Timestamp(end)]
+        if columns is not None:
+            df = df[list(columns)]
+        if len(df):
+            yield df.reset_index(drop=True)
+
+
+def read_delta(root=DELTA_DIR, start=None, end=None, columns=None):
+    """读取变化编码存储并还原为逐快照记录"""
+    frames = list(iter_days(root, start, end, columns))
+    if not frames:
+        empty = storage.to_typed_frame([])
+        return empty[list(columns)] if columns is not None else empty
+    df = pd.concat(frames, ignore_index=True)
+    # 不同日期的 category 取值不同，合并后需重新转换
+    for column in storage.CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    return df
+
+
+def compact(root=DELTA_DIR):
+    """
+    将每个分区内的多个 part 文件合并为一个，文件名取最新的 part，不影响增量写入的状态校验
+    先写入合并后的文件再删除旧文件，中途中断只会留下重复事件，读取时会去重
+    :return: {分区目录: 合并前的文件数}
+    """
+    result = {}
+    with store_lock(root):
+        for directory in storage.list_partitions(root):
+            files = sorted(glob.glob(os.path.join(directory, "part-*.parquet")))
+            result[directory] = len(files)
+            if len(files) <= 1:
+                continue
+            events = pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)
+            events = _events(events.drop_duplicates(), None).sort_values("timestamp", kind="stable")
+            _write_atomic(events, files[-1])
+            for path in files[:-1]:
+                os.remove(path)
+    return result
+
+
+def migrate_csv(csv_path=TRAFFIC_CSV_FILE, root=DELTA_DIR, chunksize=500000, keyframe_every=DELTA_KEYFRAME_EVERY):
+    """
+    将已有的CSV文件转换为变化编码存储（CSV 需按时间顺序追加写入）
+    分块读取，每块中最后一天的数据留到下一块，保证同一天在一次调用中编码
+    :return: 迁移的记录数
+    """
+    if os.path.exists(root):
+        raise FileExistsError(f"目标目录 {root} 已存在")
+    total = 0
+    pending = None
+    with open_committed(csv_path) as f:
+        for chunk in pd.read_csv(f, dtype=str, chunksize=chunksize):
+            chunk = storage.to_typed_frame(chunk)
+            if pending is not None:
+                chunk = pd.concat([pending, chunk], ignore_index=True)
+            days = chunk["timestamp"].dt.normalize()
+            last_day = days.max()
+            write_frame(chunk[days < last_day], root, keyframe_every)
+            pending = chunk[days == last_day]
+            total += int((days < last_day).sum())
+    if pending is not None and len(pending):
+        write_frame(pending, root, keyframe_every)
+        total += len(pending)
+    return total
+
+
+def verify(csv_path, root=DELTA_DIR):
+    """
+    逐项比较还原出的数据与原始CSV是否完全一致（两边都缺失视为相同）
+    :return: 不一致的说明列表，为空表示一致
+    """
+    expected = storage.to_typed_frame(storage.read_csv(csv_path))
+    actual = read_delta(root)
+    if len(expected) != len(actual):
+        return [f"记录数不同: CSV {len(expected)}, 还原 {len(actual)}"]
+    keys = ["timestamp", "road_name", "direction", "speed", "status", "description", "delay_index"]
+
+    def normalized(df):
+        df = df.astype({column: object for column in storage.CATEGORY_COLUMNS + ["description"]})
+        return df.sort_values(keys, na_position="first", kind="stable").reset_index(drop=True)
+
+    expected, actual = normalized(expected), normalized(actual)
+    problems = []
+    for column in FIELDNAMES:
+        x, y = expected[column], actual[column]
+        same = (x == y).fillna(False).to_numpy(dtype=bool) | (x.isna().to_numpy() & y.isna().to_numpy())
+        if not same.all():
+            problems.append(f"{column}: {int((~same).sum())} 处不同")
+    return problems
+
+
+def disk_usage(path):
+    """文件或目录占用的字节数"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(path) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="变化编码存储管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="将CSV文件转换为变化编码存储")
+    migrate.add_argument("--csv", default=TRAFFIC_CSV_FILE, help="源CSV文件")
+    migrate.add_argument("--root", default=DELTA_DIR, help="存储目录（不能已存在）")
+    check = sub.add_parser("verify", help="比较还原出的数据与原始CSV是否完全一致")
+    check.add_argument("--csv", default=TRAFFIC_CSV_FILE, help="原始CSV文件")
+    check.add_argument("--root", default=DELTA_DIR, help="存储目录")
+    compact_cmd = sub.add_parser("compact", help="合并每个分区内的小文件")
+    compact_cmd.add_argument("--root", default=DELTA_DIR, help="存储目录")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        total = migrate_csv(args.csv, args.root)
+        print(f"已迁移 {total} 条记录到 {args.root}，"
+              f"占用 {disk_usage(args.root) / 1e6:.1f} MB（CSV {disk_usage(args.csv) / 1e6:.1f} MB）")
+    elif args.command == "verify":
+        problems = verify(args.csv, args.root)
+        print("\n".join(problems) if problems else "还原数据与CSV完全一致")
+    else:
+        for directory, count in compact(args.root).items():
+            print(f"{directory}: 合并了 {count} 个文件")
+
+
+if __name__ == "__main__":
+    main()
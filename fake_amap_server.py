@@ -0,0 +1,282 @@
+# fake_amap_server.py
+# 本地模拟高德API服务，用于基准测试，不消耗真实配额
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from tile_collector import diagonal_km, format_rectangle, parse_rectangle
+
+DIRECTIONS = ["东向西", "西向东", "南向北", "北向南"]
+DESCRIPTIONS = {
+    "1": "畅通",
+    "2": "缓行",
+    "3": "拥堵",
+    "4": "严重拥堵",
+}
+
+
+# 模拟同一条道路的多个POI名称：括号说明可由名称规范化识别，道路名以数字结尾时出入口和编号别名只能从响应识别
+ALIAS_FORMATS = ["{}(北段)", "{}入口", "{}-{}"]
+_ALIAS_SUFFIX = re.compile(r"(\(北段\)|入口|-\d+)$")
+
+
+def _stable_int(text):
+    """根据字符串得到稳定的整数，保证同一道路每次返回相同数据"""
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def fake_traffic_response(road_name, segments=2):
+    """生成与 /v3/traffic/status/road 格式一致的响应，别名返回与原道路相同的路段"""
+    road_name = _ALIAS_SUFFIX.sub("", road_name)
+    seed = _stable_int(road_name)
+    roads = []
+    for i in range(segments):
+        status = str(1 + (seed >> i) % 4)
+        speed = 15 + (seed >> (i + 3)) % 50
+        roads.append({
+            "name": road_name,
+            "status": status,
+            "direction": DIRECTIONS[(seed + i) % len(DIRECTIONS)],
+            "angle": str((seed + 90 * i) % 360),
+            "speed": str(speed),
+            "lcodes": str(seed % 100000),
+            "polyline": "119.30,26.08;119.31,26.09",
+        })
+    return {
+        "status": "1",
+        "info": "OK",
+        "infocode": "10000",
+        "trafficinfo": {
+            "description": f"{road_name}：{DESCRIPTIONS[roads[0]['status']]}",
+            "evaluation": {"status": roads[0]["status"]},
+            "roads": roads,
+        },
+    }
+
+
+# 模拟道路分布的范围，与 config.TILE_BBOX 一致
+TILE_AREA = (119.15, 25.95, 119.45, 26.15)
+# 每个模拟路段的坐标跨度（度），跨越矩形边界的路段会被相邻矩形重复返回
+_SEGMENT_SPAN = 0.004
+
+
+def fake_segment_index(total_roads, segments=2, area=TILE_AREA):
+    """
+    为模拟道路的每个路段生成固定的位置，供矩形区域接口按范围返回
+    路段的状态、速度、方向与 /v3/traffic/status/road 返回的一致，每个路段有各自的 lcodes
+    :return: [(经度, 纬度, 路段)]
+    """
+    lng1, lat1, lng2, lat2 = area
+    index = []
+    for road in range(total_roads):
+        name = f"测试路{road}"
+        for i, segment in enumerate(fake_traffic_response(name, segments)["trafficinfo"]["roads"]):
+            seed = _stable_int(f"{name}#{i}")
+            lng = lng1 + (seed % 10007) / 10007 * (lng2 - lng1 - _SEGMENT_SPAN)
+            lat = lat1 + (seed // 10007 % 10009) / 10009 * (lat2 - lat1 - _SEGMENT_SPAN)
+            segment["lcodes"] = str(seed % 1000000)
+            segment["polyline"] = f"{lng:.6f},{lat:.6f};{lng + _SEGMENT_SPAN:.6f},{lat + _SEGMENT_SPAN:.6f}"
+            index.append((lng, lat, segment))
+    return index
+
+
+def fake_rectangle_response(rectangle, index, max_diagonal_km=10):
+    """生成与 /v3/traffic/status/rectangle 格式一致的响应，返回与矩形有交集的路段；对角线超限时返回参数错误"""
+    try:
+        rect = parse_rectangle(rectangle)
+    except ValueError:
+        rect = None
+    if rect is None or diagonal_km(rect) > max_diagonal_km:
+        return {"status": "0", "info": "INVALID_PARAMS", "infocode": "20000"}
+    lng1, lat1, lng2, lat2 = rect
+    roads = [segment for lng, lat, segment in index
+             if lng <= lng2 and lng + _SEGMENT_SPAN >= lng1 and lat <= lat2 and lat + _SEGMENT_SPAN >= lat1]
+    return {"status": "1", "info": "OK", "infocode": "10000",
+            "trafficinfo": {"description": "", "evaluation": {}, "roads": roads}}
+
+
+def _poi_name(index, aliases):
+    """第 index 个POI名称：每条道路依次是原名和 aliases 个别名"""
+    road, variant = divmod(index, aliases + 1)
+    name = f"测试路{road}"
+    if variant == 0:
+        return name
+    return ALIAS_FORMATS[(variant - 1) % len(ALIAS_FORMATS)].format(name, variant)
+
+
+def fake_poi_response(page, offset, total_roads, aliases=0):
+    """生成与 /v3/place/text 格式一致的道路POI响应，每条道路额外返回 aliases 个别名"""
+    total = total_roads * (aliases + 1)
+    start = (page - 1) * offset
+    end = min(start + offset, total)
+    pois = [{"name": _poi_name(i, aliases), "type": "交通地名;道路名;道路名"} for i in range(start, end)]
+    return {"status": "1", "info": "OK", "infocode": "10000", "count": str(total), "pois": pois}
+
+
+class _Server(ThreadingHTTPServer):
+    # 默认监听队列只有5，并发测试时会出现连接被丢弃后重传的情况
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class FakeAmapServer:
+    """
+    在后台线程中运行的模拟高德API服务
+    :param latency: 每个请求的模拟延迟（秒）
+    :param segments: 每条道路返回的路段数
+    :param total_roads: POI检索可返回的道路总数
+    :param fail_rate: 返回 HTTP 500 的请求比例
+    :param throttle_rate: 返回限流 infocode 的请求比例
+    :param seed: 故障注入使用的随机种子
+    :param key_quota: 每个 Key 可调用交通态势接口的次数，超出后返回日配额超限（10003），None 表示不限制
+    :param aliases: POI检索时每条道路额外返回的别名数
+    :param tile_max_diagonal_km: 矩形区域接口允许的对角线上限（公里）
+    :param tile_responses: 录制的矩形区域响应 {矩形参数: 响应}（见 tile_collector record），
+                           不为 None 时按原样回放，未录制的矩形返回错误；为 None 时按模拟道路的位置生成
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, segments=2, total_roads=500,
+                 fail_rate=0.0, throttle_rate=0.0, seed=0, key_quota=None, aliases=0,
+                 tile_max_diagonal_km=10, tile_responses=None):
+        self.latency = latency
+        self.segments = segments
+        self.total_roads = total_roads
+        self.aliases = aliases
+        self.fail_rate = fail_rate
+        self.throttle_rate = throttle_rate
+        self.key_quota = key_quota
+        self.tile_max_diagonal_km = tile_max_diagonal_km
+        self.tile_responses = tile_responses
+        self._segment_index = None
+        self.request_count = 0
+        self.key_counts = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 长连接下头部和正文分两次写出，需关闭 Nagle 算法避免 40ms 的延迟确认
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with server._lock:
+                    server.request_count += 1
+                    draw = server._rng.random()
+                if server.latency:
+                    time.sleep(server.latency)
+                if draw < server.fail_rate:
+                    self._send_json({"status": "0", "info": "SERVICE_NOT_AVAILABLE"}, code=500)
+                    return
+                if draw < server.fail_rate + server.throttle_rate:
+                    self._send_json({"status": "0", "info": "CUQPS_HAS_EXCEEDED_THE_LIMIT", "infocode": "10019"})
+                    return
+                parsed = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                if parsed.path == "/v3/traffic/status/road":
+                    key = query.get("key", "")
+                    with server._lock:
+                        server.key_counts[key] = server.key_counts.get(key, 0) + 1
+                        over_quota = server.key_quota is not None and server.key_counts[key] > server.key_quota
+                    if over_quota:
+                        self._send_json({"status": "0", "info": "DAILY_QUERY_OVER_LIMIT", "infocode": "10003"})
+                        return
+                    body = fake_traffic_response(query.get("name", ""), server.segments)
+                elif parsed.path == "/v3/traffic/status/rectangle":
+                    body = server.rectangle_response(query.get("rectangle", ""))
+                elif parsed.path == "/v3/place/text":
+                    body = fake_poi_response(int(query.get("page", 1)), int(query.get("offset", 20)),
+                                             server.total_roads, server.aliases)
+                else:
+                    self.send_error(404)
+                    return
+                self._send_json(body)
+
+            def _send_json(self, body, code=200):
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json;charset=UTF-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                # 基准测试时不输出访问日志
+                pass
+
+        return Handler
+
+    def rectangle_response(self, rectangle):
+        if self.tile_responses is not None:
+            # 回放时先把参数规范为 tile_collector.format_rectangle 的格式再查找
+            try:
+                rectangle = format_rectangle(parse_rectangle(rectangle))
+            except ValueError:
+                pass
+            return self.tile_responses.get(
+                rectangle, {"status": "0", "info": "NO_RECORDED_RESPONSE", "infocode": "20003"})
+        with self._lock:
+            if self._segment_index is None:
+                self._segment_index = fake_segment_index(self.total_roads, self.segments)
+        return fake_rectangle_response(rectangle, self._segment_index, self.tile_max_diagonal_km)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟高德API服务")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.05, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--roads", type=int, default=500, help="POI检索可返回的道路总数")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 HTTP 500 的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回限流 infocode 的比例")
+    parser.add_argument("--aliases", type=int, default=0, help="每条道路额外返回的POI别名数")
+    parser.add_argument("--replay-tiles", metavar="FILE",
+                        help="回放 tile_collector record 录制的矩形区域响应，默认按模拟道路的位置生成")
+    args = parser.parse_args()
+
+    tile_responses = None
+    if args.replay_tiles:
+        with open(args.replay_tiles, encoding="utf-8") as f:
+            tile_responses = json.load(f)
+    with FakeAmapServer(port=args.port, latency=args.latency, total_roads=args.roads,
+                        fail_rate=args.fail_rate, throttle_rate=args.throttle_rate, aliases=args.aliases,
+                        tile_responses=tile_responses) as fake:
+        print(f"模拟高德API服务已启动: {fake.url}  (Ctrl+C 退出)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# free_flow.py
+# 自由流速度解析器：根据配置一次性编译匹配规则，按道路名称查找自由流速度并缓存结果
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from config import FREE_FLOW_SPEEDS
+
+# 道路类型关键词，名称中没有匹配到具体配置时，按关键词推断道路类型
+ROAD_TYPE_KEYWORDS = {
+    "高速": "高速公路",
+    "快速": "快速路",
+    "高架": "高架路",
+    "大道": "主干道",
+    "路": "主干道",
+    "街": "主干道"
+}
+
+
+class FreeFlowResolver:
+    """
+    根据道路名称解析自由流速度
+    匹配分两层：先匹配 FREE_FLOW_SPEEDS 中的道路名/道路类型，再匹配类型关键词，都没有则取 default
+    同一层内取名称中出现的最长的配置项；长度相同时取配置中靠前的一项
+    :param speeds: 自由流速度配置，格式同 config.FREE_FLOW_SPEEDS
+    :param keywords: 类型关键词到道路类型的映射
+    :param cache_size: 按道路名称缓存结果的数量
+    """
+
+    def __init__(self, speeds=None, keywords=None, cache_size=8192):
+        speeds = FREE_FLOW_SPEEDS if speeds is None else speeds
+        keywords = ROAD_TYPE_KEYWORDS if keywords is None else keywords
+        self.default = speeds.get("default", 50)
+        self._tiers = [
+            self._compile({key: value for key, value in speeds.items() if key != "default"}),
+            self._compile({key: speeds.get(road_type, self.default) for key, road_type in keywords.items()}),
+        ]
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    @staticmethod
+    def _compile(table):
+        """
+        把一层配置编译为一个正则表达式
+        使用零宽先行断言 (?=(...)) 可以在每个位置都尝试匹配，从而找到重叠出现的所有配置项；
+        备选项按长度从长到短排列，保证每个位置先匹配到最长的一项
+        """
+        if not table:
+            return None, {}
+        order = {key: i for i, key in enumerate(table)}
+        alternatives = sorted(table, key=lambda key: (-len(key), order[key]))
+        pattern = re.compile("(?=(" + "|".join(re.escape(key) for key in alternatives) + "))")
+        return pattern, {key: (table[key], order[key]) for key in table}
+
+    def _resolve(self, road_name):
+        if not isinstance(road_name, str) or not road_name:
+            return self.default
+        for pattern, table in self._tiers:
+            if pattern is None:
+                continue
+            best = None
+            for match in pattern.finditer(road_name):
+                key = match.group(1)
+                rank = (len(key), -table[key][1])
+                if best is None or rank > best[0]:
+                    best = (rank, key)
+            if best is not None:
+                return table[best[1]][0]
+        return self.default
+
+    def resolve_many(self, road_names):
+        """
+        批量解析自由流速度，重复的道路名只解析一次
+        :param road_names: pandas Series、numpy 数组或列表
+        :return: 输入为 Series 时返回同索引的 Series，否则返回 numpy 数组
+        """
+        series = road_names if isinstance(road_names, pd.Series) else pd.Series(road_names)
+        codes, uniques = pd.factorize(series)
+        speeds = np.array([self.resolve(name) for name in uniques] + [self.default], dtype="float64")
+        # 缺失值的编码为 -1，正好取到末尾的默认值
+        values = speeds[codes]
+        if isinstance(road_names, pd.Series):
+            return pd.Series(values, index=road_names.index, name="free_flow_speed")
+        return values
+
+    def cache_info(self):
+        return self.resolve.cache_info()
+
+
+_default_resolver = None
+
+
+def get_resolver():
+    """获取基于 config.FREE_FLOW_SPEEDS 的共享解析器"""
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = FreeFlowResolver()
+    return _default_resolver
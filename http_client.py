@@ -0,0 +1,180 @@
+# http_client.py
+# 共享的高德API HTTP客户端：连接池复用、带抖动的指数退避重试、快照级超时预算
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import HTTP_TIMEOUT, HTTP_POOL_SIZE, HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX
+import metrics
+
+# 高德返回的限流/服务繁忙类 infocode，这些错误稍后重试通常可以成功
+# 10004 访问过于频繁, 10014 QPS超限, 10015 网关超时, 10016 服务繁忙,
+# 10019/10020/10021 各类并发/QPS超限
+THROTTLE_INFOCODES = {"10004", "10014", "10015", "10016", "10019", "10020", "10021"}
+
+
+class DeadlineExceeded(Exception):
+    """本次快照的总耗时预算已用完"""
+
+
+class AmapClient:
+    """
+    基于 requests.Session 的高德API客户端，线程安全，可在多个采集线程间共享
+    :param timeout: 单次请求超时（秒）
+    :param pool_size: 连接池大小，应不小于并发线程数
+    :param max_retries: 最大重试次数（不含首次请求）
+    :param backoff_base: 退避基数（秒），第 n 次重试最多等待 backoff_base * 2^n
+    :param backoff_max: 单次退避的最大等待时间（秒）
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES,
+                 backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        # 超时预算属于设置它的上下文，同一进程中同时进行的多次快照（常驻采集、回填、基准测试）互不覆盖；
+        # 采集线程池通过 contextvars.copy_context 继承提交任务时的预算，见 traffic_fetcher.iter_in_order
+        self._deadline = contextvars.ContextVar(f"amap_deadline_{id(self)}", default=None)
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+        if name in ("retries", "deadline_exceeded"):
+            metrics.inc(f"http_{name}_total", value)
+
+    def remaining(self):
+        """当前超时预算剩余秒数，没有设置预算时返回 None"""
+        deadline = self._deadline.get()
+        if deadline is None:
+            return None
+        return deadline - time.monotonic()
+
+    @contextmanager
+    def deadline(self, seconds):
+        """
+        在 with 块内为当前上下文（线程）发出的请求设置总耗时预算，超出后请求直接抛出 DeadlineExceeded
+        :param seconds: 预算秒数，None 表示不限制
+        """
+        token = self._deadline.set(None if seconds is None else time.monotonic() + seconds)
+        try:
+            yield self
+        finally:
+            self._deadline.reset(token)
+
+    def _backoff(self, attempt):
+        # full jitter：在 [0, min(上限, base*2^n)] 内随机等待，避免多个线程同时重试
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _check_deadline(self):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded("快照超时预算已用完")
+        return remaining
+
+    def get_json(self, url, params, on_retry=None):
+        """
+        发送 GET 请求并返回 JSON，超时、连接错误、5xx、响应不是 JSON 和限流 infocode 会自动重试
+        :param url: 请求地址
+        :param params: 查询参数
+        :param on_retry: 每次重试前调用（首次请求由调用方自行限流、计数），用于令牌桶或 Key 池限流并计入调用次数；
+                         返回 False 时不再重试，按重试耗尽处理
+        :return: JSON 数据；重试耗尽后限流响应会原样返回，网络错误和 5xx 会抛出异常
+        """
+        attempt = 0
+        while True:
+            remaining = self._check_deadline()
+            timeout = self.timeout if remaining is None else min(self.timeout, remaining)
+            self._count("requests")
+            error = None
+            data = None
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=timeout)
+                metrics.inc("http_responses_total", code=response.status_code)
+                if response.status_code >= 500:
+                    error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                else:
+                    response.raise_for_status()
+                    data = response.json()
+            except ValueError as e:
+                # 网关返回的 HTML 错误页等，状态码为 200 但不是 JSON，与 5xx 一样重试
+                metrics.inc("http_responses_total", code="InvalidJSON")
+                error = e
+            except (requests.Timeout, requests.ConnectionError) as e:
+                metrics.inc("http_responses_total", code=type(e).__name__)
+                error = e
+            finally:
+                metrics.observe("http_attempt_seconds", time.perf_counter() - started)
+
+            if error is None and not (data.get("status") != "1" and data.get("infocode") in THROTTLE_INFOCODES):
+                return data
+
+            if attempt >= self.max_retries:
+                self._count("failures")
+                if error is not None:
+                    raise error
+                return data
+
+            delay = self._backoff(attempt)
+            remaining = self.remaining()
+            if remaining is not None and delay >= remaining:
+                self._count("failures")
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("快照超时预算不足以继续重试")
+            time.sleep(delay)
+            if on_retry is not None and on_retry() is False:
+                self._count("failures")
+                if error is not None:
+                    raise error
+                return data
+            attempt += 1
+            self._count("retries")
+
+    def stats(self):
+        """
+        返回请求统计：请求数、重试数、失败数，以及连接池新建/复用的连接数
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        opened = 0
+        served = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            served += pool.num_requests
+        stats["connections_opened"] = opened
+        stats["connections_reused"] = max(served - opened, 0)
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_client():
+    """获取进程内共享的客户端，首次调用时创建"""
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = AmapClient()
+    return _default_client
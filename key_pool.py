@@ -0,0 +1,148 @@
+# key_pool.py
+# 多个高德 API Key 组成的 Key 池：请求在各 Key 之间轮换，每个 Key 单独限流并统计调用次数，配额用完的 Key 不再使用
+import json
+import os
+import threading
+import time
+from datetime import date
+from functools import partial
+
+from config import AMAP_QPS, KEY_USAGE_FILE
+from rate_limiter import TokenBucket
+
+# 表示 Key 当日配额已用完或 Key 不可用的 infocode
+# 10001 Key不正确或过期, 10003 访问已超出日访问量, 10044 账号维度日调用量超出限制
+EXHAUSTED_INFOCODES = {"10001", "10003", "10044"}
+
+
+class KeyQuotaExhausted(Exception):
+    """Key 池中所有 Key 的配额都已用完"""
+
+
+def mask_key(key):
+    """日志中只显示 Key 的前4位"""
+    return f"{key[:4]}****" if key else "****"
+
+
+class KeyPool:
+    """
+    线程安全的 Key 池
+    :param keys: Key 列表
+    :param qps: 每个 Key 的QPS上限，0 或 None 表示不限流
+    :param quotas: {Key: 本 Key 池还可以使用的次数}，None 表示不限制；多个进程共用一个 Key 时由调用方分配份额
+    """
+
+    def __init__(self, keys, qps=AMAP_QPS, quotas=None):
+        if not keys:
+            raise ValueError("Key 池至少需要一个 Key")
+        self.keys = list(keys)
+        self.qps = qps
+        self._buckets = {key: TokenBucket(qps) if qps else None for key in self.keys}
+        self._quotas = quotas or {}
+        self.usage = {key: 0 for key in self.keys}
+        self.exhausted = set()
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _usable(self, key):
+        if key in self.exhausted:
+            return False
+        quota = self._quotas.get(key)
+        return quota is None or self.usage[key] < quota
+
+    def acquire(self):
+        """
+        按轮换顺序取一个有令牌的 Key，所有 Key 都暂时没有令牌时等待
+        :return: Key
+        :raises KeyQuotaExhausted: 所有 Key 的配额都已用完
+        """
+        while True:
+            with self._lock:
+                count = len(self.keys)
+                usable = 0
+                for i in range(count):
+                    index = (self._next + i) % count
+                    key = self.keys[index]
+                    if not self._usable(key):
+                        continue
+                    usable += 1
+                    bucket = self._buckets[key]
+                    if bucket is None or bucket.try_acquire():
+                        self.usage[key] += 1
+                        self._next = (index + 1) % count
+                        return key
+                if usable == 0:
+                    raise KeyQuotaExhausted("所有 Key 的配额都已用完")
+            # 每个 Key 每 1/qps 秒补充一个令牌，可用 Key 越多等待越短
+            time.sleep(1.0 / (self.qps * usable))
+
+    def charge(self, key):
+        """
+        同一个 Key 的重试（见 AmapClient.get_json 的 on_retry）：等待该 Key 的令牌并计入调用次数
+        :return: False 表示该 Key 已不可用或配额已用完，不应再重试
+        """
+        bucket = self._buckets[key]
+        while True:
+            with self._lock:
+                if not self._usable(key):
+                    return False
+                if bucket is None or bucket.try_acquire():
+                    self.usage[key] += 1
+                    return True
+            time.sleep(1.0 / self.qps)
+
+    def report(self, key, data):
+        """
+        根据响应更新 Key 状态
+        :return: True 表示该 Key 已不可用，调用方应换一个 Key 重试
+        """
+        if data.get("status") != "1" and data.get("infocode") in EXHAUSTED_INFOCODES:
+            with self._lock:
+                self.exhausted.add(key)
+            return True
+        return False
+
+    def request(self, send):
+        """
+        用 Key 池发送一次请求：Key 配额用完时换下一个 Key 重试；
+        同一个 Key 的限流/网络错误重试经过 charge 限流并计入该 Key 的调用次数
+        :param send: send(key, on_retry) -> JSON 数据，on_retry 需传给 AmapClient.get_json
+        :return: JSON 数据
+        :raises KeyQuotaExhausted: 所有 Key 都不可用
+        """
+        for _ in range(len(self.keys) - 1):
+            key = self.acquire()
+            data = send(key, partial(self.charge, key))
+            if not self.report(key, data):
+                return data
+        key = self.acquire()
+        data = send(key, partial(self.charge, key))
+        self.report(key, data)
+        return data
+
+    def stats(self):
+        """各 Key 的调用次数和状态（Key 已脱敏）"""
+        with self._lock:
+            return {mask_key(key): {"used": self.usage[key], "exhausted": key in self.exhausted}
+                    for key in self.keys}
+
+
+def load_usage(path=KEY_USAGE_FILE, today=None):
+    """
+    读取各 Key 当日已用次数，文件不存在或不是当天的记录时返回空记录
+    :return: {"date": "YYYY-MM-DD", "used": {Key: 次数}, "exhausted": [Key]}
+    """
+    today = today or date.today().isoformat()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            usage = json.load(f)
+        if usage.get("date") == today:
+            return usage
+    return {"date": today, "used": {}, "exhausted": []}
+
+
+def save_usage(usage, path=KEY_USAGE_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(usage, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
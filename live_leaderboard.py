@@ -0,0 +1,268 @@
+# live_leaderboard.py
+# 实时拥堵排行榜：在采集进程内存中按道路维护最近 N 分钟的延时指数（滑动窗口），每次快照后更新并输出最拥堵道路的 JSON 和 HTML，
+# 不读取已保存的历史数据
+import heapq
+import html
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+from config import (COLLECT_INTERVAL_MINUTES, LEADERBOARD_WINDOWS, LEADERBOARD_TOP_K, LEADERBOARD_JSON_FILE,
+                    LEADERBOARD_HTML_FILE, LEADERBOARD_STATE_FILE)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def snapshot_samples(records, samples=None):
+    """
+    把一次快照的记录按道路汇总为一个样本，error 记录和没有延时指数的记录不计入
+    :param samples: 已汇总的样本，不为空时把记录累加进去（同一快照分批汇总）
+    :return: {道路: (延时指数之和, 记录数, 最严重的 status)}
+    """
+    samples = {} if samples is None else samples
+    for record in records:
+        if record.get("status") == "error" or record.get("delay_index") is None or not record.get("road_name"):
+            continue
+        total, count, status = samples.get(record["road_name"], (0.0, 0, 0))
+        record_status = int(record["status"]) if str(record.get("status", "")).isdigit() else 0
+        samples[record["road_name"]] = (total + float(record["delay_index"]), count + 1, max(status, record_status))
+    return samples
+
+
+class RoadWindow:
+    """
+    单条道路在窗口内的样本，环形缓冲区（容量为窗口内最多的快照数）加上累计和，入队、过期出队都是 O(1)
+    :param capacity: 最多保留的样本数，写满后最旧的样本被覆盖
+    """
+    __slots__ = ("samples", "total", "count", "status")
+
+    def __init__(self, capacity):
+        self.samples = deque(maxlen=capacity)
+        self.total = 0.0
+        self.count = 0
+        self.status = 0
+
+    def push(self, timestamp, total, count, status):
+        if len(self.samples) == self.samples.maxlen:
+            self._drop()
+        self.samples.append((timestamp, total, count))
+        self.total += total
+        self.count += count
+        self.status = status
+
+    def _drop(self):
+        _, total, count = self.samples.popleft()
+        self.total -= total
+        self.count -= count
+        if not self.samples:
+            # 清空时归零，避免反复加减累积浮点误差
+            self.total = 0.0
+            self.count = 0
+
+    def expire(self, cutoff):
+        """移除时间不晚于 cutoff 的样本"""
+        while self.samples and self.samples[0][0] <= cutoff:
+            self._drop()
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class SlidingWindow:
+    """
+    最近 minutes 分钟内每条道路的平均延时指数
+    每次快照记录一次本次更新了哪些道路，过期时只处理这些道路，每个样本只入队、出队各一次
+    :param minutes: 窗口长度（分钟）
+    :param interval: 采集间隔（分钟），用于确定每条道路环形缓冲区的容量
+    """
+
+    def __init__(self, minutes, interval=COLLECT_INTERVAL_MINUTES):
+        self.minutes = minutes
+        self.capacity = max(minutes // max(interval, 1), 1) + 1
+        self.roads = {}
+        self._snapshots = deque()
+
+    def add(self, timestamp, samples):
+        for name, (total, count, status) in samples.items():
+            road = self.roads.get(name)
+            if road is None:
+                road = self.roads[name] = RoadWindow(self.capacity)
+            road.push(timestamp, total, count, status)
+        self._snapshots.append((timestamp, list(samples)))
+        self.expire(timestamp)
+
+    def expire(self, now):
+        cutoff = now - timedelta(minutes=self.minutes)
+        while self._snapshots and self._snapshots[0][0] <= cutoff:
+            _, names = self._snapshots.popleft()
+            for name in names:
+                road = self.roads.get(name)
+                if road is None:
+                    continue
+                road.expire(cutoff)
+                if not road.samples:
+                    del self.roads[name]
+
+    def top(self, k):
+        """平均延时指数最高的 k 条道路，堆选择，不对全部道路排序"""
+        return heapq.nlargest(k, self.roads.items(), key=lambda item: item[1].mean)
+
+
+class LiveLeaderboard:
+    """
+    多个滑动窗口的拥堵排行榜，每次快照调用 update(records)
+    窗口内的样本保存在 state_file 中，定时任务每次启动新进程时也能接上之前的窗口
+    :param windows: 窗口长度列表（分钟）
+    :param top_k: 每个窗口输出的道路数
+    """
+
+    def __init__(self, windows=LEADERBOARD_WINDOWS, top_k=LEADERBOARD_TOP_K, interval=COLLECT_INTERVAL_MINUTES,
+                 state_file=LEADERBOARD_STATE_FILE):
+        self.windows = [SlidingWindow(minutes, interval) for minutes in sorted(windows)]
+        self.top_k = top_k
+        self.state_file = state_file
+        self.updated = None
+
+    @classmethod
+    def load(cls, state_file=LEADERBOARD_STATE_FILE, **kwargs):
+        """读取窗口状态，文件不存在或损坏时从空窗口开始"""
+        board = cls(state_file=state_file, **kwargs)
+        try:
+            with open(state_file, encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return board
+        for timestamp, samples in state.get("snapshots", []):
+            board.add(datetime.strptime(timestamp, TIME_FORMAT), {name: tuple(value) for name, value in samples.items()})
+        return board
+
+    def save(self):
+        """原子写入最长窗口内的样本（按快照），先写临时文件再替换"""
+        if not self.state_file:
+            return
+        snapshots = {}
+        for name, road in self.windows[-1].roads.items():
+            for timestamp, total, count in road.samples:
+                snapshots.setdefault(timestamp, {})[name] = [total, count, road.status]
+        state = {"snapshots": [[timestamp.strftime(TIME_FORMAT), samples]
+                               for timestamp, samples in sorted(snapshots.items())]}
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_file)
+
+    def add(self, timestamp, samples):
+        if self.updated is not None and timestamp <= self.updated:
+            # 同一快照重复提交（或时间回拨）时忽略，避免重复计数
+            return False
+        for window in self.windows:
+            window.add(timestamp, samples)
+        self.updated = timestamp
+        return True
+
+    def update(self, records):
+        """
+        加入一次快照的记录，记录的 timestamp 为快照时间
+        :return: 是否加入（快照时间不晚于上一次时忽略）
+        """
+        if not records:
+            return False
+        return self.add(datetime.strptime(records[0]["timestamp"], TIME_FORMAT), snapshot_samples(records))
+
+    def rankings(self):
+        """
+        :return: {窗口分钟数: [{"rank", "road_name", "delay_index", "samples", "status"}]}，delay_index 为窗口内平均值
+        """
+        result = {}
+        for window in self.windows:
+            result[window.minutes] = [
+                {"rank": rank, "road_name": name, "delay_index": round(road.mean, 2),
+                 "samples": len(road.samples), "status": road.status}
+                for rank, (name, road) in enumerate(window.top(self.top_k), 1)
+            ]
+        return result
+
+    def to_dict(self):
+        return {
+            "updated": self.updated.strftime(TIME_FORMAT) if self.updated else None,
+            "windows": {str(minutes): rows for minutes, rows in self.rankings().items()},
+        }
+
+    def to_html(self, refresh_seconds=COLLECT_INTERVAL_MINUTES * 60):
+        data = self.to_dict()
+        parts = [
+            "<!DOCTYPE html>",
+            '<html lang="zh-CN"><head><meta charset="utf-8">',
+            f'<meta http-equiv="refresh" content="{refresh_seconds}">',
+            "<title>福州实时拥堵排行榜</title>",
+            "<style>body{font-family:sans-serif;margin:24px;color:#333}table{border-collapse:collapse;"
+            "margin:0 24px 24px 0;display:inline-table}th,td{border-bottom:1px solid #ddd;padding:4px 12px;"
+            "text-align:left}th{background:#f5f5f5}</style>",
+            "</head><body>",
+            f"<h2>福州实时拥堵排行榜</h2><p>更新时间: {html.escape(data['updated'] or '-')}</p>",
+        ]
+        for minutes, rows in data["windows"].items():
+            parts.append(f"<table><caption>最近 {minutes} 分钟平均延时指数 TOP {self.top_k}</caption>")
+            parts.append("<tr><th>排名</th><th>道路</th><th>延时指数</th><th>样本数</th><th>最新状态</th></tr>")
+            for row in rows:
+                parts.append(f"<tr><td>{row['rank']}</td><td>{html.escape(row['road_name'])}</td>"
+                             f"<td>{row['delay_index']:.2f}</td><td>{row['samples']}</td><td>{row['status']}</td></tr>")
+            parts.append("</table>")
+        parts.append("</body></html>")
+        return "\n".join(parts)
+
+    def write(self, json_file=LEADERBOARD_JSON_FILE, html_file=LEADERBOARD_HTML_FILE):
+        """覆盖写入排行榜 JSON 和 HTML（先写临时文件再重命名），为 None 的文件不写"""
+        for path, content in ((json_file, lambda: json.dumps(self.to_dict(), ensure_ascii=False, indent=2)),
+                              (html_file, self.to_html)):
+            if not path:
+                continue
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content())
+            os.replace(tmp_path, path)
+
+
+# 进程内共享的排行榜，常驻模式下窗口一直保存在内存中，只在启动时读取一次状态文件
+_board = None
+
+
+def get_leaderboard():
+    global _board
+    if _board is None:
+        _board = LiveLeaderboard.load()
+    return _board
+
+
+class LeaderboardUpdate:
+    """
+    一次快照的排行榜样本：每批记录保存后调用 add 按道路汇总，快照提交后调用 commit 加入排行榜
+    样本只与本次快照涉及的道路数有关；快照保存失败时不调用 commit，窗口保持不变
+    """
+
+    def __init__(self):
+        self.timestamp = None
+        self.samples = {}
+
+    def add(self, records):
+        """汇总一批已保存（带 timestamp）的记录"""
+        if records:
+            self.timestamp = records[0]["timestamp"]
+        snapshot_samples(records, self.samples)
+
+    def commit(self):
+        """加入排行榜并输出 JSON/HTML、保存窗口状态"""
+        board = get_leaderboard()
+        if self.timestamp is not None and board.add(datetime.strptime(self.timestamp, TIME_FORMAT), self.samples):
+            board.write()
+            board.save()
+        return board
+
+
+def update_leaderboard(records):
+    """加入一次快照并输出排行榜 JSON/HTML、保存窗口状态（边采集边保存时用 LeaderboardUpdate 逐批汇总）"""
+    update = LeaderboardUpdate()
+    update.add(records)
+    return update.commit()
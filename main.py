@@ -1,58 +1,206 @@
 # main.py
-from road_fetcher import fetch_roads_in_fuzhou
-from traffic_fetcher import fetch_fuzhou_traffic
-from csv_utils import save_to_csv
+from road_catalog import SegmentTracker, get_roads, update_segments
+from traffic_fetcher import SnapshotSummary, iter_fuzhou_traffic, chain_observers
+from storage import save_snapshot_stream
+from rollup_store import RollupUpdate
+from congestion_cube import CubeUpdate
+from live_leaderboard import LeaderboardUpdate
+from dashboard import DashboardUpdate
+from http_client import get_client
+from collector_daemon import CollectorDaemon
+from poll_scheduler import PollScheduler
+from tile_collector import TileCollector
+from anomaly_detector import AnomalyDetector
+from config import (SNAPSHOT_DEADLINE, METRICS_ENABLED, METRICS_PROFILE_DIR, ROAD_DEDUP, POLL_ADAPTIVE, COLLECT_MODE,
+                    ANOMALY_DETECTION, DASHBOARD_DIR)
+import metrics
+import argparse
+import itertools
 import traceback
 
 
-def calculate_average_delay_index(traffic_data):
+def run_snapshot(verbose=True, record_metrics=METRICS_ENABLED, profile_dir=METRICS_PROFILE_DIR, mode=COLLECT_MODE):
     """
-    计算平均延时指数
-    :param traffic_data: 交通数据列表
-    :return: 平均延时指数
+    采集并保存一次快照
+    :param verbose: 是否逐条打印采集到的记录
+    :param record_metrics: 是否记录本次快照的指标，结束后导出到 METRICS_PROM_FILE 和 METRICS_JSONL_FILE
+    :param profile_dir: 不为空时对每个环节做 cProfile（仅在 record_metrics 时生效）
+    :param mode: 采集模式，"road" 按道路名逐条请求，"tile" 按矩形区域请求（见 tile_collector.py）
+    :return: 本次快照的摘要（traffic_fetcher.SnapshotSummary）
     """
-    valid_data = [item for item in traffic_data if
-                  item.get("delay_index") is not None and item.get("status") != "error"]
-    if not valid_data:
-        return 0
+    if record_metrics:
+        metrics.start_run(profile_dir)
+    try:
+        return _snapshot(verbose, mode)
+    finally:
+        recorder = metrics.finish_run()
+        if recorder is not None:
+            stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in recorder.stages.items())
+            print(f"各环节耗时: {stages}")
 
-    total_delay = sum(float(item["delay_index"]) for item in valid_data)
-    return round(total_delay / len(valid_data), 2)
 
+def _report_anomalies(detector):
+    """保存异常检测状态并打印本次的报警"""
+    if detector is None:
+        return
+    detector.commit()
+    print(f"异常检测: 检测 {detector.observed} 条道路，报警 {len(detector.alerts)} 条")
+    for alert in detector.alerts:
+        print(f"  {alert['road_name']}: 延时指数 {alert['delay_index']}，该时段均值 {alert['mean']}"
+              f"（标准差 {alert['std']}，z={alert['z']}）")
 
-if __name__ == "__main__":
-    try:
-        # 先获取福州道路名称
-        roads = fetch_roads_in_fuzhou(pages=10)  # 页数可调，越大抓取越多
-        print(f"共获取到 {len(roads)} 条道路")
 
-        # 获取交通数据
-        traffic_data = fetch_fuzhou_traffic(roads)
+def _carried_batch(carried, tracker):
+    """沿用的记录作为最后一批；在前面的批次都经过 tracker 之后再去掉与本次请求到的路段重复的记录"""
+    yield carried if tracker is None else tracker.drop_seen(carried)
 
-        # 计算平均延时指数
-        avg_delay = calculate_average_delay_index(traffic_data)
-        print(f"福州市平均交通延时指数: {avg_delay}")
 
-        # 打印到控制台
-        for record in traffic_data:
+class _RecordPrinter:
+    """逐批打印已保存的记录"""
+
+    @staticmethod
+    def add(records):
+        for record in records:
             print(record)
 
-        # 保存到 CSV
-        save_to_csv(traffic_data, "fuzhou_traffic.csv")
-        print("数据已保存到 fuzhou_traffic.csv")
-
-        # 打印延时指数最高的5条道路
-        sorted_by_delay = sorted(
-            [r for r in traffic_data if r.get("delay_index") is not None and r.get("status") != "error"],
-            key=lambda x: x["delay_index"],
-            reverse=True
-        )[:5]
-
-        print("\n延时指数最高的5条道路:")
-        for i, road in enumerate(sorted_by_delay, 1):
-            print(
-                f"{i}. {road['road_name']}: 延时指数 {road['delay_index']} (速度: {road['speed']}km/h, 状态: {road['status']})")
-
-    except Exception as e:
-        print(f"程序执行出错: {str(e)}")
-        traceback.print_exc()
\ No newline at end of file
+
+def _collect_tiles(client, summary, consumers):
+    """按矩形区域采集并保存，道路目录、名称去重和自适应轮询都不需要"""
+    collector = TileCollector()
+    detector = AnomalyDetector() if ANOMALY_DETECTION else None
+    with client.deadline(SNAPSHOT_DEADLINE):
+        with metrics.stage("fetch"):
+            batches = detector.observe_batches(collector) if detector is not None else collector
+            _, data_path = save_snapshot_stream(batches, consumers=[summary] + consumers)
+    print(f"HTTP统计: {client.stats()}")
+    _report_anomalies(detector)
+    report = collector.summary()
+    print(f"按矩形区域采集: 网格 {report['tiles']} 个矩形，共请求 {report['requests']} 次"
+          f"（超限四等分 {report['split']} 次，失败 {report['failed']} 个），得到 {report['segments']} 个路段"
+          f"（去掉相邻矩形重复 {report['duplicates']} 个，无名称 {report['unnamed']} 个）")
+    for rectangle, info in collector.failed:
+        print(f"矩形 {rectangle} 请求失败: {info}")
+    return data_path
+
+
+def _collect_roads(client, summary, consumers):
+    """
+    按道路名逐条采集并保存
+    :param summary: 本次快照的摘要，逐批累加
+    :param consumers: 其他逐批处理已保存记录的对象，见 storage.save_snapshot_stream
+    :return: 数据保存位置
+    """
+    # 整次快照共享一个耗时预算，超时后剩余道路直接记为 error，避免与下一次定时任务重叠
+    with client.deadline(SNAPSHOT_DEADLINE):
+        # 先获取福州道路名称（读取本地道路目录，过期时才重新检索POI）
+        with metrics.stage("roads"):
+            roads = get_roads()
+        print(f"共获取到 {len(roads)} 条道路")
+
+        # 自适应轮询时只请求到期的道路，其余道路沿用上一次请求到的记录
+        scheduler = PollScheduler() if POLL_ADAPTIVE else None
+        queries, carried = scheduler.plan(roads) if scheduler is not None else (roads, [])
+        if scheduler is not None:
+            plan = scheduler.summary(roads, queries)
+            metrics.inc("poll_roads_total", plan["polled"], kind="polled")
+            metrics.inc("poll_roads_total", plan["carried"], kind="carried")
+            print(f"自适应轮询: 本次请求 {plan['polled']} 条道路，沿用 {plan['carried']} 条，"
+                  f"预计每天请求 {plan['daily_calls']} 次（预算 {plan['daily_budget']}）")
+
+        # 获取交通数据并边采集边保存，写入耗时计入 fetch 环节
+        # CSV、SQLite 后端每批写入一次、整次快照采集完才提交；其他后端按列暂存，采集完后一次写入
+        tracker = SegmentTracker() if ROAD_DEDUP else None
+        # 按道路、按星期几+小时检测延时指数异常（沿用的记录不参与检测）
+        detector = AnomalyDetector() if ANOMALY_DETECTION else None
+        with metrics.stage("fetch"):
+            # 调度器在路段去重之前，按每个查询的完整响应记录状态；否则路段都已被其他查询返回的道路
+            # 不会记录状态，每次快照都会重新请求
+            batches = iter_fuzhou_traffic(queries, observer=chain_observers(scheduler, tracker, detector))
+            if carried:
+                batches = itertools.chain(batches, _carried_batch(carried, tracker))
+            _, data_path = save_snapshot_stream(batches, consumers=[summary] + consumers)
+    print(f"HTTP统计: {client.stats()}")
+    if scheduler is not None and summary.records:
+        scheduler.commit(summary.timestamp)
+    _report_anomalies(detector)
+
+    # 根据响应识别返回相同路段的道路名称，下次快照不再重复请求
+    if tracker is not None:
+        learned, report = update_segments(tracker.segments)
+        metrics.inc("road_queries_saved_total", report["poi_names"] - len(roads))
+        print(f"道路名称去重: POI名称 {report['poi_names']} 个，本次去重后 {len(roads)} 条道路，下次 {report['queries']} 条"
+              f"（节省 {report['saved']} 次请求，新识别重复名称 {learned} 个，去掉重复路段记录 {tracker.duplicates} 条）")
+    return data_path
+
+
+def _snapshot(verbose, mode=COLLECT_MODE):
+    client = get_client()
+    collect = _collect_tiles if mode == "tile" else _collect_roads
+    # 保存后的统计在采集时逐批汇总（不保留整次快照的记录），快照提交后再一次写入各自的文件
+    summary = SnapshotSummary()
+    rollup = RollupUpdate()
+    cube = CubeUpdate()
+    board = LeaderboardUpdate()
+    dashboard = DashboardUpdate() if DASHBOARD_DIR else None
+    consumers = [consumer for consumer in (rollup, cube, board, dashboard) if consumer is not None]
+    # 打印到控制台
+    if verbose:
+        consumers.append(_RecordPrinter())
+    data_path = collect(client, summary, consumers)
+
+    # 计算平均延时指数
+    print(f"福州市平均交通延时指数: {summary.average_delay_index}")
+
+    # 数据已在采集时保存（CSV、分区列式存储、SQLite 或变化编码存储，见 config.STORAGE_BACKEND）
+    print(f"数据已保存到 {data_path}")
+
+    # 增量更新按道路、按小时的汇总统计
+    with metrics.stage("rollup"):
+        rollup.commit(data_path)
+    # 增量更新按 (道路, 方向, 星期, 小时, 日期) 聚合的拥堵立方体
+    with metrics.stage("cube"):
+        cube.commit(data_path)
+    # 更新内存中的滑动窗口排行榜（最近30/60分钟），输出 leaderboard.json / leaderboard.html
+    with metrics.stage("leaderboard"):
+        leaderboard = board.commit()
+    # 增量更新看板分片（只重写本次快照涉及的日期、道路和排名页）
+    if dashboard is not None:
+        with metrics.stage("dashboard"):
+            dashboard.commit(data_path)
+
+    # 打印延时指数最高的5条道路
+    print("\n延时指数最高的5条道路:")
+    for i, road in enumerate(summary.highest(), 1):
+        print(
+            f"{i}. {road['road_name']}: 延时指数 {road['delay_index']} (速度: {road['speed']}km/h, 状态: {road['status']})")
+
+    for minutes, rows in leaderboard.rankings().items():
+        print(f"\n最近{minutes}分钟平均延时指数最高的5条道路:")
+        for row in rows[:5]:
+            print(f"{row['rank']}. {row['road_name']}: 平均延时指数 {row['delay_index']} ({row['samples']} 次快照)")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="福州交通数据采集")
+    parser.add_argument("--daemon", action="store_true",
+                        help="常驻运行，按整点对齐的间隔持续采集（替代 crontab 定时任务）")
+    parser.add_argument("--metrics", action="store_true", default=METRICS_ENABLED,
+                        help="记录各环节耗时、请求延迟等指标，导出为 Prometheus 文本文件和 JSON Lines")
+    parser.add_argument("--profile-stages", default=METRICS_PROFILE_DIR, metavar="DIR",
+                        help="对每个环节做 cProfile 并保存到 DIR（会同时开启 --metrics）")
+    parser.add_argument("--tiles", action="store_true", default=COLLECT_MODE == "tile",
+                        help="用矩形网格覆盖采集范围，按矩形区域请求（替代按道路名逐条请求）")
+    args = parser.parse_args()
+    record_metrics = args.metrics or args.profile_stages is not None
+    mode = "tile" if args.tiles else "road"
+
+    if args.daemon:
+        # 常驻进程内连接池、道路目录和自由流速度缓存在多次采集之间复用
+        CollectorDaemon(lambda: run_snapshot(False, record_metrics, args.profile_stages, mode)).run()
+    else:
+        try:
+            run_snapshot(True, record_metrics, args.profile_stages, mode)
+        except Exception as e:
+            print(f"程序执行出错: {str(e)}")
+            traceback.print_exc()
@@ -0,0 +1,251 @@
+# metrics.py
+# 采集指标：各环节耗时、请求延迟直方图、状态/infocode 计数、重试次数、写入行数和字节数
+# 每次快照一个记录器，结束后导出为 Prometheus 文本文件并向 JSON Lines 文件追加一行；
+# 未开启时所有埋点函数只做一次 None 判断就返回
+import bisect
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from config import METRICS_PROM_FILE, METRICS_JSONL_FILE, METRICS_LATENCY_BUCKETS
+
+# 指标说明，同时决定 Prometheus 中的类型
+METRICS = {
+    "collector_stage_seconds": ("gauge", "各环节耗时（秒）"),
+    "collector_run_seconds": ("gauge", "整次快照耗时（秒）"),
+    "collector_run_timestamp_seconds": ("gauge", "快照开始时间（Unix 时间戳）"),
+    "amap_request_seconds": ("histogram", "高德API调用耗时（秒，含重试）"),
+    "amap_responses_total": ("counter", "高德API响应数，按 status/infocode 区分"),
+    "amap_request_errors_total": ("counter", "未拿到响应的高德API调用数，按异常类型区分"),
+    "http_attempt_seconds": ("histogram", "单次HTTP请求耗时（秒，不含退避等待）"),
+    "http_responses_total": ("counter", "HTTP响应数，按状态码或异常类型区分"),
+    "http_retries_total": ("counter", "HTTP重试次数"),
+    "http_deadline_exceeded_total": ("counter", "因快照超时预算用完而放弃的请求数"),
+    "traffic_records_total": ("counter", "采集到的记录数，按 status 区分"),
+    "road_queries_saved_total": ("counter", "道路名称规范化去重后节省的请求数"),
+    "tile_requests_total": ("counter", "矩形区域请求数，按成功（ok）/超限后四等分（split）/失败（failed）区分"),
+    "poll_roads_total": ("counter", "自适应轮询的道路数，按本次请求（polled）/沿用（carried）区分"),
+    "anomaly_alerts_total": ("counter", "延时指数异常报警数，按偏高（high）/偏低（low）区分"),
+    "storage_rows_written_total": ("counter", "写入的记录数"),
+    "storage_bytes_written_total": ("counter", "写入的字节数"),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((k, "" if v is None else str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    """Prometheus 标签，值中的反斜杠、引号和换行需要转义"""
+    if not labels:
+        return ""
+    escaped = (k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    """固定桶的直方图，桶上界为 buckets，最后一个桶为 +Inf"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """用桶上界估算分位数，落在 +Inf 桶时返回最大值"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.max
+
+
+class MetricsRecorder:
+    """
+    一次快照的指标记录器，线程安全，可在多个采集线程间共享
+    :param buckets: 延迟直方图的桶上界（秒）
+    :param profile_dir: 不为空时对每个环节做 cProfile，保存为 profile_dir/<开始时间>-<环节>.prof
+    """
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS, profile_dir=None):
+        self.buckets = sorted(buckets)
+        self.profile_dir = profile_dir
+        self.started = time.time()
+        self.run_id = datetime.fromtimestamp(self.started).strftime("%Y%m%d-%H%M%S")
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def stage(self, name):
+        """记录 with 块的耗时，同名环节累加；开启 profile_dir 时同时做 cProfile"""
+        profiler = cProfile.Profile() if self.profile_dir else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{self.run_id}-{name}.prof"))
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_dict(self):
+        """汇总为可序列化为 JSON 的字典"""
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            histograms = {}
+            for (name, labels), h in sorted(self.histograms.items(), key=lambda item: item[0]):
+                histograms.setdefault(name, []).append({
+                    "labels": dict(labels), "count": h.count, "sum": round(h.sum, 6), "max": round(h.max, 6),
+                    "p50": h.quantile(0.5), "p95": h.quantile(0.95),
+                    "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts)),
+                })
+            return {
+                "run_id": self.run_id,
+                "started": datetime.fromtimestamp(self.started).strftime("%Y-%m-%d %H:%M:%S"),
+                "seconds": round(time.time() - self.started, 4),
+                "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+                "counters": counters,
+                "histograms": histograms,
+            }
+
+    def to_prometheus(self):
+        """Prometheus 文本格式"""
+        lines = []
+        samples = {name: [] for name in METRICS}
+        with self._lock:
+            for name, seconds in self.stages.items():
+                samples["collector_stage_seconds"].append(
+                    f"collector_stage_seconds{_format_labels((('stage', name),))} {seconds:.6f}")
+            samples["collector_run_seconds"].append(f"collector_run_seconds {time.time() - self.started:.6f}")
+            samples["collector_run_timestamp_seconds"].append(f"collector_run_timestamp_seconds {self.started:.3f}")
+            for (name, labels), value in sorted(self.counters.items()):
+                samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip([str(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    cumulative += count
+                    samples.setdefault(name, []).append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                samples[name].append(f"{name}_sum{_format_labels(labels)} {h.sum:.6f}")
+                samples[name].append(f"{name}_count{_format_labels(labels)} {h.count}")
+        for name, lines_of_metric in samples.items():
+            if not lines_of_metric:
+                continue
+            kind, help_text = METRICS.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(lines_of_metric)
+        return "\n".join(lines) + "\n"
+
+    def export(self, prom_file=METRICS_PROM_FILE, jsonl_file=METRICS_JSONL_FILE):
+        """覆盖写入 Prometheus 文本文件（先写临时文件再重命名），并向 JSON Lines 文件追加一行"""
+        if prom_file:
+            os.makedirs(os.path.dirname(prom_file) or ".", exist_ok=True)
+            tmp_path = prom_file + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, prom_file)
+        if jsonl_file:
+            os.makedirs(os.path.dirname(jsonl_file) or ".", exist_ok=True)
+            with open(jsonl_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.to_dict(), ensure_ascii=False) + "\n")
+
+
+# 当前快照的记录器，为 None 表示未开启
+_recorder = None
+_NULL = nullcontext()
+
+
+def start_run(profile_dir=None, buckets=METRICS_LATENCY_BUCKETS):
+    """开始记录一次快照的指标"""
+    global _recorder
+    _recorder = MetricsRecorder(buckets, profile_dir)
+    return _recorder
+
+
+def finish_run(prom_file=METRICS_PROM_FILE, jsonl_file=METRICS_JSONL_FILE):
+    """结束记录并导出，返回记录器；未开启时返回 None"""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.export(prom_file, jsonl_file)
+    return recorder
+
+
+def active():
+    return _recorder
+
+
+def inc(name, value=1, **labels):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.observe(name, value, **labels)
+
+
+def stage(name):
+    recorder = _recorder
+    return _NULL if recorder is None else recorder.stage(name)
+
+
+def timer(name, **labels):
+    recorder = _recorder
+    return _NULL if recorder is None else recorder.timer(name, **labels)
+
+
+def record_response(api, data):
+    """按 status/infocode 统计一次高德API响应"""
+    recorder = _recorder
+    if recorder is not None:
+        recorder.inc("amap_responses_total", api=api, status=data.get("status"), infocode=data.get("infocode"))
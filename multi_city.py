@@ -0,0 +1,191 @@
+# multi_city.py
+# 多城市采集：每个城市一个进程，城市之间互不阻塞；请求分摊到 Key 池中的多个 Key，按 Key 统计每日配额
+import argparse
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from collector_daemon import CollectorDaemon, log
+from config import (AMAP_KEY, AMAP_KEYS, AMAP_QPS, AMAP_DAILY_QUOTA, KEY_USAGE_FILE, CITY_JOBS, CITY_DATA_DIR,
+                    CITY_WORKERS, STORAGE_BACKEND, SNAPSHOT_DEADLINE, TRAFFIC_CSV_FILE, PARQUET_DIR,
+                    ROAD_CATALOG_FILE, ROLLUP_FILE, CUBE_DIR, SQLITE_FILE, DELTA_DIR, ROAD_DEDUP)
+from congestion_cube import CubeUpdate
+from free_flow import FreeFlowResolver
+from http_client import get_client
+from key_pool import KeyPool, load_usage, save_usage, mask_key
+from road_catalog import SegmentTracker, get_roads, update_segments
+from rollup_store import RollupUpdate
+from storage import save_snapshot_stream
+from traffic_fetcher import SnapshotSummary, iter_city_traffic
+
+
+def job_paths(job, root=CITY_DATA_DIR):
+    """
+    城市任务的文件位置，全部放在 root/name/ 下，文件名与单城市采集时相同
+    :return: {"dir", "catalog", "csv", "parquet", "sqlite", "delta", "rollup", "cube"}
+    """
+    directory = os.path.join(root, job["name"])
+    return {
+        "dir": directory,
+        "catalog": os.path.join(directory, ROAD_CATALOG_FILE),
+        "csv": os.path.join(directory, TRAFFIC_CSV_FILE),
+        "parquet": os.path.join(directory, PARQUET_DIR),
+        "sqlite": os.path.join(directory, SQLITE_FILE),
+        "delta": os.path.join(directory, DELTA_DIR),
+        "rollup": os.path.join(directory, ROLLUP_FILE),
+        "cube": os.path.join(directory, CUBE_DIR),
+    }
+
+
+def assign_keys(job_count, keys):
+    """
+    把 Key 分配给各城市任务
+    Key 数不少于任务数时，每个任务独占若干 Key；否则多个任务共用一个 Key，按共用的任务数平分 QPS 和配额
+    :return: [(该任务使用的 Key 列表, 份额)]，份额为 1 表示独占
+    """
+    if len(keys) >= job_count:
+        return [(keys[i::job_count], 1.0) for i in range(job_count)]
+    sharers = [0] * len(keys)
+    for i in range(job_count):
+        sharers[i % len(keys)] += 1
+    return [([keys[i % len(keys)]], 1.0 / sharers[i % len(keys)]) for i in range(job_count)]
+
+
+def _quotas(keys, share, usage, daily_quota):
+    """按当日已用次数和份额计算各 Key 本次还可以使用的次数，None 表示不限制"""
+    if not daily_quota:
+        return None
+    quotas = {}
+    for key in keys:
+        if key in usage["exhausted"]:
+            quotas[key] = 0
+        else:
+            quotas[key] = max(int((daily_quota - usage["used"].get(key, 0)) * share), 0)
+    return quotas
+
+
+def run_city_job(job, keys, qps, quotas, backend=STORAGE_BACKEND, root=CITY_DATA_DIR, deadline=SNAPSHOT_DEADLINE):
+    """
+    在子进程中采集并保存一个城市的快照
+    :param job: CITY_JOBS 中的一项
+    :param keys: 该任务使用的 Key
+    :param qps: 每个 Key 分给该任务的QPS
+    :param quotas: 每个 Key 本次可用的次数
+    :return: 采集结果摘要
+    """
+    paths = job_paths(job, root)
+    os.makedirs(paths["dir"], exist_ok=True)
+    resolver = FreeFlowResolver(job.get("free_flow_speeds"))
+    key_pool = KeyPool(keys, qps, quotas)
+    client = get_client()
+    started = time.perf_counter()
+    with client.deadline(deadline):
+        roads = get_roads(paths["catalog"], city=job["city"], key_pool=key_pool)
+        tracker = SegmentTracker() if ROAD_DEDUP else None
+        batches = iter_city_traffic(job["city"], roads, key_pool=key_pool, resolver=resolver, observer=tracker)
+        # 统计在采集时逐批汇总，不保留整次快照的记录
+        summary = SnapshotSummary()
+        rollup = RollupUpdate(paths["rollup"])
+        cube = CubeUpdate(paths["cube"])
+        _, data_path = save_snapshot_stream(batches, backend, paths["csv"], paths["parquet"], paths["sqlite"],
+                                            paths["delta"], consumers=[summary, rollup, cube])
+    saved = 0
+    if tracker is not None:
+        _, report = update_segments(tracker.segments, paths["catalog"])
+        saved = report["saved"]
+    rollup.commit(data_path)
+    cube.commit(data_path)
+    return {
+        "name": job["name"],
+        "city": job["city"],
+        "roads": len(roads),
+        "saved_calls": saved,
+        "records": summary.records,
+        "errors": summary.errors,
+        "seconds": round(time.perf_counter() - started, 2),
+        "data_path": data_path,
+        "used": key_pool.usage,
+        "exhausted": sorted(key_pool.exhausted),
+        "http": client.stats(),
+    }
+
+
+def run_jobs(jobs=None, keys=None, processes=CITY_WORKERS, qps=AMAP_QPS, daily_quota=AMAP_DAILY_QUOTA,
+             usage_file=KEY_USAGE_FILE, backend=STORAGE_BACKEND, root=CITY_DATA_DIR,
+             initializer=None, initargs=()):
+    """
+    并行采集所有城市，结束后把各 Key 的调用次数累加到 usage_file
+    :param jobs: 城市任务列表，默认取 config.CITY_JOBS
+    :param keys: Key 列表，默认取 config.AMAP_KEYS（为空时使用 AMAP_KEY）
+    :param processes: 进程数
+    :param initializer: 子进程初始化函数（基准测试时用于指向模拟服务）
+    :return: 各城市的结果摘要列表，失败或跳过的城市包含 "error" 字段
+    """
+    jobs = CITY_JOBS if jobs is None else jobs
+    keys = list(keys or AMAP_KEYS or [AMAP_KEY])
+    usage = load_usage(usage_file)
+    plans = []
+    for job, (job_keys, share) in zip(jobs, assign_keys(len(jobs), keys)):
+        quotas = _quotas(job_keys, share, usage, daily_quota)
+        plans.append((job, job_keys, qps * share if qps else qps, quotas))
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max(min(processes, len(jobs)), 1),
+                             initializer=initializer, initargs=initargs) as executor:
+        futures = []
+        for job, job_keys, job_qps, quotas in plans:
+            if quotas is not None and not any(quotas.values()):
+                summaries.append({"name": job["name"], "city": job["city"], "error": "Key 配额已用完，跳过"})
+                continue
+            futures.append((job, executor.submit(run_city_job, job, job_keys, job_qps, quotas, backend, root)))
+        for job, future in futures:
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                traceback.print_exc()
+                summaries.append({"name": job["name"], "city": job["city"], "error": f"{type(e).__name__}: {e}"})
+
+    for summary in summaries:
+        for key, count in summary.get("used", {}).items():
+            usage["used"][key] = usage["used"].get(key, 0) + count
+        for key in summary.get("exhausted", []):
+            if key not in usage["exhausted"]:
+                usage["exhausted"].append(key)
+    save_usage(usage, usage_file)
+    return summaries
+
+
+def print_summaries(summaries):
+    for summary in summaries:
+        if "error" in summary:
+            log(f"{summary['city']}: 未完成 - {summary['error']}")
+            continue
+        used = ", ".join(f"{mask_key(key)}={count}" for key, count in summary["used"].items())
+        log(f"{summary['city']}: {summary['roads']} 条道路 (去重节省 {summary['saved_calls']} 次请求), "
+            f"{summary['records']} 条记录 "
+            f"(error {summary['errors']}), 耗时 {summary['seconds']}s, Key 用量 {used}, 数据: {summary['data_path']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多城市交通数据采集")
+    parser.add_argument("--processes", type=int, default=CITY_WORKERS, help="同时采集的城市数")
+    parser.add_argument("--city", action="append", default=None, help="只采集指定的任务名（可重复）")
+    parser.add_argument("--daemon", action="store_true", help="常驻运行，按整点对齐的间隔持续采集")
+    args = parser.parse_args()
+
+    jobs = [job for job in CITY_JOBS if args.city is None or job["name"] in args.city]
+    if not jobs:
+        parser.error("没有匹配的城市任务")
+
+    def snapshot():
+        print_summaries(run_jobs(jobs, processes=args.processes))
+
+    if args.daemon:
+        CollectorDaemon(snapshot).run()
+    else:
+        snapshot()
+
+
+if __name__ == "__main__":
+    main()
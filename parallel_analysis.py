@@ -0,0 +1,79 @@
+# parallel_analysis.py
+# 并行分析：把历史数据按 CSV 字节范围或按天切分为分片，在进程池中分别累加按道路、按小时的统计，再合并为一个 TrafficAggregator
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from config import ANALYSIS_WORKERS, ANALYSIS_SPLIT_BYTES, LOADER_CHUNK_SIZE
+from csv_utils import split_csv
+import sqlite_store
+from storage import default_data_path, is_sqlite, list_partitions
+from streaming_loader import TrafficAggregator, aggregate_traffic
+
+
+def _day_shards(days, start=None, end=None):
+    """每天一个分片 (起始时间, 结束时间, None)，首尾两天按 start/end 截断"""
+    shards = []
+    for day in days:
+        day_start = pd.Timestamp(day)
+        day_end = day_start + pd.Timedelta(days=1)
+        if start is not None:
+            day_start = max(day_start, pd.Timestamp(start))
+        if end is not None:
+            day_end = min(day_end, pd.Timestamp(end))
+        if day_start < day_end:
+            shards.append((day_start, day_end, None))
+    return shards
+
+
+def plan_shards(path=None, start=None, end=None, split_bytes=ANALYSIS_SPLIT_BYTES):
+    """
+    把数据切分为互不重叠的分片，每条记录恰好属于一个分片
+    :param path: CSV 文件、分区存储目录、变化编码存储目录或 SQLite 数据库
+    :param split_bytes: CSV 每个分片的字节数
+    :return: [(起始时间, 结束时间, 字节范围)]；CSV 按字节范围切分（时间范围仍为 start/end），其他按天切分（字节范围为 None）
+    """
+    path = path or default_data_path()
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"数据文件 {path} 不存在")
+    if os.path.isdir(path):
+        # 分区存储和变化编码存储都按天分区
+        days = [os.path.basename(directory)[len("date="):] for directory in list_partitions(path, start, end)]
+        return _day_shards(days, start, end)
+    if is_sqlite(path):
+        first, last = sqlite_store.time_range(path)
+        if first is None:
+            return []
+        days = pd.date_range(pd.Timestamp(first).normalize(), pd.Timestamp(last).normalize(), freq="D")
+        return _day_shards(days, start, end)
+    return [(start, end, byte_range) for byte_range in split_csv(path, split_bytes)]
+
+
+def _aggregate_shard(path, shard, max_age, chunksize):
+    shard_start, shard_end, byte_range = shard
+    return aggregate_traffic(path, chunksize, shard_start, shard_end, max_age, byte_range)
+
+
+def aggregate_parallel(path=None, workers=ANALYSIS_WORKERS, start=None, end=None, max_age=None,
+                       chunksize=LOADER_CHUNK_SIZE, split_bytes=ANALYSIS_SPLIT_BYTES):
+    """
+    并行读取并聚合全部数据，结果与 streaming_loader.aggregate_traffic 相同
+    各分片的总和与记录数按分片顺序相加，记录数完全一致，总和只有浮点加法顺序带来的舍入差异
+    :param workers: 进程数，None 表示CPU核数，1 或只有一个分片时在当前进程中计算
+    :param max_age: 只统计数据年龄不超过 max_age 分钟的记录，见 streaming_loader.iter_chunks
+    :return: TrafficAggregator
+    """
+    path = path or default_data_path()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    shards = plan_shards(path, start, end, split_bytes)
+    aggregator = TrafficAggregator()
+    if workers <= 1 or len(shards) <= 1:
+        for shard in shards:
+            aggregator.merge(_aggregate_shard(path, shard, max_age, chunksize))
+        return aggregator
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+        futures = [executor.submit(_aggregate_shard, path, shard, max_age, chunksize) for shard in shards]
+        for future in futures:
+            aggregator.merge(future.result())
+    return aggregator
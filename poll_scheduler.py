@@ -0,0 +1,162 @@
+# poll_scheduler.py
+# 自适应轮询：每条道路单独的请求间隔，拥堵或延时指数变化大时缩短、平稳时逐渐放宽，全部请求控制在每日预算内；
+# 本次快照未请求的道路沿用上一次请求到的记录，并用 sampled_at 标明实际请求时间
+import json
+import math
+import os
+from datetime import datetime
+
+from config import (AMAP_KEYS, AMAP_DAILY_QUOTA, COLLECT_INTERVAL_MINUTES, POLL_MAX_INTERVAL_MINUTES,
+                    POLL_CHANGE_THRESHOLD, POLL_CONGESTED_STATUS, POLL_DAILY_BUDGET, POLL_STATE_FILE)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+MINUTES_PER_DAY = 24 * 60
+
+
+def default_budget():
+    """每日请求预算：未配置时按所有 Key 的每日配额计算"""
+    if POLL_DAILY_BUDGET is not None:
+        return POLL_DAILY_BUDGET
+    return AMAP_DAILY_QUOTA * max(len(AMAP_KEYS), 1)
+
+
+def load_state(path=POLL_STATE_FILE):
+    """
+    读取轮询状态，文件不存在时返回空状态
+    :return: {"roads": {道路: {"interval", "sampled_at", "delay_index", "status", "records"}}}
+    """
+    if not os.path.exists(path):
+        return {"roads": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state, path=POLL_STATE_FILE):
+    """原子写入轮询状态，先写临时文件再替换"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _max_status(records):
+    statuses = [int(r["status"]) for r in records if str(r.get("status", "")).isdigit()]
+    return max(statuses, default=0)
+
+
+def _mean_delay(records):
+    values = [float(r["delay_index"]) for r in records if r.get("delay_index") is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+
+class PollScheduler:
+    """
+    按道路安排请求：
+    - 拥堵（任一路段 status >= congested_status）或平均延时指数变化超过 change_threshold 时，间隔减半，最短为一个采集周期
+    - 否则每次请求后间隔放宽一个采集周期，最长 max_interval 分钟
+    - 全部道路按各自间隔每天需要的请求数超过 daily_budget 时，所有间隔按同一比例拉长；
+      单次快照的请求数也不超过预算按采集周期平均分摊的份额，超出时优先请求逾期最久的道路
+    请求失败的道路不更新状态，下一次快照重试
+    用法:
+        queries, carried = scheduler.plan(roads)
+        ... 请求 queries，每条道路的结果交给 scheduler(road, records) ...
+        scheduler.commit(快照时间戳)
+    :param tick: 采集间隔（分钟）
+    """
+
+    def __init__(self, path=POLL_STATE_FILE, tick=COLLECT_INTERVAL_MINUTES, max_interval=POLL_MAX_INTERVAL_MINUTES,
+                 change_threshold=POLL_CHANGE_THRESHOLD, congested_status=POLL_CONGESTED_STATUS, daily_budget=None):
+        self.path = path
+        self.tick = tick
+        self.max_interval = max(max_interval, tick)
+        self.change_threshold = change_threshold
+        self.congested_status = congested_status
+        self.daily_budget = default_budget() if daily_budget is None else daily_budget
+        self.state = load_state(path)
+        self.stretch = 1.0
+        self._observed = {}
+
+    def _interval(self, road):
+        entry = self.state["roads"].get(road)
+        return entry["interval"] if entry else self.tick
+
+    def daily_calls(self, roads):
+        """按当前间隔（未拉长），全部道路每天需要的请求数"""
+        return sum(MINUTES_PER_DAY / self._interval(road) for road in roads)
+
+    def plan(self, roads, now=None):
+        """
+        选出本次快照需要请求的道路
+        :param roads: 全部道路
+        :return: (需要请求的道路列表（保持输入顺序）, 沿用上一次数据的记录列表)
+        """
+        now = now or datetime.now()
+        self.stretch = max(1.0, self.daily_calls(roads) / self.daily_budget) if self.daily_budget else 1.0
+        per_snapshot = max(1, math.floor(self.daily_budget * self.tick / MINUTES_PER_DAY)) \
+            if self.daily_budget else len(roads)
+
+        overdue = []
+        for index, road in enumerate(roads):
+            entry = self.state["roads"].get(road)
+            if entry is None or not entry.get("records"):
+                overdue.append((math.inf, index))
+                continue
+            elapsed = (now - datetime.strptime(entry["sampled_at"], TIME_FORMAT)).total_seconds() / 60
+            # 半个采集周期的余量，避免采集耗时的抖动导致刚好错过
+            ratio = (elapsed + self.tick / 2) / (entry["interval"] * self.stretch)
+            if ratio >= 1:
+                overdue.append((ratio, index))
+        overdue.sort(key=lambda item: -item[0])
+        due = sorted(index for _, index in overdue[:per_snapshot])
+
+        due_roads = set(roads[index] for index in due)
+        carried = []
+        for road in roads:
+            entry = self.state["roads"].get(road)
+            if road in due_roads or entry is None:
+                continue
+            for record in entry["records"]:
+                carried.append(dict(record, sampled_at=entry["sampled_at"]))
+        return [roads[index] for index in due], carried
+
+    def __call__(self, road, records):
+        """记录一条道路的请求结果，调整其请求间隔（作为 traffic_fetcher.iter_city_traffic 的 observer）"""
+        ok = [r for r in records if r.get("status") != "error"]
+        if not ok:
+            return records
+        entry = self.state["roads"].get(road)
+        interval = entry["interval"] if entry else self.tick
+        delay = _mean_delay(ok)
+        status = _max_status(ok)
+        changing = (entry is not None and entry.get("delay_index") is not None and delay is not None
+                    and abs(delay - entry["delay_index"]) > self.change_threshold)
+        if status >= self.congested_status or changing:
+            interval = max(self.tick, interval // 2 // self.tick * self.tick)
+        elif entry is not None:
+            interval = min(self.max_interval, interval + self.tick)
+        self._observed[road] = {
+            "interval": interval,
+            "delay_index": delay,
+            "status": status,
+            "records": [{k: v for k, v in r.items() if k not in ("timestamp", "sampled_at")} for r in ok],
+        }
+        return records
+
+    def commit(self, timestamp):
+        """快照保存后调用：本次请求到的道路以快照时间作为 sampled_at 写入状态文件"""
+        for road, entry in self._observed.items():
+            entry["sampled_at"] = timestamp
+            self.state["roads"][road] = entry
+        self._observed = {}
+        save_state(self.state, self.path)
+
+    def summary(self, roads, queries):
+        """本次快照的轮询情况"""
+        return {
+            "roads": len(roads),
+            "polled": len(queries),
+            "carried": len(roads) - len(queries),
+            "daily_calls": round(self.daily_calls(roads) / self.stretch),
+            "daily_budget": self.daily_budget,
+            "stretch": round(self.stretch, 2),
+        }
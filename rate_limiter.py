@@ -0,0 +1,55 @@
+# rate_limiter.py
+# 令牌桶限流器，用于把并发请求控制在高德API的单Key QPS配额以内
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+    :param rate: 每秒补充的令牌数（即允许的QPS）
+    :param capacity: 桶容量（允许的瞬时突发量），默认等于 rate
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate 必须大于0")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """尝试立即取出令牌，成功返回 True，不阻塞"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """
+        取出令牌，令牌不足时阻塞等待
+        :param tokens: 需要的令牌数
+        :return: 实际等待的秒数
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                # 计算补足令牌还需要的时间，在锁外休眠
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,289 @@
+# road_catalog.py
+# 道路目录缓存：把POI检索到的道路名称保存在本地，采集时直接读取
+# 同一条道路的多个POI名称（出入口、分段、括号说明）规范化后只请求一次；
+# 规范化后仍然返回相同路段的名称，根据实际响应识别出来，之后也不再重复请求
+import argparse
+import json
+import os
+import re
+import unicodedata
+from datetime import datetime, timedelta
+
+from config import ROAD_CATALOG_FILE, ROAD_CATALOG_TTL_HOURS, ROAD_FETCH_PAGES, ROAD_DEDUP, ROAD_DEDUP_RECHECK_HOURS
+from road_fetcher import fetch_roads
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 名称末尾的括号说明，例如 "五四路(北段)"、"杨桥路（辅路）"
+_BRACKET_SUFFIX = re.compile(r"[(\[（【][^)\]）】]*[)\]）】]$")
+# 道路名后面的分段、出入口说明，例如 "五四路北段"、"福马路2段"、"二环路入口"、"杨桥路辅路"
+_SECTION_SUFFIX = re.compile(r"(?<=[路街道巷桥])(?:[东西南北中上下]段|[一二三四五六七八九十\d]+段|"
+                             r"[东西南北]?(?:入口|出口|匝道|辅路|路口|口))$")
+
+
+def canonical_name(name):
+    """
+    道路名称规范化：统一全角/半角、去除空白、末尾括号说明和分段/出入口说明
+    :param name: POI名称
+    :return: 规范化后的名称
+    """
+    text = unicodedata.normalize("NFKC", name)
+    text = re.sub(r"\s+", "", text)
+    while True:
+        stripped = _SECTION_SUFFIX.sub("", _BRACKET_SUFFIX.sub("", text))
+        if stripped == text or not stripped:
+            break
+        text = stripped
+    return text
+
+
+def load_catalog(path=ROAD_CATALOG_FILE):
+    """
+    读取道路目录，文件不存在时返回空目录
+    :return: {"refreshed_at": 时间字符串或None, "roads": {名称: {...}}, "queries": {查询名称: {...}}}
+    """
+    if not os.path.exists(path):
+        return {"refreshed_at": None, "roads": {}, "queries": {}}
+    with open(path, encoding="utf-8") as f:
+        catalog = json.load(f)
+    # 旧版本的目录没有按响应学习到的查询信息
+    catalog.setdefault("queries", {})
+    return catalog
+
+
+def save_catalog(catalog, path=ROAD_CATALOG_FILE):
+    """原子写入道路目录，先写临时文件再替换，避免写到一半被读取"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def merge_roads(catalog, names, now=None):
+    """
+    将新检索到的道路合并进目录：新道路追加，已有道路只更新 last_seen
+    :param catalog: 道路目录
+    :param names: 本次检索到的道路名称列表
+    :return: 新增的道路数量
+    """
+    now = (now or datetime.now()).strftime(TIME_FORMAT)
+    roads = catalog["roads"]
+    added = 0
+    for name in names:
+        entry = roads.get(name)
+        if entry is None:
+            roads[name] = {
+                "canonical": canonical_name(name),
+                "first_seen": now,
+                "last_seen": now,
+            }
+            added += 1
+        else:
+            entry["last_seen"] = now
+    catalog["refreshed_at"] = now
+    return added
+
+
+def is_stale(catalog, ttl_hours=ROAD_CATALOG_TTL_HOURS, now=None):
+    """目录为空或超过有效期时返回 True"""
+    if not catalog["roads"] or not catalog.get("refreshed_at"):
+        return True
+    refreshed_at = datetime.strptime(catalog["refreshed_at"], TIME_FORMAT)
+    return (now or datetime.now()) - refreshed_at > timedelta(hours=ttl_hours)
+
+
+def refresh_catalog(path=ROAD_CATALOG_FILE, pages=ROAD_FETCH_PAGES, keyword="道路", city="福州市", key=None,
+                    key_pool=None):
+    """
+    重新检索POI并合并到目录；检索失败时抛出 road_fetcher.RoadFetchError，目录和刷新时间都不变
+    :param city: 检索的城市
+    :param key: 检索使用的 API Key，默认取 config.AMAP_KEY
+    :param key_pool: 可选的 Key 池，见 road_fetcher.fetch_roads
+    :return: (目录, 新增道路数)
+    """
+    catalog = load_catalog(path)
+    names = fetch_roads(city, keyword=keyword, pages=pages, key=key, key_pool=key_pool)
+    added = merge_roads(catalog, names)
+    save_catalog(catalog, path)
+    return catalog, added
+
+
+def _is_covered(entry, now, recheck_hours):
+    """根据响应判定为重复、且判定时间未超过 recheck_hours"""
+    if not entry.get("covered_by") or not entry.get("learned_at"):
+        return False
+    learned_at = datetime.strptime(entry["learned_at"], TIME_FORMAT)
+    return now - learned_at <= timedelta(hours=recheck_hours)
+
+
+def plan_queries(catalog, recheck_hours=ROAD_DEDUP_RECHECK_HOURS, now=None):
+    """
+    规范化去重后本次快照需要请求的道路名称
+    :return: 查询名称列表，按目录中首次出现的顺序
+    """
+    now = now or datetime.now()
+    queries = []
+    seen = set()
+    for name in catalog["roads"]:
+        # 每次重新计算，规范化规则更新后旧目录也能生效
+        query = canonical_name(name)
+        if query in seen:
+            continue
+        seen.add(query)
+        if not _is_covered(catalog["queries"].get(query, {}), now, recheck_hours):
+            queries.append(query)
+    return queries
+
+
+def dedup_report(catalog, recheck_hours=ROAD_DEDUP_RECHECK_HOURS, now=None):
+    """
+    规范化去重的效果
+    :return: {"poi_names": POI名称数, "canonical": 规范化后的名称数, "learned": 按响应判定为重复的名称数,
+              "queries": 每次快照的请求数, "saved": 每次快照节省的请求数}
+    """
+    queries = plan_queries(catalog, recheck_hours, now)
+    canonical = len({canonical_name(name) for name in catalog["roads"]})
+    return {
+        "poi_names": len(catalog["roads"]),
+        "canonical": canonical,
+        "learned": canonical - len(queries),
+        "queries": len(queries),
+        "saved": len(catalog["roads"]) - len(queries),
+    }
+
+
+def _segment_key(record):
+    # 同一道路同一方向可能有多个路段，需要按路段标识区分
+    return record.get("road_name"), record.get("direction"), record.get("segment")
+
+
+class SegmentTracker:
+    """
+    记录一次快照中每个查询名称返回的路段（道路名+方向+路段标识，与 tile_collector.segment_key 一致），
+    供 learn_segments 判断哪些名称返回的是同一条道路；
+    同时去掉与前面查询重复的路段记录，避免同一路段在一次快照中保存两次
+    作为 traffic_fetcher.iter_city_traffic 的 observer 使用，在调用方线程中按道路顺序调用
+    """
+
+    def __init__(self):
+        self.segments = {}
+        self.duplicates = 0
+        self._seen = set()
+
+    def __call__(self, road, records):
+        ok = [r for r in records if r.get("status") != "error"]
+        if not ok:
+            return records
+        self.segments[road] = sorted({_segment_key(r) for r in ok}, key=str)
+        return self.drop_seen(ok)
+
+    def drop_seen(self, records):
+        """
+        去掉本次快照中已经出现过的路段记录（自适应轮询沿用的记录在全部请求完成后也经过这里）
+        :return: 保留的记录
+        """
+        kept = []
+        for record in records:
+            key = _segment_key(record)
+            if key not in self._seen:
+                self._seen.add(key)
+                kept.append(record)
+        self.duplicates += len(records) - len(kept)
+        return kept
+
+
+def learn_segments(catalog, segments, now=None):
+    """
+    根据本次快照的响应更新重复判定：返回的路段完全被其他查询覆盖的名称记为重复（covered_by）
+    按返回路段数从多到少依次选取，路段多的名称优先保留
+    :param segments: {查询名称: [(道路名, 方向, 路段标识), ...]}，见 SegmentTracker；
+                     旧目录中只有 (道路名, 方向) 的记录不会与新记录匹配，对应名称会重新请求一次后按新格式判定
+    :return: 新判定为重复的名称数
+    """
+    now = (now or datetime.now()).strftime(TIME_FORMAT)
+    queries = catalog["queries"]
+    for query, keys in segments.items():
+        queries[query] = {"segments": [list(key) for key in keys], "covered_by": None, "learned_at": now}
+
+    known = sorted(((query, {tuple(key) for key in entry["segments"]}) for query, entry in queries.items()
+                    if entry.get("segments")), key=lambda item: (-len(item[1]), item[0]))
+    owner = {}
+    added = 0
+    for query, keys in known:
+        if keys and all(key in owner for key in keys):
+            covered_by = owner[next(iter(sorted(keys, key=str)))]
+            if queries[query].get("covered_by") is None:
+                added += 1
+            queries[query]["covered_by"] = covered_by
+        else:
+            queries[query]["covered_by"] = None
+            for key in keys:
+                owner.setdefault(key, query)
+    return added
+
+
+def update_segments(segments, path=ROAD_CATALOG_FILE):
+    """
+    读取目录、用本次快照的响应更新重复判定并保存
+    :return: (新判定为重复的名称数, 更新后的 dedup_report)
+    """
+    catalog = load_catalog(path)
+    added = learn_segments(catalog, segments)
+    save_catalog(catalog, path)
+    return added, dedup_report(catalog)
+
+
+def get_roads(path=ROAD_CATALOG_FILE, ttl_hours=ROAD_CATALOG_TTL_HOURS, pages=ROAD_FETCH_PAGES, city="福州市",
+              key=None, dedup=ROAD_DEDUP, key_pool=None):
+    """
+    获取采集用的道路列表：目录有效时直接读取，过期或不存在时自动刷新
+    刷新失败但本地仍有旧目录时，继续使用旧目录
+    :param city: 目录对应的城市，每个城市应使用单独的目录文件
+    :param dedup: 是否返回规范化去重后的查询名称（见 plan_queries），否则返回全部POI名称
+    :param key_pool: 可选的 Key 池，刷新目录的POI检索也计入 Key 池的调用次数
+    :return: 道路名称列表
+    """
+    catalog = load_catalog(path)
+    if is_stale(catalog, ttl_hours):
+        try:
+            catalog, added = refresh_catalog(path, pages, city=city, key=key, key_pool=key_pool)
+            print(f"道路目录已刷新，新增 {added} 条道路")
+        except Exception as e:
+            if not catalog["roads"]:
+                raise
+            print(f"道路目录刷新失败，继续使用旧目录: {e}")
+    if not dedup:
+        return list(catalog["roads"])
+    return plan_queries(catalog)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="道路目录缓存管理")
+    parser.add_argument("command", choices=["refresh", "show", "report"],
+                        help="refresh: 重新检索并合并; show: 查看目录; report: 查看规范化去重节省的请求数")
+    parser.add_argument("--file", default=ROAD_CATALOG_FILE, help="目录文件路径")
+    parser.add_argument("--pages", type=int, default=ROAD_FETCH_PAGES, help="检索的POI页数")
+    parser.add_argument("--city", default="福州市", help="检索的城市")
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        catalog, added = refresh_catalog(args.file, args.pages, city=args.city)
+        print(f"共 {len(catalog['roads'])} 条道路，本次新增 {added} 条")
+    elif args.command == "report":
+        catalog = load_catalog(args.file)
+        report = dedup_report(catalog)
+        print(f"POI名称 {report['poi_names']} 个，规范化后 {report['canonical']} 个，"
+              f"按响应判定为重复 {report['learned']} 个")
+        print(f"每次快照请求 {report['queries']} 次，节省 {report['saved']} 次")
+        for query, entry in sorted(catalog["queries"].items()):
+            if entry.get("covered_by"):
+                print(f"{query}\t与 {entry['covered_by']} 返回相同路段\t{entry['learned_at']}")
+    else:
+        catalog = load_catalog(args.file)
+        print(f"最后刷新时间: {catalog.get('refreshed_at')}，共 {len(catalog['roads'])} 条道路")
+        for name, entry in catalog["roads"].items():
+            print(f"{name}\t{canonical_name(name)}\t{entry['first_seen']}\t{entry['last_seen']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,27 @@
 # road_delay_analysis.py
 # 道路拥堵指数统计条形图
 
-import pandas as pd
 import numpy as np
 from pyecharts import options as opts
 from pyecharts.charts import Bar
+import argparse
 import os
+import re
+from storage import load_traffic, default_data_path
+from rollup_store import RollupStore
+from congestion_cube import CongestionCube
+from parallel_analysis import aggregate_parallel
+from chart_render import cap_top_n, paginate, render_if_changed
+from config import ROLLUP_FILE, CUBE_DIR, CHART_MAX_BARS, CHART_PAGE_SIZE, ANALYSIS_WORKERS
 
+PAGES_DIR = "road_delay_pages"
+# 分页文件名，页码位数超过3位时也能正确解析，例如 page_1000.html
+PAGE_FILE = re.compile(r"page_(\d+)\.html")
 
-def load_data(file_path="fuzhou_traffic.csv"):
-    """读取交通数据CSV文件"""
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"数据文件 {file_path} 不存在")
 
-    df = pd.read_csv(file_path)
-    return df
+def load_data(file_path="fuzhou_traffic.csv", start=None, end=None, columns=None):
+    """读取交通数据（CSV文件、分区存储目录、变化编码存储目录或SQLite数据库），可按时间范围和列筛选"""
+    return load_traffic(file_path, start=start, end=end, columns=columns)
 
 
 def calculate_total_delay_index(df):
@@ -26,8 +33,9 @@ def calculate_total_delay_index(df):
     return road_delay
 
 
-def create_minimalist_bar_chart(road_delay, title="福州道路拥堵指数前10"):
-    """创建简约风格条形统计图"""
+def create_minimalist_bar_chart(road_delay, title="福州道路拥堵指数前10", max_bars=CHART_MAX_BARS):
+    """创建简约风格条形统计图，道路数超过 max_bars 时其余道路合并为“其他”"""
+    road_delay = cap_top_n(road_delay, max_bars)
     # 提取道路名称和拥堵指数
     road_names = road_delay['road_name'].tolist()
     delay_values = [round(val, 2) for val in road_delay['delay_index'].tolist()]
@@ -150,8 +158,9 @@ def create_top_n_bar_chart(road_delay, n=15, title="福州道路24小时拥堵
     return bar
 
 
-def create_full_rounded_bar_chart(road_delay, title="福州道路24小时拥堵指数统计"):
-    """创建完整圆角条形统计图（所有道路）"""
+def create_full_rounded_bar_chart(road_delay, title="福州道路24小时拥堵指数统计", max_bars=CHART_MAX_BARS):
+    """创建完整圆角条形统计图（所有道路），道路数超过 max_bars 时其余道路合并为“其他”"""
+    road_delay = cap_top_n(road_delay, max_bars)
     # 提取道路名称和拥堵指数
     road_names = road_delay['road_name'].tolist()
     delay_values = [round(val, 2) for val in road_delay['delay_index'].tolist()]
@@ -217,30 +226,70 @@ def create_full_rounded_bar_chart(road_delay, title="福州道路24小时拥堵
 
     return bar
 
-def main():
-    try:
-        # 1. 读取数据
-        print("正在读取数据...")
-        df = load_data("fuzhou_traffic.csv")
-        print(f"成功读取 {len(df)} 条记录")
+def render_pages(road_delay, page_size=CHART_PAGE_SIZE, pages_dir=PAGES_DIR):
+    """
+    按拥堵指数排名分页渲染全部道路
+    :return: 重新渲染的页数
+    """
+    os.makedirs(pages_dir, exist_ok=True)
+    pages = paginate(road_delay.reset_index(drop=True), page_size)
+    rendered = 0
+    for page, page_df in pages:
+        title = f"福州道路拥堵指数统计（第{page}/{len(pages)}页）"
+        output_file = os.path.join(pages_dir, f"page_{page:03d}.html")
+        if render_if_changed(lambda: create_full_rounded_bar_chart(page_df, title, max_bars=None), output_file,
+                             "rounded_page", page_df, title):
+            rendered += 1
+    # 道路减少时删除多余的旧页面
+    for name in os.listdir(pages_dir):
+        match = PAGE_FILE.fullmatch(name)
+        if match and int(match.group(1)) > len(pages):
+            os.remove(os.path.join(pages_dir, name))
+    return rendered
+
 
-        # 2. 计算每条道路的拥堵指数总和
-        print("正在计算道路拥堵指数总和...")
-        road_delay = calculate_total_delay_index(df)
+def main(scan=False, workers=ANALYSIS_WORKERS):
+    """
+    :param scan: 不使用拥堵立方体和汇总统计，直接扫描全部历史数据
+    :param workers: 扫描历史数据时的进程数，None 表示CPU核数
+    """
+    try:
+        if os.path.isdir(CUBE_DIR) and not scan:
+            # 1-2. 从拥堵立方体汇总（逐天合并，不读取原始数据）
+            print(f"正在读取拥堵立方体 {CUBE_DIR}...")
+            road_delay = CongestionCube.load(CUBE_DIR, keep_dates=False).road_delay()
+        elif os.path.exists(ROLLUP_FILE) and not scan:
+            # 1-2. 直接读取采集时增量维护的汇总统计，无需扫描历史数据
+            print(f"正在读取汇总统计 {ROLLUP_FILE}...")
+            road_delay = RollupStore.load(ROLLUP_FILE).road_delay()
+        else:
+            # 1-2. 把历史数据切分为多个分片，在多个进程中分块读取并累加每条道路的拥堵指数总和后合并
+            print("正在分块读取数据并计算道路拥堵指数总和...")
+            aggregator = aggregate_parallel(default_data_path(), workers)
+            print(f"成功读取 {aggregator.rows} 条记录")
+            road_delay = aggregator.road_delay()
         print(f"共统计了 {len(road_delay)} 条道路")
 
-        # 3. 创建两种图表
+        # 3. 创建图表（统计结果与上次渲染相同时跳过）
         print("正在生成可视化图表...")
 
-        # 简约风格完整图表（包含所有道路，可缩放）
-        bar_chart_full = create_minimalist_bar_chart(road_delay)
-        bar_chart_full.render("road_delay_full.html")
-        print("完整图表已保存至: road_delay_full.html")
+        # 简约风格完整图表（前 CHART_MAX_BARS 条道路 + “其他”，可缩放）
+        if render_if_changed(lambda: create_minimalist_bar_chart(road_delay), "road_delay_full.html",
+                             "minimalist", road_delay, CHART_MAX_BARS):
+            print("完整图表已保存至: road_delay_full.html")
+        else:
+            print("统计结果未变化，跳过: road_delay_full.html")
 
         # 前10条道路的图表
-        bar_chart_top = create_top_n_bar_chart(road_delay, 10)
-        bar_chart_top.render("road_delay_top10.html")
-        print("TOP15图表已保存至: road_delay_top10.html")
+        if render_if_changed(lambda: create_top_n_bar_chart(road_delay, 10), "road_delay_top10.html",
+                             "top_n", road_delay.head(10)):
+            print("TOP10图表已保存至: road_delay_top10.html")
+        else:
+            print("统计结果未变化，跳过: road_delay_top10.html")
+
+        # 全部道路分页渲染，每页 CHART_PAGE_SIZE 条，只重新渲染内容变化的页面
+        rendered = render_pages(road_delay)
+        print(f"分页图表已保存至: {PAGES_DIR}/（重新渲染 {rendered} 页）")
 
         # 4. 打印统计结果
         print("\n道路拥堵指数统计（前10条）：")
@@ -256,4 +305,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="道路拥堵指数统计")
+    parser.add_argument("--scan", action="store_true", help="不使用拥堵立方体和汇总统计，直接扫描全部历史数据")
+    parser.add_argument("--workers", type=int, default=ANALYSIS_WORKERS, help="扫描历史数据时的进程数，默认为CPU核数")
+    args = parser.parse_args()
+    main(args.scan, args.workers)
\ No newline at end of file
@@ -1,34 +1,60 @@
 # road_fetcher.py
-import requests
 from config import AMAP_KEY
+from http_client import get_client
+import metrics
 
 BASE_URL = "https://restapi.amap.com/v3/place/text"
 
-def fetch_roads_in_fuzhou(keyword="道路", pages=5):
+
+class RoadFetchError(RuntimeError):
+    """POI检索第一页就失败（Key 无效、配额用完等），没有取到任何道路"""
+
+def _get_page(params, key, key_pool):
+    if key_pool is None:
+        return get_client().get_json(BASE_URL, dict(params, key=key or AMAP_KEY))
+    return key_pool.request(lambda pool_key, on_retry: get_client().get_json(BASE_URL, dict(params, key=pool_key),
+                                                                               on_retry))
+
+
+def fetch_roads(city, keyword="道路", pages=5, key=None, key_pool=None):
     """
-    获取福州市的道路名称（POI检索）
+    获取指定城市的道路名称（POI检索）
+    :param city: 城市名，例如 "福州市"
     :param keyword: 搜索关键字，默认“道路”
     :param pages: 爬取页数（每页最多50条）
+    :param key: 使用的 API Key，默认取 config.AMAP_KEY
+    :param key_pool: 可选的 Key 池，使用时每页（包括重试）都由 Key 池限流并计数，忽略 key
     :return: 道路名称列表
+    :raises RoadFetchError: 第一页请求失败；之后的页失败时返回已取到的道路
     """
     roads = []
+    seen = set()  # 用集合判重，避免在列表上逐个比较
     for page in range(1, pages + 1):
         params = {
-            "key": AMAP_KEY,
             "keywords": keyword,
-            "city": "福州市",
+            "city": city,
             "types": "1903",  # 城市道路
             "offset": 50,
             "page": page
         }
-        response = requests.get(BASE_URL, params=params, timeout=10).json()
+        with metrics.timer("amap_request_seconds", api="place_text"):
+            response = _get_page(params, key, key_pool)
+        metrics.record_response("place_text", response)
         if response.get("status") != "1":
+            if page == 1:
+                raise RoadFetchError(f"POI检索失败: {response.get('info')} ({response.get('infocode')})")
             break
         pois = response.get("pois", [])
         if not pois:
             break
         for poi in pois:
             name = poi.get("name")
-            if name and name not in roads:
+            if name and name not in seen:
+                seen.add(name)
                 roads.append(name)
     return roads
+
+
+def fetch_roads_in_fuzhou(keyword="道路", pages=5):
+    """获取福州市的道路名称（POI检索）"""
+    return fetch_roads("福州市", keyword, pages)
@@ -0,0 +1,277 @@
+# rollup_store.py
+# 增量汇总存储：每次写入快照时同步更新按道路、按小时的统计量，分析时无需重新扫描历史数据
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import ROLLUP_FILE
+from storage import load_traffic, default_data_path
+
+METRICS = ["delay_index", "speed"]
+STATS = ["count", "sum", "sumsq", "min", "max"]
+
+
+def _empty_stats():
+    return {"count": 0, "sum": 0.0, "sumsq": 0.0, "min": None, "max": None}
+
+
+def _to_float(value):
+    """把记录中的数值（可能是字符串或None）转为 float，无效值返回 None"""
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def _add(stats, value):
+    stats["count"] += 1
+    stats["sum"] += value
+    stats["sumsq"] += value * value
+    stats["min"] = value if stats["min"] is None else min(stats["min"], value)
+    stats["max"] = value if stats["max"] is None else max(stats["max"], value)
+
+
+def _merge(stats, other):
+    stats["count"] += other["count"]
+    stats["sum"] += other["sum"]
+    stats["sumsq"] += other["sumsq"]
+    for name, pick in (("min", min), ("max", max)):
+        if other[name] is not None:
+            stats[name] = other[name] if stats[name] is None else pick(stats[name], other[name])
+
+
+def _hour_of(timestamp):
+    # 时间戳格式为 "%Y-%m-%d %H:%M:%S"，也兼容 datetime/Timestamp
+    if isinstance(timestamp, str):
+        return int(timestamp[11:13])
+    return int(timestamp.hour)
+
+
+class RollupStore:
+    """
+    按道路和按小时的增量统计：count、sum、sumsq、min、max
+    统计的指标为 delay_index 和 speed
+    文件大小只与道路数、小时数有关；按快照的时间序列由看板分片提供（见 dashboard.load_timeline）
+    """
+
+    def __init__(self, path=ROLLUP_FILE):
+        self.path = path
+        self.data = {"rows": 0, "roads": {}, "hours": {}}
+
+    @classmethod
+    def load(cls, path=ROLLUP_FILE):
+        store = cls(path)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                store.data = json.load(f)
+            # 旧版本的统计文件带有按快照的 timeline，会随快照数不断增大，下次保存时去掉
+            store.data.pop("timeline", None)
+        return store
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _group(self, table, key):
+        group = self.data[table].get(key)
+        if group is None:
+            group = {metric: _empty_stats() for metric in METRICS}
+            self.data[table][key] = group
+        return group
+
+    def update(self, records):
+        """
+        将一次快照的记录累加到统计中，记录需已带有 timestamp（保存后会自动写入）
+        :param records: 交通数据列表
+        """
+        for record in records:
+            values = {metric: _to_float(record.get(metric)) for metric in METRICS}
+            targets = [self._group("hours", str(_hour_of(record["timestamp"])))]
+            if record.get("road_name"):
+                targets.append(self._group("roads", record["road_name"]))
+            for group in targets:
+                for metric, value in values.items():
+                    if value is not None:
+                        _add(group[metric], value)
+            self.data["rows"] += 1
+
+    def merge(self, other):
+        """合并另一份统计（如 RollupUpdate 累加的一次快照的增量）"""
+        for table in ("roads", "hours"):
+            for key, group in other.data[table].items():
+                target = self._group(table, key)
+                for metric, stats in group.items():
+                    _merge(target[metric], stats)
+        self.data["rows"] += other.data["rows"]
+
+    @classmethod
+    def from_frame(cls, df, path=ROLLUP_FILE):
+        """
+        根据原始数据一次性重建统计
+        :param df: 至少包含 timestamp、road_name、delay_index、speed 列
+        """
+        store = cls(path)
+        store.data = {
+            "rows": int(len(df)),
+            "roads": _aggregate(df, df["road_name"].astype("object")),
+            "hours": _aggregate(df, df["timestamp"].dt.hour.astype(str)),
+        }
+        return store
+
+    def frame(self, table, metric="delay_index", stat="sum"):
+        """
+        将某个统计量导出为 DataFrame
+        :param table: "roads" 或 "hours"
+        :return: 两列 DataFrame：键列（road_name 或 hour）和指标列
+        """
+        key_column = "road_name" if table == "roads" else "hour"
+        rows = []
+        for key, group in self.data[table].items():
+            stats = group[metric]
+            if stats["count"] == 0:
+                continue
+            value = stats["sum"] / stats["count"] if stat == "mean" else stats[stat]
+            rows.append((int(key) if table == "hours" else key, value))
+        return pd.DataFrame(rows, columns=[key_column, metric])
+
+    def road_delay(self):
+        """与 calculate_total_delay_index 结果一致：每条道路的拥堵指数总和，从高到低排序"""
+        df = self.frame("roads", "delay_index", "sum")
+        return df.sort_values("delay_index", ascending=False).reset_index(drop=True)
+
+    def hourly_delay(self):
+        """与 calculate_hourly_traffic_index 结果一致：每小时的拥堵指数总和，按小时排序"""
+        df = self.frame("hours", "delay_index", "sum")
+        return df.sort_values("hour").reset_index(drop=True)
+
+
+def _aggregate(df, keys):
+    """按键分组，计算每个指标的 count/sum/sumsq/min/max"""
+    result = {}
+    for metric in METRICS:
+        values = pd.to_numeric(df[metric], errors="coerce")
+        grouped = pd.DataFrame({"key": keys, "v": values, "sq": values * values}).dropna(subset=["key"])
+        agg = grouped.groupby("key", sort=False).agg(
+            count=("v", "count"), sum=("v", "sum"), sumsq=("sq", "sum"), min=("v", "min"), max=("v", "max"))
+        for key, row in agg.iterrows():
+            group = result.setdefault(str(key), {m: _empty_stats() for m in METRICS})
+            count = int(row["count"])
+            if count == 0:
+                continue
+            group[metric] = {
+                "count": count,
+                "sum": float(row["sum"]),
+                "sumsq": float(row["sumsq"]),
+                "min": float(row["min"]),
+                "max": float(row["max"]),
+            }
+    return result
+
+
+class RollupUpdate:
+    """
+    一次快照的增量统计：每批记录保存后调用 add 累加到内存中的增量，快照提交后调用 commit 合并到统计文件
+    增量的大小只与本次快照涉及的道路数有关；快照保存失败时不调用 commit，统计文件保持不变
+    :param path: 统计文件
+    """
+
+    def __init__(self, path=ROLLUP_FILE):
+        self.path = path
+        self.delta = RollupStore(path)
+
+    def add(self, records):
+        """累加一批已保存（带 timestamp）的记录"""
+        self.delta.update(records)
+
+    def commit(self, data_path=None):
+        """
+        合并到统计文件；统计文件不存在而历史数据已存在时，先从历史数据重建一次，保证统计覆盖全部数据
+        :param data_path: 原始数据路径，用于首次重建
+        """
+        if not os.path.exists(self.path):
+            data_path = data_path or default_data_path()
+            df = load_traffic(data_path, columns=["timestamp", "road_name", "delay_index", "speed"])
+            # 本次快照已经写入原始数据，重建结果已包含它
+            store = RollupStore.from_frame(df, self.path)
+        else:
+            store = RollupStore.load(self.path)
+            store.merge(self.delta)
+        store.save()
+        return store
+
+
+def update_rollup(records, data_path=None, path=ROLLUP_FILE):
+    """
+    保存一次快照后调用，增量更新统计文件（边采集边保存时用 RollupUpdate 逐批累加）
+    :param records: 本次快照（已保存、带 timestamp）的记录
+    :param data_path: 原始数据路径，用于首次重建
+    """
+    update = RollupUpdate(path)
+    update.add(records)
+    return update.commit(data_path)
+
+
+def check_consistency(data_path=None, path=ROLLUP_FILE, rtol=1e-9, atol=1e-6):
+    """
+    用原始数据完整重算一遍，与增量统计逐项比较
+    :return: 不一致项列表，为空表示一致
+    """
+    df = load_traffic(data_path or default_data_path(), columns=["timestamp", "road_name", "delay_index", "speed"])
+    expected = RollupStore.from_frame(df).data
+    actual = RollupStore.load(path).data
+    problems = []
+    if expected["rows"] != actual["rows"]:
+        problems.append(f"记录数: 重算 {expected['rows']} / 增量 {actual['rows']}")
+    for table in ("roads", "hours"):
+        for key in sorted(set(expected[table]) | set(actual[table])):
+            exp_group = expected[table].get(key)
+            act_group = actual[table].get(key)
+            if exp_group is None or act_group is None:
+                problems.append(f"{table}/{key}: 只存在于{'增量统计' if exp_group is None else '重算结果'}")
+                continue
+            for metric in METRICS:
+                for stat in STATS:
+                    exp_value = exp_group[metric][stat]
+                    act_value = act_group[metric][stat]
+                    if exp_value is None or act_value is None:
+                        same = exp_value is None and act_value is None
+                    else:
+                        same = np.isclose(exp_value, act_value, rtol=rtol, atol=atol)
+                    if not same:
+                        problems.append(f"{table}/{key}/{metric}/{stat}: 重算 {exp_value} / 增量 {act_value}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量汇总统计管理")
+    parser.add_argument("command", choices=["check", "rebuild"], help="check: 与全量重算比对; rebuild: 从原始数据重建")
+    parser.add_argument("--data", default=None, help="原始数据路径（CSV文件、分区目录或SQLite数据库）")
+    parser.add_argument("--file", default=ROLLUP_FILE, help="统计文件路径")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        df = load_traffic(args.data or default_data_path(),
+                          columns=["timestamp", "road_name", "delay_index", "speed"])
+        RollupStore.from_frame(df, args.file).save()
+        print(f"已从 {len(df)} 条记录重建统计文件 {args.file}")
+    else:
+        problems = check_consistency(args.data, args.file)
+        if problems:
+            print(f"发现 {len(problems)} 处不一致:")
+            for problem in problems[:50]:
+                print("  " + problem)
+        else:
+            print("增量统计与全量重算结果一致")
+
+
+if __name__ == "__main__":
+    main()
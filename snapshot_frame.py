@@ -0,0 +1,198 @@
+# snapshot_frame.py
+# 紧凑的快照记录容器：道路名、方向等字符串字段驻留为整数编号，速度、状态、延时指数、自由流速度保存在类型数组中，
+# 可以不复制数据地转换为 DataFrame，供需要在内存中保存快照的调用方使用
+import math
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from csv_utils import FIELDNAMES
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# 用编号保存的字符串字段
+CODE_COLUMNS = ["road_name", "direction", "status", "description"]
+# status 的常见取值，预先放入驻留表
+STATUS_VALUES = ["0", "1", "2", "3", "4", "error"]
+
+
+def code_dtype(size):
+    """
+    与 pandas 为 size 个类别选择的编号类型一致，转换为 Categorical 时编号数组不会被转换类型（复制）
+    """
+    if size < np.iinfo(np.int8).max:
+        return np.int8
+    if size < np.iinfo(np.int16).max:
+        return np.int16
+    if size < np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
+
+
+class StringPool:
+    """
+    字符串驻留表：相同的字符串只保存一份，记录中只保存编号，None 的编号为 -1
+    驻留表只追加不删除，已分配的编号不变；多次快照共享同一个驻留表时由调用方决定何时丢弃，
+    否则 description 等取值很多的字段会让驻留表一直增长
+    """
+
+    def __init__(self, values=()):
+        self.values = []
+        self._ids = {}
+        self._index = None
+        for value in values:
+            self.intern(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        if value is None:
+            return -1
+        code = self._ids.get(value)
+        if code is None:
+            code = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def categories(self, size):
+        """前 size 个字符串组成的 Index，用作 Categorical 的类别；取全部时缓存，驻留表增长后重建"""
+        if size == len(self.values):
+            if self._index is None or len(self._index) != size:
+                self._index = pd.Index(self.values, dtype="object")
+            return self._index
+        return pd.Index(self.values[:size], dtype="object")
+
+
+def new_pools():
+    return {"road_name": StringPool(), "direction": StringPool(), "status": StringPool(STATUS_VALUES),
+            "description": StringPool()}
+
+
+def _to_float(value):
+    # 高德返回的速度是字符串，空字符串等无法解析的值记为 NaN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _to_number(value):
+    """速度、自由流速度还原为记录中的值：NaN 为 None，整数值还原为 int（与原始记录写入 CSV 的格式一致）"""
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+class SnapshotFrame:
+    """
+    一次快照的全部记录，按列保存：
+    - road_name、direction、status、description：驻留表编号（int8/int16/…，与 pandas Categorical 的编号类型一致）
+    - speed：float32，delay_index、free_flow_speed：float64，缺失为 NaN
+    - sampled_at：datetime64[s]，缺失为 NaT；快照时间 timestamp 整次快照只保存一个
+    用法:
+        frame = SnapshotFrame.from_records(records)
+        df = frame.to_frame()        # 各列直接引用上面的数组，不复制
+        records = frame.to_records() # 还原为字典列表
+    :param pools: {列名: StringPool}，默认每次快照使用单独的驻留表，随快照一起释放
+    """
+
+    def __init__(self, codes, speed, delay_index, free_flow_speed, sampled_at, pools=None, timestamp=None):
+        self.codes = codes
+        self.speed = speed
+        self.delay_index = delay_index
+        self.free_flow_speed = free_flow_speed
+        self.sampled_at = sampled_at
+        self.pools = pools or new_pools()
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_records(cls, records, pools=None, timestamp=None):
+        """
+        :param records: 记录（字典）的可迭代对象，字段见 traffic_fetcher.parse_traffic_response
+        :param timestamp: 快照时间，默认取记录中的 timestamp（未保存的记录没有该字段）
+        """
+        pools = pools or new_pools()
+        interns = [(name, pools[name].intern) for name in CODE_COLUMNS]
+        codes = {name: [] for name in CODE_COLUMNS}
+        speed, delay_index, free_flow_speed, sampled_at = [], [], [], []
+        for record in records:
+            for name, intern in interns:
+                value = record.get(name)
+                codes[name].append(intern(None if value is None else str(value)))
+            speed.append(_to_float(record.get("speed")))
+            delay_index.append(_to_float(record.get("delay_index")))
+            free_flow_speed.append(_to_float(record.get("free_flow_speed")))
+            sampled_at.append(record.get("sampled_at") or "NaT")
+            if timestamp is None:
+                timestamp = record.get("timestamp")
+        return cls(
+            {name: np.array(values, dtype=code_dtype(len(pools[name]))) for name, values in codes.items()},
+            np.array(speed, dtype=np.float32),
+            np.array(delay_index, dtype=np.float64),
+            np.array(free_flow_speed, dtype=np.float64),
+            np.array(sampled_at, dtype="datetime64[s]"),
+            pools,
+            timestamp,
+        )
+
+    def __len__(self):
+        return len(self.speed)
+
+    def __iter__(self):
+        return iter(self.to_records())
+
+    @property
+    def nbytes(self):
+        """各数组占用的字节数（不含驻留表）"""
+        arrays = list(self.codes.values()) + [self.speed, self.delay_index, self.free_flow_speed, self.sampled_at]
+        return sum(array.nbytes for array in arrays)
+
+    def categorical(self, name):
+        """字符串字段的 Categorical，编号直接引用数组"""
+        codes = self.codes[name]
+        # 编号类型对应的类别数上限，驻留表在本快照之后增长的部分不会被引用
+        size = min(len(self.pools[name]), np.iinfo(codes.dtype).max - 1)
+        return pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(self.pools[name].categories(size)),
+                                         validate=False)
+
+    def to_frame(self):
+        """
+        转换为列顺序与 CSV 一致的 DataFrame，各列直接引用本对象的数组，不复制
+        只有 timestamp 列需要把一个快照时间展开为整列
+        """
+        data = {}
+        for name in FIELDNAMES:
+            if name == "timestamp":
+                data[name] = np.full(len(self), np.datetime64(self.timestamp or "NaT", "s"))
+            elif name in self.codes:
+                data[name] = self.categorical(name)
+            elif name == "sampled_at":
+                data[name] = self.sampled_at
+            else:
+                data[name] = getattr(self, name)
+        return pd.DataFrame(data, copy=False)
+
+    def to_records(self):
+        """
+        还原为记录列表；speed 还原为字符串（与高德返回的格式一致），没有 sampled_at、timestamp 的记录不含这两个字段
+        """
+        values = {name: self.pools[name].values for name in CODE_COLUMNS}
+        codes = {name: self.codes[name].tolist() for name in CODE_COLUMNS}
+        speed = self.speed.tolist()
+        delay_index = self.delay_index.tolist()
+        free_flow_speed = self.free_flow_speed.tolist()
+        sampled_at = self.sampled_at.astype(datetime).tolist()
+        records = []
+        for i in range(len(self)):
+            record = {name: None if codes[name][i] < 0 else values[name][codes[name][i]] for name in CODE_COLUMNS}
+            speed_value = _to_number(speed[i])
+            record["speed"] = None if speed_value is None else str(speed_value)
+            record["delay_index"] = None if math.isnan(delay_index[i]) else delay_index[i]
+            record["free_flow_speed"] = _to_number(free_flow_speed[i])
+            if sampled_at[i] is not None:
+                record["sampled_at"] = sampled_at[i].strftime(TIME_FORMAT)
+            if self.timestamp is not None:
+                record["timestamp"] = self.timestamp
+            records.append(record)
+        return records
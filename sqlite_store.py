@@ -0,0 +1,252 @@
+# sqlite_store.py
+# SQLite 存储后端：WAL 模式、按快照批量事务写入，(road_name, timestamp) 和 (timestamp) 索引支持按道路/按时间段快速查询
+import argparse
+import math
+import sqlite3
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from config import SQLITE_FILE, SQLITE_BATCH_SIZE, TRAFFIC_CSV_FILE
+from csv_utils import FIELDNAMES, open_committed
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS traffic (
+    timestamp TEXT NOT NULL,
+    road_name TEXT,
+    direction TEXT,
+    speed REAL,
+    status TEXT,
+    description TEXT,
+    delay_index REAL,
+    free_flow_speed REAL,
+    sampled_at TEXT
+)
+"""
+# 后续新增的列，旧数据库打开时自动补上
+ADDED_COLUMNS = {"sampled_at": "TEXT"}
+# 单条道路的时间序列走 (road_name, timestamp)，时间窗口排名和按小时统计走 (timestamp)
+INDEXES = {
+    "idx_traffic_road_time": "traffic (road_name, timestamp)",
+    "idx_traffic_time": "traffic (timestamp)",
+}
+INSERT = f"INSERT INTO traffic ({', '.join(FIELDNAMES)}) VALUES ({', '.join('?' * len(FIELDNAMES))})"
+REAL_COLUMNS = {"speed", "delay_index", "free_flow_speed"}
+
+
+def connect(path=SQLITE_FILE):
+    """
+    打开数据库并建表建索引
+    WAL 模式下写入快照时分析脚本仍可并发读取；synchronous=NORMAL 在 WAL 下只在检查点时刷盘，断电最多丢失最后一次提交
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(SCHEMA)
+    existing = table_columns(conn)
+    for column, kind in ADDED_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE traffic ADD COLUMN {column} {kind}")
+    _create_indexes(conn)
+    conn.commit()
+    return conn
+
+
+def table_columns(conn):
+    """traffic 表现有的列"""
+    return {row[1] for row in conn.execute("PRAGMA table_info(traffic)")}
+
+
+def _create_indexes(conn):
+    for name, target in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+def format_time(value):
+    """把字符串/datetime 统一为与存储一致的时间字符串，None 原样返回"""
+    if value is None:
+        return None
+    return pd.Timestamp(value).strftime(TIME_FORMAT)
+
+
+def _clean(column, value):
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if column == "sampled_at":
+        return None if pd.isna(value) else format_time(value)
+    if column in REAL_COLUMNS:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if column == "status" and isinstance(value, float):
+        # CSV 读回的状态可能是 1.0，统一存为 "1"
+        return str(int(value))
+    return str(value)
+
+
+def _rows(records):
+    for record in records:
+        yield tuple(_clean(column, record.get(column)) for column in FIELDNAMES)
+
+
+def _frame_rows(df):
+    """按列批量转换 DataFrame，比逐条调用 _clean 快得多，用于大批量导入"""
+    df = df.reindex(columns=FIELDNAMES)
+    for column in REAL_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    df["status"] = df["status"].astype("string").str.replace(r"\.0$", "", regex=True)
+    if pd.api.types.is_datetime64_any_dtype(df["sampled_at"]):
+        df["sampled_at"] = df["sampled_at"].dt.strftime(TIME_FORMAT)
+    df = df.astype(object).where(df.notna(), None)
+    return df.itertuples(index=False, name=None)
+
+
+def insert_records(conn, records, batch_size=SQLITE_BATCH_SIZE):
+    """
+    写入记录，所有批次在同一个事务中提交，要么全部写入，要么全部不写入
+    :param records: 记录字典的可迭代对象（需已带 timestamp），或 DataFrame
+    :return: 写入的记录数
+    """
+    rows = _frame_rows(records) if isinstance(records, pd.DataFrame) else _rows(records)
+    total = 0
+    batch = []
+    with conn:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                conn.executemany(INSERT, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(INSERT, batch)
+            total += len(batch)
+    return total
+
+
+def _stamped(records, timestamp):
+    for record in records:
+        record["timestamp"] = timestamp
+        yield record
+
+
+def save_sqlite_snapshot(records, path=SQLITE_FILE, timestamp=None):
+    """
+    将一次快照写入 SQLite，整次快照使用同一个时间戳、同一个事务
+    :param records: 记录字典的可迭代对象，可以边采集边产生（见 storage.save_snapshot_stream）
+    :return: 写入的记录数
+    """
+    timestamp = timestamp or datetime.now().strftime(TIME_FORMAT)
+    conn = connect(path)
+    try:
+        # 与 save_to_csv 一致，写入时把时间戳写回记录，方便后续统计使用
+        return insert_records(conn, _stamped(records, timestamp))
+    finally:
+        conn.close()
+
+
+def where_clause(start=None, end=None, road=None, direction=None):
+    """
+    生成 WHERE 子句和参数，时间范围为 [start, end)
+    :return: (" WHERE ..." 或空字符串, 参数列表)
+    """
+    clauses, params = [], []
+    if road is not None:
+        clauses.append("road_name = ?")
+        params.append(road)
+    if direction is not None:
+        clauses.append("direction = ?")
+        params.append(direction)
+    if start is not None:
+        clauses.append("timestamp >= ?")
+        params.append(format_time(start))
+    if end is not None:
+        clauses.append("timestamp < ?")
+        params.append(format_time(end))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def read_frame(path=SQLITE_FILE, start=None, end=None, columns=None, road=None, chunksize=None):
+    """
+    读取数据，时间戳保持为字符串
+    :param columns: 需要的列，None 表示全部
+    :param chunksize: 不为空时返回 DataFrame 生成器
+    """
+    columns = list(columns) if columns is not None else FIELDNAMES
+    unknown = set(columns) - set(FIELDNAMES)
+    if unknown:
+        raise ValueError(f"未知的列: {sorted(unknown)}")
+    where, params = where_clause(start, end, road)
+    conn = sqlite3.connect(path, timeout=30)
+    # 只读取时不修改表结构，旧数据库中没有的新列读为 NULL
+    existing = table_columns(conn)
+    selected = [column if column in existing else f"NULL AS {column}" for column in columns]
+    sql = f"SELECT {', '.join(selected)} FROM traffic{where}"
+    if chunksize is None:
+        try:
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+    return _iter_frames(conn, sql, params, chunksize)
+
+
+def time_range(path=SQLITE_FILE):
+    """
+    数据的时间范围
+    :return: (最早时间, 最晚时间) 字符串，没有数据时为 (None, None)
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        return conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM traffic").fetchone()
+    finally:
+        conn.close()
+
+
+def _iter_frames(conn, sql, params, chunksize):
+    try:
+        yield from pd.read_sql_query(sql, conn, params=params, chunksize=chunksize)
+    finally:
+        conn.close()
+
+
+def import_csv(csv_path=TRAFFIC_CSV_FILE, db_path=SQLITE_FILE, chunksize=500000):
+    """
+    将已有的 CSV 文件导入 SQLite
+    导入期间先删除索引，全部写入后再重建，比逐行维护索引快得多
+    :return: 导入的记录数
+    """
+    conn = connect(db_path)
+    try:
+        for name in INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        total = 0
+        with open_committed(csv_path) as f:
+            for chunk in pd.read_csv(f, dtype=str, chunksize=chunksize):
+                total += insert_records(conn, chunk)
+        _create_indexes(conn)
+        conn.execute("ANALYZE")
+        conn.commit()
+        return total
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 存储管理")
+    parser.add_argument("command", choices=["import"], help="import: 将CSV文件导入数据库")
+    parser.add_argument("--csv", default=TRAFFIC_CSV_FILE, help="源CSV文件")
+    parser.add_argument("--db", default=SQLITE_FILE, help="数据库文件")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    total = import_csv(args.csv, args.db)
+    print(f"已导入 {total} 条记录到 {args.db}，耗时 {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
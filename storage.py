@@ -0,0 +1,523 @@
+# storage.py
+# 按日期分区的列式存储（Parquet），以及统一的数据读取/写入入口
+import argparse
+import glob
+import json
+import os
+import shutil
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from config import STORAGE_BACKEND, TRAFFIC_CSV_FILE, PARQUET_DIR, SQLITE_FILE, DELTA_DIR
+from csv_utils import FIELDNAMES, CsvSnapshotWriter, open_committed, save_to_csv, store_lock, upgrade_csv
+import delta_store
+import metrics
+from snapshot_frame import SnapshotFrame
+import sqlite_store
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 字典编码（category）的列，道路名、方向和状态取值重复度很高
+CATEGORY_COLUMNS = ["road_name", "direction", "status"]
+FLOAT_COLUMNS = ["speed", "delay_index", "free_flow_speed"]
+
+# pandas 解析时间字符串得到的类型（各版本的默认精度不同）
+PARSED_DATETIME = pd.to_datetime(pd.Series(["2000-01-01 00:00:00"])).dtype
+
+# 读取CSV时显式指定的类型，避免 pandas 逐列推断并把文本都读成 object
+CSV_DTYPES = {
+    "road_name": "category",
+    "direction": "category",
+    "status": "category",
+    "speed": "float64",
+    "description": "string",
+    "delay_index": "float64",
+    "free_flow_speed": "float64",
+}
+
+
+def fill_sampled_at(df):
+    """
+    补齐 sampled_at：为空（或旧数据没有该列）表示记录就是该次快照请求的，取快照时间
+    读取数据的函数在返回前调用，调用方拿到的 sampled_at 总是实际请求时间
+    """
+    if "timestamp" not in df.columns:
+        return df
+    if "sampled_at" not in df.columns:
+        df["sampled_at"] = df["timestamp"]
+        return df
+    sampled_at = df["sampled_at"]
+    if not pd.api.types.is_datetime64_any_dtype(sampled_at):
+        sampled_at = pd.to_datetime(sampled_at, format=TIME_FORMAT)
+    df["sampled_at"] = sampled_at.fillna(df["timestamp"])
+    return df
+
+
+def sample_age(df):
+    """每条记录在快照时的数据年龄（分钟），本次快照请求的记录为 0，需包含 timestamp 和 sampled_at 列"""
+    return (df["timestamp"] - df["sampled_at"]).dt.total_seconds() / 60
+
+
+def read_columns(columns, start=None, end=None):
+    """
+    需要从文件读取的列：按时间筛选需要 timestamp，补齐 sampled_at 也需要 timestamp
+    :return: 列列表，columns 为 None 时返回 None（读取全部列）
+    """
+    if columns is None:
+        return None
+    result = list(columns)
+    if "timestamp" not in result and (start is not None or end is not None or "sampled_at" in result):
+        result.append("timestamp")
+    return result
+
+
+def csv_usecols(columns):
+    """pandas.read_csv 的 usecols：旧CSV文件中没有的新字段跳过，不报错"""
+    if columns is None:
+        return None
+    wanted = set(columns)
+    return lambda column: column in wanted
+
+
+def read_parquet(path, columns=None):
+    """读取单个 parquet 文件，后续新增、旧文件中没有的列不读取（由调用方补齐）"""
+    if columns is not None:
+        names = set(pq.read_schema(path).names)
+        columns = [column for column in columns if column in names]
+    return pd.read_parquet(path, columns=columns)
+
+
+def to_typed_frame(data):
+    """
+    将记录列表或 DataFrame 转换为统一类型的 DataFrame
+    :param data: 记录列表（字典）、DataFrame 或 SnapshotFrame
+    :return: 带类型的 DataFrame，列顺序与 CSV 一致
+    """
+    if isinstance(data, SnapshotFrame):
+        data = data.to_frame()
+        # SnapshotFrame 的时间为秒精度，转换为解析时间字符串得到的精度，写入的文件与记录列表写入时类型一致
+        for column in ("timestamp", "sampled_at"):
+            data[column] = data[column].astype(PARSED_DATETIME)
+    df = data.copy() if isinstance(data, pd.DataFrame) else pd.DataFrame(list(data))
+    for column in FIELDNAMES:
+        if column not in df.columns:
+            df[column] = None
+    df = df[FIELDNAMES]
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    for column in FLOAT_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+    for column in CATEGORY_COLUMNS:
+        # status 在 CSV 中可能被解析成数字，统一转为字符串，例如 1 -> "1"
+        values = df[column].astype("string")
+        if column == "status":
+            values = values.str.replace(r"\.0$", "", regex=True)
+        df[column] = values.astype("category")
+    df["description"] = df["description"].astype("string")
+    # 写入时保持为空，存储中只有沿用的记录才有 sampled_at
+    df["sampled_at"] = pd.to_datetime(df["sampled_at"])
+    return df
+
+
+def partition_dir(root, day):
+    """返回某一天的分区目录，例如 traffic_data/date=2024-05-01"""
+    return os.path.join(root, f"date={day}")
+
+
+def _write_parquet_atomic(df, path):
+    # 先写临时文件再重命名，读取方不会看到写了一半的文件
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def write_partitions(df, root=PARQUET_DIR, part_name=None):
+    """
+    将 DataFrame 按日期写入对应分区，每个分区生成一个新的 part 文件
+    :param df: 带类型的 DataFrame（见 to_typed_frame）
+    :param root: 存储根目录
+    :param part_name: part 文件名（不含扩展名），默认使用当前时间
+    :return: 写入的文件路径列表
+    """
+    part_name = part_name or datetime.now().strftime("part-%Y%m%d%H%M%S%f")
+    paths = []
+    for day, group in df.groupby(df["timestamp"].dt.strftime("%Y-%m-%d"), sort=True):
+        directory = partition_dir(root, day)
+        os.makedirs(directory, exist_ok=True)
+        # 上一次合并中途中断时先完成合并，避免读到重复的记录
+        recover_compaction(directory)
+        path = os.path.join(directory, f"{part_name}.parquet")
+        _write_parquet_atomic(group.reset_index(drop=True), path)
+        paths.append(path)
+    return paths
+
+
+# 回填时新数据先写入 <目录>.backfill.tmp，完成后原目录改名为 <目录>.backfill.old，再把新目录改名为原目录
+BACKFILL_STAGING_SUFFIX = ".backfill.tmp"
+BACKFILL_BACKUP_SUFFIX = ".backfill.old"
+
+
+def recover_backfill(root):
+    """
+    处理中途中断的目录回填（需持有 store_lock）：
+    - 原目录已改名、新目录还未改名：完成交换
+    - 已交换、旧目录未删完：删除旧目录
+    - 新目录未生成完：删除新目录
+    :return: 是否有需要恢复的回填
+    """
+    root = os.path.normpath(root)
+    staging = root + BACKFILL_STAGING_SUFFIX
+    backup = root + BACKFILL_BACKUP_SUFFIX
+    if not os.path.exists(staging) and not os.path.exists(backup):
+        return False
+    if os.path.exists(backup) and not os.path.exists(root):
+        # 新目录改名前中断；新目录不存在时还原旧目录
+        os.rename(staging if os.path.exists(staging) else backup, root)
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(backup, ignore_errors=True)
+    return True
+
+
+def stamp_records(records, timestamp):
+    """与 save_to_csv 一致，把快照时间戳写回记录，方便后续统计使用；SnapshotFrame 整次快照只保存一个时间戳"""
+    if isinstance(records, SnapshotFrame):
+        records.timestamp = timestamp
+        return
+    for record in records:
+        record["timestamp"] = timestamp
+
+
+def save_parquet_snapshot(records, root=PARQUET_DIR, timestamp=None):
+    """
+    将一次快照写入分区存储，整次快照使用同一个时间戳
+    写入时持有存储目录的写锁，与回填、合并小文件互斥
+    :return: 写入的文件路径列表
+    """
+    timestamp = timestamp or datetime.now().strftime(TIME_FORMAT)
+    stamp_records(records, timestamp)
+    df = to_typed_frame(records)
+    with store_lock(root):
+        recover_backfill(root)
+        return write_partitions(df, root)
+
+
+def save_snapshot(records, backend=STORAGE_BACKEND, csv_path=TRAFFIC_CSV_FILE, parquet_dir=PARQUET_DIR,
+                  sqlite_path=SQLITE_FILE, delta_dir=DELTA_DIR, timestamp=None):
+    """
+    按配置的存储后端保存一次快照
+    :param records: 交通数据列表
+    :param backend: "csv"、"parquet"、"sqlite" 或 "delta"
+    :param csv_path: CSV 文件路径（多城市采集时每个城市单独一个）
+    :param parquet_dir: 分区存储根目录
+    :param sqlite_path: SQLite 数据库文件
+    :param delta_dir: 变化编码存储目录
+    :param timestamp: 快照时间戳，默认取当前时间
+    :return: 数据保存位置
+    """
+    if backend == "parquet":
+        paths = save_parquet_snapshot(records, parquet_dir, timestamp)
+        _count_written(backend, len(records), paths)
+        return parquet_dir
+    if backend == "sqlite":
+        rows = sqlite_store.save_sqlite_snapshot(records, sqlite_path, timestamp)
+        _count_written(backend, rows)
+        return sqlite_path
+    if backend == "delta":
+        path = delta_store.save_delta_snapshot(records, delta_dir, timestamp)
+        _count_written(backend, len(records), [path])
+        return delta_dir
+    # CSV 的写入行数和追加字节数在 save_to_csv 中统计
+    save_to_csv(records, csv_path, timestamp)
+    return csv_path
+
+
+def _stamped_batches(batches, timestamp, consumers):
+    """把快照时间戳写回每批记录并交给 consumers，逐条返回记录"""
+    for batch in batches:
+        for record in batch:
+            record["timestamp"] = timestamp
+        for consumer in consumers:
+            consumer.add(batch)
+        yield from batch
+
+
+def save_snapshot_stream(batches, backend=STORAGE_BACKEND, csv_path=TRAFFIC_CSV_FILE, parquet_dir=PARQUET_DIR,
+                         sqlite_path=SQLITE_FILE, delta_dir=DELTA_DIR, consumers=()):
+    """
+    边采集边保存一次快照，快照时间戳取开始采集的时间，不保留整次快照的记录：
+    - CSV 后端每采集完一批就写入（提交前读取方看不到），采集中途出错时整次快照回滚
+    - SQLite 后端逐批写入同一个事务，采集完成后提交
+    - 分区存储、变化编码存储需要整次快照的数据，按列暂存为 SnapshotFrame，采集完成后一次写入
+    每批记录写入后（已带 timestamp）交给 consumers 的 add，如 rollup_store.RollupUpdate；
+    快照提交后由调用方调用它们的 commit，保存失败时本次快照不会计入任何统计
+    :param batches: 记录批次的可迭代对象，见 traffic_fetcher.iter_city_traffic
+    :param consumers: 逐批处理已保存记录的对象
+    :return: (保存的记录数, 数据保存位置)
+    """
+    timestamp = datetime.now().strftime(TIME_FORMAT)
+    if backend == "csv":
+        with CsvSnapshotWriter(csv_path, timestamp) as writer:
+            for batch in batches:
+                writer.write(batch)
+                for consumer in consumers:
+                    consumer.add(batch)
+        return writer.rows, csv_path
+    records = _stamped_batches(batches, timestamp, consumers)
+    if backend == "sqlite":
+        rows = sqlite_store.save_sqlite_snapshot(records, sqlite_path, timestamp)
+        _count_written(backend, rows)
+        return rows, sqlite_path
+    frame = SnapshotFrame.from_records(records, timestamp=timestamp)
+    return len(frame), save_snapshot(frame, backend, csv_path, parquet_dir, sqlite_path, delta_dir, timestamp)
+
+
+def _count_written(backend, rows, paths=None):
+    # SQLite 写入的页数不容易从文件大小推算，只统计行数
+    if metrics.active() is not None:
+        metrics.inc("storage_rows_written_total", rows, backend=backend)
+        if paths is not None:
+            metrics.inc("storage_bytes_written_total", sum(os.path.getsize(p) for p in paths), backend=backend)
+
+
+def default_data_path(backend=STORAGE_BACKEND, csv_path=TRAFFIC_CSV_FILE, parquet_dir=PARQUET_DIR,
+                      sqlite_path=SQLITE_FILE, delta_dir=DELTA_DIR):
+    """当前存储后端对应的数据路径"""
+    if backend == "sqlite":
+        return sqlite_path
+    if backend == "delta":
+        return delta_dir
+    return parquet_dir if backend == "parquet" else csv_path
+
+
+def is_sqlite(path):
+    """按扩展名判断是否为 SQLite 数据库"""
+    return str(path).endswith((".db", ".sqlite", ".sqlite3"))
+
+
+def list_partitions(root=PARQUET_DIR, start=None, end=None):
+    """
+    列出时间范围内的分区目录
+    :param start: 起始时间（含），None 表示不限
+    :param end: 结束时间（不含），None 表示不限
+    """
+    start_day = pd.Timestamp(start).strftime("%Y-%m-%d") if start is not None else None
+    end_day = None
+    if end is not None:
+        end = pd.Timestamp(end)
+        # 结束时间恰好为零点时当天的分区不在范围内（按天切分并行分析时不会多打开下一天的分区）
+        end_day = (end - pd.Timedelta(days=1) if end == end.normalize() else end).strftime("%Y-%m-%d")
+    selected = []
+    for directory in sorted(glob.glob(os.path.join(root, "date=*"))):
+        day = os.path.basename(directory)[len("date="):]
+        if start_day is not None and day < start_day:
+            continue
+        if end_day is not None and day > end_day:
+            continue
+        selected.append(directory)
+    return selected
+
+
+def _filter_time(df, start, end):
+    if start is not None:
+        df = df[df["timestamp"] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df["timestamp"] < pd.Timestamp(end)]
+    return df
+
+
+def read_partitions(root=PARQUET_DIR, start=None, end=None, columns=None):
+    """
+    读取分区存储，只打开时间范围内的分区，只读取需要的列
+    :param root: 存储根目录
+    :param start: 起始时间（含）
+    :param end: 结束时间（不含）
+    :param columns: 需要的列，None 表示全部
+    :return: DataFrame
+    """
+    files = []
+    for directory in list_partitions(root, start, end):
+        files.extend(partition_files(directory))
+    if not files:
+        empty = to_typed_frame([])
+        return empty[columns] if columns is not None else empty
+
+    frames = [read_parquet(path, read_columns(columns, start, end)) for path in files]
+    df = fill_sampled_at(pd.concat(frames, ignore_index=True))
+    # 不同文件的 category 取值不同，合并后需重新转换
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    df = _filter_time(df, start, end)
+    if columns is not None:
+        df = df[list(columns)]
+    # 去掉时间筛选后不再出现的取值，避免旧版 pandas 分组时产生全零的组
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].cat.remove_unused_categories()
+    return df.reset_index(drop=True)
+
+
+def read_csv(file_path=TRAFFIC_CSV_FILE, start=None, end=None, columns=None):
+    """读取CSV文件，支持时间范围和列筛选"""
+    usecols = read_columns(columns, start, end)
+    # 只读取已提交的快照，正在写入的快照不可见
+    with open_committed(file_path) as f:
+        df = pd.read_csv(f, usecols=csv_usecols(usecols), dtype=CSV_DTYPES)
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIME_FORMAT)
+    df = _filter_time(fill_sampled_at(df), start, end)
+    if columns is not None:
+        df = df[list(columns)]
+    return df.reset_index(drop=True)
+
+
+def apply_csv_dtypes(df):
+    """把从 SQLite 读出的字符串时间戳和文本列转换为与 read_csv 相同的类型"""
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIME_FORMAT)
+    for column, dtype in CSV_DTYPES.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    return fill_sampled_at(df) if "sampled_at" in df.columns else df
+
+
+def read_sqlite(db_path=SQLITE_FILE, start=None, end=None, columns=None):
+    """读取 SQLite 数据库，时间范围条件由 timestamp 索引完成，只读取需要的列"""
+    df = apply_csv_dtypes(sqlite_store.read_frame(db_path, start, end, read_columns(columns)))
+    return df[list(columns)] if columns is not None else df
+
+
+def load_traffic(path=None, start=None, end=None, columns=None):
+    """
+    统一的数据读取入口：路径为目录时按分区存储（或变化编码存储）读取，.db 文件按 SQLite 读取，否则按CSV读取
+    :param path: CSV 文件、分区存储目录、变化编码存储目录或 SQLite 数据库，默认取当前存储后端的路径
+    :param start: 起始时间（含）
+    :param end: 结束时间（不含）
+    :param columns: 需要的列
+    :return: DataFrame
+    """
+    path = path or default_data_path()
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"数据文件 {path} 不存在")
+    if delta_store.is_delta(path):
+        return delta_store.read_delta(path, start, end, columns)
+    if os.path.isdir(path):
+        return read_partitions(path, start, end, columns)
+    if is_sqlite(path):
+        return read_sqlite(path, start, end, columns)
+    return read_csv(path, start, end, columns)
+
+
+COMPACTED_FILE = "part-compacted.parquet"
+# 合并结果先写入不以 .parquet 结尾的文件，读取方不会读到；清单记录被合并的文件，清单写入后合并即视为完成
+COMPACT_PENDING_FILE = "compacted.pending"
+COMPACT_MANIFEST_FILE = "compacted.manifest.json"
+
+
+def recover_compaction(directory):
+    """
+    完成或撤销中途中断的合并：有清单时删除清单中仍存在的旧文件再启用合并结果，没有清单时丢弃合并结果
+    :return: 是否有需要恢复的合并
+    """
+    pending = os.path.join(directory, COMPACT_PENDING_FILE)
+    manifest = os.path.join(directory, COMPACT_MANIFEST_FILE)
+    if not os.path.exists(manifest):
+        if os.path.exists(pending):
+            os.remove(pending)
+            return True
+        return False
+    with open(manifest, encoding="utf-8") as f:
+        names = json.load(f)
+    for name in names:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    if os.path.exists(pending):
+        os.replace(pending, os.path.join(directory, COMPACTED_FILE))
+    os.remove(manifest)
+    return True
+
+
+def partition_files(directory):
+    """
+    分区内需要读取的 part 文件；合并中途中断（清单已写入）时读取合并结果，跳过清单中的旧文件
+    """
+    files = sorted(glob.glob(os.path.join(directory, "*.parquet")))
+    manifest = os.path.join(directory, COMPACT_MANIFEST_FILE)
+    if not os.path.exists(manifest):
+        return files
+    with open(manifest, encoding="utf-8") as f:
+        compacted = set(json.load(f))
+    files = [path for path in files if os.path.basename(path) not in compacted]
+    pending = os.path.join(directory, COMPACT_PENDING_FILE)
+    return ([pending] if os.path.exists(pending) else []) + files
+
+
+def compact_partition(directory):
+    """
+    将一个分区内的多个 part 文件合并为一个文件
+    合并结果先写入临时文件，删除旧文件后再重命名，中途中断不会出现重复记录（下次合并时用 recover_compaction 完成）
+    合并期间持有存储目录的写锁
+    :return: 合并前的文件数
+    """
+    with store_lock(os.path.dirname(os.path.normpath(directory))):
+        recover_compaction(directory)
+        files = sorted(glob.glob(os.path.join(directory, "*.parquet")))
+        if len(files) <= 1:
+            return len(files)
+        df = to_typed_frame(pd.concat([pd.read_parquet(path) for path in files], ignore_index=True))
+        df = df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+        _write_parquet_atomic(df, os.path.join(directory, COMPACT_PENDING_FILE))
+        manifest = os.path.join(directory, COMPACT_MANIFEST_FILE)
+        with open(manifest + ".tmp", "w", encoding="utf-8") as f:
+            json.dump([os.path.basename(path) for path in files], f)
+        os.replace(manifest + ".tmp", manifest)
+        recover_compaction(directory)
+        return len(files)
+
+
+def migrate_csv(csv_path=TRAFFIC_CSV_FILE, root=PARQUET_DIR, chunksize=500000):
+    """
+    将已有的CSV文件转换为分区存储，分块读取以控制内存，最后按分区合并
+    写入期间持有存储目录的写锁，与采集写入、回填、合并小文件互斥
+    :return: 迁移的记录数
+    """
+    total = 0
+    with store_lock(root), open_committed(csv_path) as f:
+        recover_backfill(root)
+        for i, chunk in enumerate(pd.read_csv(f, chunksize=chunksize)):
+            write_partitions(to_typed_frame(chunk), root, part_name=f"part-migrated-{i:05d}")
+            total += len(chunk)
+    # compact_partition 自己获取写锁，不能在上面的锁内调用
+    for directory in list_partitions(root):
+        compact_partition(directory)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分区列式存储管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="将CSV文件转换为分区存储")
+    migrate.add_argument("--csv", default=TRAFFIC_CSV_FILE, help="源CSV文件")
+    migrate.add_argument("--root", default=PARQUET_DIR, help="分区存储目录")
+    compact = sub.add_parser("compact", help="合并每个分区内的小文件")
+    compact.add_argument("--root", default=PARQUET_DIR, help="分区存储目录")
+    upgrade = sub.add_parser("upgrade-csv", help="为旧CSV文件补上后续新增的字段")
+    upgrade.add_argument("--csv", default=TRAFFIC_CSV_FILE, help="CSV文件")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        total = migrate_csv(args.csv, args.root)
+        print(f"已迁移 {total} 条记录到 {args.root}")
+    elif args.command == "upgrade-csv":
+        added = upgrade_csv(args.csv)
+        print(f"{args.csv}: 已补上字段 {', '.join(added)}" if added else f"{args.csv}: 字段已是最新")
+    else:
+        for directory in list_partitions(args.root):
+            count = compact_partition(directory)
+            print(f"{directory}: 合并了 {count} 个文件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# streaming_loader.py
+# 分块流式读取交通数据，并逐块累加按道路、按小时的统计，峰值内存与数据总量无关
+import os
+
+import pandas as pd
+
+from config import LOADER_CHUNK_SIZE
+from csv_utils import open_committed, open_range, read_header
+import delta_store
+import sqlite_store
+from storage import (CSV_DTYPES, TIME_FORMAT, default_data_path, list_partitions, is_sqlite, apply_csv_dtypes,
+                     csv_usecols, read_parquet, fill_sampled_at, sample_age, partition_files)
+import storage
+
+# 道路/小时统计只需要这三列，description 等文本列不读取
+AGGREGATE_COLUMNS = ["timestamp", "road_name", "delay_index"]
+
+
+def _csv_chunks(path, byte_range=None, **kwargs):
+    """分块读取CSV中已提交的快照（或其中一个字节范围），读完或生成器关闭时关闭文件"""
+    if byte_range is None:
+        with open_committed(path) as f:
+            yield from pd.read_csv(f, **kwargs)
+        return
+    # 字节范围不含表头，列名取自文件第一行
+    with open_range(path, byte_range) as f:
+        yield from pd.read_csv(f, header=None, names=read_header(path), **kwargs)
+
+
+def iter_chunks(path=None, columns=None, chunksize=LOADER_CHUNK_SIZE, start=None, end=None, max_age=None,
+                byte_range=None):
+    """
+    分块读取交通数据
+    :param path: CSV 文件、分区存储目录、变化编码存储目录或 SQLite 数据库
+    :param columns: 需要的列，None 表示全部
+    :param chunksize: CSV 每块的行数（分区存储按文件分块，变化编码存储按天分块）
+    :param start: 起始时间（含）
+    :param end: 结束时间（不含）
+    :param max_age: 只保留数据年龄（快照时间 - sampled_at）不超过 max_age 分钟的记录，None 表示不限；
+                    自适应轮询时未请求的道路沿用上一次的数据，0 表示只要本次快照实际请求到的记录
+    :param byte_range: 只读取CSV的 (起始字节, 结束字节) 范围，由 csv_utils.split_csv 切分，供并行分析使用
+    :return: DataFrame 生成器，timestamp 已解析为 datetime，道路名等为 category
+    """
+    path = path or default_data_path()
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"数据文件 {path} 不存在")
+    wanted = columns
+    if max_age is not None and columns is not None and "sampled_at" not in columns:
+        wanted = list(columns) + ["sampled_at"]
+    read_columns = storage.read_columns(wanted, start, end)
+
+    if delta_store.is_delta(path):
+        chunks = delta_store.iter_days(path, start, end, read_columns)
+    elif os.path.isdir(path):
+        files = []
+        for directory in list_partitions(path, start, end):
+            files.extend(partition_files(directory))
+        chunks = (read_parquet(file, read_columns) for file in files)
+    elif is_sqlite(path):
+        # 时间范围条件在 SQL 中完成
+        frames = sqlite_store.read_frame(path, start, end, read_columns, chunksize=chunksize)
+        chunks = (apply_csv_dtypes(frame) for frame in frames)
+    else:
+        dtypes = {k: v for k, v in CSV_DTYPES.items() if read_columns is None or k in read_columns}
+        chunks = _csv_chunks(path, byte_range, usecols=csv_usecols(read_columns), dtype=dtypes, chunksize=chunksize)
+
+    for chunk in chunks:
+        if "timestamp" in chunk.columns and not pd.api.types.is_datetime64_any_dtype(chunk["timestamp"]):
+            chunk["timestamp"] = pd.to_datetime(chunk["timestamp"], format=TIME_FORMAT)
+        if read_columns is None or "sampled_at" in read_columns:
+            chunk = fill_sampled_at(chunk)
+        if max_age is not None:
+            chunk = chunk[sample_age(chunk) <= max_age]
+        if start is not None:
+            chunk = chunk[chunk["timestamp"] >= pd.Timestamp(start)]
+        if end is not None:
+            chunk = chunk[chunk["timestamp"] < pd.Timestamp(end)]
+        if columns is not None:
+            chunk = chunk[list(columns)]
+        if len(chunk):
+            yield chunk
+
+
+class TrafficAggregator:
+    """
+    按道路、按小时、按快照时间累加 delay_index 的总和与记录数
+    每块数据先在块内分组，再与已有结果相加；两个聚合器也可以直接合并
+    """
+
+    def __init__(self):
+        self.road_sum = pd.Series(dtype="float64")
+        self.road_count = pd.Series(dtype="int64")
+        self.hour_sum = pd.Series(dtype="float64")
+        self.hour_count = pd.Series(dtype="int64")
+        self.time_sum = pd.Series(dtype="float64")
+        self.rows = 0
+
+    @staticmethod
+    def _accumulate(total, part):
+        if total.empty:
+            return part
+        return total.add(part, fill_value=0)
+
+    def update(self, chunk):
+        """累加一块数据，需包含 timestamp、road_name、delay_index 列"""
+        delay = chunk["delay_index"]
+        by_road = delay.groupby(chunk["road_name"].astype("object"), observed=True)
+        by_hour = delay.groupby(chunk["timestamp"].dt.hour)
+        self.road_sum = self._accumulate(self.road_sum, by_road.sum())
+        self.road_count = self._accumulate(self.road_count, by_road.count())
+        self.hour_sum = self._accumulate(self.hour_sum, by_hour.sum())
+        self.hour_count = self._accumulate(self.hour_count, by_hour.count())
+        self.time_sum = self._accumulate(self.time_sum, delay.groupby(chunk["timestamp"]).sum())
+        self.rows += len(chunk)
+        return self
+
+    def merge(self, other):
+        """合并另一个聚合器的结果（用于并行计算）"""
+        self.road_sum = self._accumulate(self.road_sum, other.road_sum)
+        self.road_count = self._accumulate(self.road_count, other.road_count)
+        self.hour_sum = self._accumulate(self.hour_sum, other.hour_sum)
+        self.hour_count = self._accumulate(self.hour_count, other.hour_count)
+        self.time_sum = self._accumulate(self.time_sum, other.time_sum)
+        self.rows += other.rows
+        return self
+
+    def road_delay(self, stat="sum"):
+        """
+        与 calculate_total_delay_index 结果一致：每条道路的拥堵指数总和，从高到低排序
+        :param stat: "sum" 总和; "mean" 平均值（总和 / 记录数）
+        """
+        values = self.road_sum if stat == "sum" else self.road_sum / self.road_count
+        df = values.rename_axis("road_name").rename("delay_index").reset_index()
+        return df.sort_values("delay_index", ascending=False).reset_index(drop=True)
+
+    def hourly_traffic(self, stat="sum"):
+        """
+        与 calculate_hourly_traffic_index 结果一致：每小时的拥堵指数总和
+        :param stat: "sum" 总和; "mean" 平均值，不受各小时采样次数不同的影响
+        """
+        values = self.hour_sum if stat == "sum" else self.hour_sum / self.hour_count
+        df = values.rename_axis("hour").rename("delay_index").reset_index()
+        df["hour"] = df["hour"].astype(int)
+        return df.sort_values("hour").reset_index(drop=True)
+
+    def timeline(self):
+        """每次快照的拥堵指数总和，按时间排序"""
+        df = self.time_sum.rename_axis("timestamp").rename("delay_index").reset_index()
+        return df.sort_values("timestamp").reset_index(drop=True)
+
+
+def aggregate_traffic(path=None, chunksize=LOADER_CHUNK_SIZE, start=None, end=None, max_age=None, byte_range=None):
+    """
+    流式读取并聚合全部数据
+    :param max_age: 只统计数据年龄不超过 max_age 分钟的记录，见 iter_chunks
+    :param byte_range: 只聚合CSV的一个字节范围，见 iter_chunks
+    :return: TrafficAggregator
+    """
+    aggregator = TrafficAggregator()
+    for chunk in iter_chunks(path, AGGREGATE_COLUMNS, chunksize, start, end, max_age, byte_range):
+        aggregator.update(chunk)
+    return aggregator
@@ -0,0 +1,113 @@
+# synthetic_data.py
+# 合成交通数据生成器：按 csv_utils 的字段格式生成 N 条道路 × D 天、每10分钟一次的快照
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from csv_utils import FIELDNAMES
+from free_flow import get_resolver
+
+DIRECTIONS = ["东向西", "西向东", "南向北", "北向南"]
+STATUS_TEXT = {"1": "畅通", "2": "缓行", "3": "拥堵", "4": "严重拥堵"}
+SUFFIXES = ["路", "大道", "街", "快速路", "高架路"]
+
+
+def road_names(count):
+    """生成确定的道路名称列表"""
+    return [f"合成{i}{SUFFIXES[i % len(SUFFIXES)]}" for i in range(count)]
+
+
+def _rush_factor(minutes):
+    # 早晚高峰拥堵程度更高：8点和18点附近的两个高斯峰
+    hours = minutes / 60.0
+    return 1.0 + 0.9 * np.exp(-((hours - 8.0) ** 2) / 1.5) + 1.0 * np.exp(-((hours - 18.0) ** 2) / 2.0)
+
+
+def generate_day(day, roads, directions_per_road=2, interval_minutes=10, error_rate=0.01, seed=0, hold_rate=0.0):
+    """
+    生成某一天的全部快照记录
+    :param day: 日期，例如 "2024-05-01"
+    :param roads: 道路名称列表
+    :param directions_per_road: 每条道路的方向数
+    :param interval_minutes: 采集间隔（分钟）
+    :param error_rate: 请求失败（status=error）记录的比例
+    :param seed: 随机种子，相同参数生成完全相同的数据
+    :param hold_rate: 每个道路/方向沿用上一次快照数值的概率（实际数据中多数道路相邻两次快照没有变化）
+    :return: DataFrame，列与 CSV 一致
+    """
+    day = pd.Timestamp(day)
+    rng = np.random.default_rng([seed, day.toordinal()])
+    minutes = np.arange(0, 24 * 60, interval_minutes)
+    directions = DIRECTIONS[:directions_per_road]
+    free_flow = get_resolver().resolve_many(roads)
+
+    n_snapshots, n_roads, n_dirs = len(minutes), len(roads), len(directions)
+    shape = (n_snapshots, n_roads, n_dirs)
+    congestion = _rush_factor(minutes)[:, None, None] * rng.uniform(0.8, 1.6, size=(1, n_roads, 1))
+    speed = np.round(free_flow[None, :, None] / (congestion * rng.uniform(0.85, 1.15, size=shape)))
+    speed = np.clip(speed, 3, None)
+    if hold_rate > 0:
+        # 每个位置取最近一次未沿用（重新采样）的快照的速度
+        resampled = rng.random(shape) >= hold_rate
+        resampled[0] = True
+        source = np.maximum.accumulate(np.where(resampled, np.arange(n_snapshots)[:, None, None], 0), axis=0)
+        speed = np.take_along_axis(speed, source, axis=0)
+    ratio = free_flow[None, :, None] / speed
+    status = np.select([ratio < 1.3, ratio < 1.8, ratio < 2.5], ["1", "2", "3"], "4")
+    delay_index = np.round(ratio, 2)
+
+    timestamps = (day + pd.to_timedelta(minutes, unit="m")).strftime("%Y-%m-%d %H:%M:%S")
+    df = pd.DataFrame({
+        "timestamp": np.repeat(np.asarray(timestamps), n_roads * n_dirs),
+        "road_name": np.tile(np.repeat(np.asarray(roads, dtype=object), n_dirs), n_snapshots),
+        "direction": np.tile(np.asarray(directions, dtype=object), n_snapshots * n_roads),
+        "speed": speed.ravel().astype(int).astype(str),
+        "status": status.ravel(),
+        "delay_index": delay_index.ravel(),
+        "free_flow_speed": np.tile(np.repeat(free_flow, n_dirs), n_snapshots).astype(int),
+    })
+    df["description"] = df["road_name"] + "：" + df["direction"] + df["status"].map(STATUS_TEXT) + "，车辆行驶较为顺畅"
+
+    # 模拟请求失败的记录，与 traffic_fetcher 中的 error 行格式一致
+    errors = rng.random(len(df)) < error_rate
+    df.loc[errors, ["direction", "speed", "description"]] = [None, None, "请求失败"]
+    df.loc[errors, "status"] = "error"
+    df.loc[errors, "delay_index"] = 1.0
+    # 每次快照都请求全部道路，sampled_at 为空
+    df["sampled_at"] = None
+    return df[FIELDNAMES]
+
+
+def generate_csv(path, road_count=500, days=7, start="2024-05-01", directions_per_road=2, seed=0, hold_rate=0.0):
+    """
+    生成合成CSV文件，按天分块写入，内存占用与总天数无关
+    :return: 写入的记录数
+    """
+    roads = road_names(road_count)
+    if os.path.exists(path):
+        os.remove(path)
+    total = 0
+    for i, day in enumerate(pd.date_range(start, periods=days, freq="D")):
+        df = generate_day(day, roads, directions_per_road, seed=seed, hold_rate=hold_rate)
+        df.to_csv(path, mode="a", header=(i == 0), index=False, encoding="utf-8")
+        total += len(df)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成交通数据CSV")
+    parser.add_argument("--output", default="synthetic_traffic.csv", help="输出文件")
+    parser.add_argument("--roads", type=int, default=500, help="道路数")
+    parser.add_argument("--days", type=int, default=7, help="天数")
+    parser.add_argument("--start", default="2024-05-01", help="起始日期")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--hold-rate", type=float, default=0.0, help="沿用上一次快照数值的概率")
+    args = parser.parse_args()
+    total = generate_csv(args.output, args.roads, args.days, args.start, seed=args.seed, hold_rate=args.hold_rate)
+    print(f"已生成 {total} 条记录: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
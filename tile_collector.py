@@ -0,0 +1,229 @@
+# tile_collector.py
+# 按矩形区域采集：用矩形网格覆盖采集范围，每个矩形调用一次矩形区域交通态势接口，返回的路段按道路名称转换为与逐条道路采集相同的记录
+import argparse
+import json
+import math
+import threading
+
+from amap_api import get_traffic_rectangle
+from config import FETCH_WORKERS, AMAP_QPS, TILE_BBOX, TILE_MAX_DIAGONAL_KM, TILE_MAX_SPLIT_DEPTH
+from rate_limiter import TokenBucket
+from traffic_fetcher import iter_in_order, parse_traffic_response
+import metrics
+
+# 每度纬度的长度（公里），经度方向再乘以纬度的余弦
+KM_PER_DEGREE = 111.32
+# 矩形超过接口面积/对角线限制时返回的 infocode（INVALID_PARAMS），收到后把矩形四等分重试
+SPLIT_INFOCODES = {"20000"}
+# 网格规划时给对角线上限留的余量，避免浮点误差导致边界上的矩形被拒绝
+_DIAGONAL_MARGIN = 0.99
+
+
+def format_rectangle(rect):
+    """(左下经度, 左下纬度, 右上经度, 右上纬度) 转换为接口参数 "lng1,lat1;lng2,lat2" """
+    lng1, lat1, lng2, lat2 = rect
+    return f"{lng1:.6f},{lat1:.6f};{lng2:.6f},{lat2:.6f}"
+
+
+def parse_rectangle(text):
+    """format_rectangle 的逆运算"""
+    (lng1, lat1), (lng2, lat2) = (map(float, point.split(",")) for point in text.split(";"))
+    return lng1, lat1, lng2, lat2
+
+
+def tile_size_km(rect):
+    """矩形的 (宽, 高)，单位公里，按中心纬度近似"""
+    lng1, lat1, lng2, lat2 = rect
+    width = abs(lng2 - lng1) * KM_PER_DEGREE * math.cos(math.radians((lat1 + lat2) / 2))
+    height = abs(lat2 - lat1) * KM_PER_DEGREE
+    return width, height
+
+
+def diagonal_km(rect):
+    """矩形对角线长度（公里）"""
+    return math.hypot(*tile_size_km(rect))
+
+
+def tile_grid(bbox=TILE_BBOX, max_diagonal_km=TILE_MAX_DIAGONAL_KM):
+    """
+    用等大的矩形网格覆盖 bbox，在每个矩形对角线不超过 max_diagonal_km 的前提下矩形数最少
+    :param bbox: (左下经度, 左下纬度, 右上经度, 右上纬度)
+    :return: 矩形列表，按行（由南向北）、行内由西向东排列
+    """
+    width, height = tile_size_km(bbox)
+    limit = max_diagonal_km * _DIAGONAL_MARGIN
+    best = None
+    for cols in range(1, math.ceil(width / limit * math.sqrt(2)) + 2):
+        tile_width = width / cols
+        if tile_width >= limit:
+            continue
+        rows = max(1, math.ceil(height / math.sqrt(limit ** 2 - tile_width ** 2)))
+        if best is None or cols * rows < best[0] * best[1]:
+            best = (cols, rows)
+    cols, rows = best
+    lng1, lat1, lng2, lat2 = bbox
+    step_lng = (lng2 - lng1) / cols
+    step_lat = (lat2 - lat1) / rows
+    return [(lng1 + c * step_lng, lat1 + r * step_lat,
+             lng2 if c == cols - 1 else lng1 + (c + 1) * step_lng,
+             lat2 if r == rows - 1 else lat1 + (r + 1) * step_lat)
+            for r in range(rows) for c in range(cols)]
+
+
+def split_tile(rect):
+    """四等分矩形"""
+    lng1, lat1, lng2, lat2 = rect
+    lng_mid = (lng1 + lng2) / 2
+    lat_mid = (lat1 + lat2) / 2
+    return [(lng1, lat1, lng_mid, lat_mid), (lng_mid, lat1, lng2, lat_mid),
+            (lng1, lat_mid, lng_mid, lat2), (lng_mid, lat_mid, lng2, lat2)]
+
+
+def segment_key(segment):
+    """
+    路段的唯一标识，用于去掉相邻矩形重复返回的跨边界路段
+    有 lcodes（高德路段编码）时按 (名称, 方向, lcodes)，否则按 (名称, 方向, 坐标串)
+    """
+    return segment.get("name"), segment.get("direction"), segment.get("lcodes") or segment.get("polyline")
+
+
+class TileCollector:
+    """
+    一次快照的矩形区域采集，迭代时按网格顺序逐个矩形返回新记录，可直接交给 storage.save_snapshot_stream
+    接口拒绝的矩形（对角线/面积超限）四等分后重试，最多 max_depth 层；没有名称的路段无法对应到道路，直接丢弃
+    :param bbox: 采集范围
+    :param max_diagonal_km: 规划网格时单个矩形对角线的上限（公里）
+    :param max_depth: 矩形被拒绝时最多再分的层数
+    :param workers: 并发线程数，默认取 config.FETCH_WORKERS
+    :param qps: 每秒请求数上限，默认取 config.AMAP_QPS，0 表示不限流
+    :param key: 使用的 API Key，默认取 config.AMAP_KEY
+    :param resolver: 自由流速度解析器
+    :param recorder: 可选字典，记录 {矩形参数: 响应}，保存后可由 fake_amap_server --replay-tiles 回放
+    """
+
+    def __init__(self, bbox=TILE_BBOX, max_diagonal_km=TILE_MAX_DIAGONAL_KM, max_depth=TILE_MAX_SPLIT_DEPTH,
+                 workers=None, qps=None, key=None, resolver=None, recorder=None):
+        self.tiles = tile_grid(bbox, max_diagonal_km)
+        self.max_depth = max_depth
+        self.workers = FETCH_WORKERS if workers is None else workers
+        qps = AMAP_QPS if qps is None else qps
+        self.limiter = TokenBucket(qps) if qps else None
+        self.key = key
+        self.resolver = resolver
+        self.recorder = recorder
+        self.requests = 0
+        self.split = 0
+        self.failed = []
+        self.segments = 0
+        self.duplicates = 0
+        self.unnamed = 0
+        self._lock = threading.Lock()
+
+    def _request(self, rect):
+        rectangle = format_rectangle(rect)
+        with self._lock:
+            self.requests += 1
+        try:
+            on_retry = None
+            if self.limiter is not None:
+                self.limiter.acquire()
+                # 重试也要取令牌，限流时不会超过 QPS
+                on_retry = self.limiter.acquire
+            data = get_traffic_rectangle(rectangle, self.key, on_retry)
+        except Exception as e:
+            # 只记录异常类型，避免把带 key 的请求URL写进数据文件
+            metrics.inc("amap_request_errors_total", error=type(e).__name__)
+            return {"status": "0", "info": f"请求异常: {type(e).__name__}"}
+        if self.recorder is not None:
+            with self._lock:
+                self.recorder[rectangle] = data
+        return data
+
+    def fetch_tile(self, rect, depth=0):
+        """
+        请求一个矩形，被拒绝时四等分后逐个请求
+        :return: 原始路段列表（子矩形按顺序拼接，尚未去重）
+        """
+        data = self._request(rect)
+        if data.get("status") == "1":
+            metrics.inc("tile_requests_total", result="ok")
+            return data.get("trafficinfo", {}).get("roads", [])
+        if data.get("infocode") in SPLIT_INFOCODES and depth < self.max_depth:
+            metrics.inc("tile_requests_total", result="split")
+            with self._lock:
+                self.split += 1
+            segments = []
+            for part in split_tile(rect):
+                segments.extend(self.fetch_tile(part, depth + 1))
+            return segments
+        metrics.inc("tile_requests_total", result="failed")
+        with self._lock:
+            self.failed.append((format_rectangle(rect), data.get("info")))
+        return []
+
+    def __iter__(self):
+        seen = set()
+        for _, segments in iter_in_order(self.fetch_tile, self.tiles, self.workers):
+            fresh = []
+            for segment in segments:
+                if not segment.get("name"):
+                    self.unnamed += 1
+                    continue
+                key = segment_key(segment)
+                if key in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(key)
+                fresh.append(segment)
+            self.segments += len(fresh)
+            records = parse_traffic_response(None, {"status": "1", "trafficinfo": {"roads": fresh}}, self.resolver)
+            if metrics.active() is not None:
+                for record in records:
+                    metrics.inc("traffic_records_total", status=record.get("status"))
+            if records:
+                yield records
+
+    def summary(self):
+        return {"tiles": len(self.tiles), "requests": self.requests, "split": self.split, "failed": len(self.failed),
+                "segments": self.segments, "duplicates": self.duplicates, "unnamed": self.unnamed}
+
+
+def collect_tiles(**kwargs):
+    """
+    按矩形区域采集一次，参数同 TileCollector
+    :return: (记录列表, TileCollector)
+    """
+    collector = TileCollector(**kwargs)
+    records = [record for batch in collector for record in batch]
+    return records, collector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按矩形区域采集")
+    sub = parser.add_subparsers(dest="command", required=True)
+    plan = sub.add_parser("plan", help="打印覆盖采集范围的矩形网格")
+    record = sub.add_parser("record", help="采集一次并保存每个矩形的原始响应，供 fake_amap_server --replay-tiles 回放")
+    record.add_argument("--out", default="tile_responses.json", help="输出文件")
+    for p in (plan, record):
+        p.add_argument("--bbox", type=float, nargs=4, default=TILE_BBOX, metavar=("LNG1", "LAT1", "LNG2", "LAT2"),
+                       help="采集范围")
+        p.add_argument("--max-diagonal", type=float, default=TILE_MAX_DIAGONAL_KM, help="矩形对角线上限（公里）")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        tiles = tile_grid(tuple(args.bbox), args.max_diagonal)
+        width, height = tile_size_km(tiles[0])
+        print(f"共 {len(tiles)} 个矩形，每个约 {width:.1f}km × {height:.1f}km（对角线 {diagonal_km(tiles[0]):.1f}km）")
+        for rect in tiles:
+            print(format_rectangle(rect))
+    else:
+        responses = {}
+        records, collector = collect_tiles(bbox=tuple(args.bbox), max_diagonal_km=args.max_diagonal,
+                                           recorder=responses)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(responses, f, ensure_ascii=False)
+        print(f"采集到 {len(records)} 条记录，{collector.summary()}，{len(responses)} 个响应已保存到 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
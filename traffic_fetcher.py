@@ -1,6 +1,17 @@
 # traffic_fetcher.py
+import contextvars
+import heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
 from amap_api import get_traffic_status
-from config import FREE_FLOW_SPEEDS
+from config import FETCH_WORKERS, AMAP_QPS, SNAPSHOT_BATCH_SIZE
+from free_flow import get_resolver
+from rate_limiter import TokenBucket
+import metrics
 
 
 def get_free_flow_speed(road_name):
@@ -9,27 +20,19 @@ def get_free_flow_speed(road_name):
     :param road_name: 道路名称
     :return: 自由流速度 (km/h)
     """
-    # 首先检查是否有特定道路的配置
-    for key in FREE_FLOW_SPEEDS:
-        if key in road_name:
-            return FREE_FLOW_SPEEDS[key]
+    # 匹配规则在解析器中一次性编译，同一道路名称的结果会被缓存
+    return get_resolver().resolve(road_name)
 
-    # 检查道路类型关键词
-    road_type_keywords = {
-        "高速": "高速公路",
-        "快速": "快速路",
-        "高架": "高架路",
-        "大道": "主干道",
-        "路": "主干道",
-        "街": "主干道"
-    }
 
-    for keyword, road_type in road_type_keywords.items():
-        if keyword in road_name:
-            return FREE_FLOW_SPEEDS.get(road_type, FREE_FLOW_SPEEDS["default"])
-
-    # 默认值
-    return FREE_FLOW_SPEEDS["default"]
+# 无法按速度计算时，根据状态估算延时指数
+STATUS_DELAY_MAPPING = {
+    "0": 1.0,  # 未知，默认1.0
+    "1": 1.0,  # 畅通
+    "2": 1.5,  # 缓行
+    "3": 2.0,  # 拥堵
+    "4": 2.5,  # 严重拥堵
+    "error": 1.0  # 错误，默认1.0
+}
 
 
 def calculate_delay_index(speed, status, free_flow_speed):
@@ -40,66 +43,271 @@ def calculate_delay_index(speed, status, free_flow_speed):
     :param free_flow_speed: 自由流速度
     :return: 延时指数
     """
-    if speed is None or free_flow_speed is None or free_flow_speed == 0:
-        # 根据状态估算
-        status_mapping = {
-            "0": 1.0,  # 未知，默认1.0
-            "1": 1.0,  # 畅通
-            "2": 1.5,  # 缓行
-            "3": 2.0,  # 拥堵
-            "4": 2.5,  # 严重拥堵
-            "error": 1.0  # 错误，默认1.0
-        }
-        return status_mapping.get(str(status), 1.0)
+    if speed is None or free_flow_speed is None or free_flow_speed == 0 or float(speed) == 0:
+        # 根据状态估算（速度为0时无法计算速度比，同样按状态估算）
+        return STATUS_DELAY_MAPPING.get(str(status), 1.0)
 
     # 基于速度比计算
     speed_ratio = free_flow_speed / float(speed)
     return round(speed_ratio, 2)
 
 
-def fetch_fuzhou_traffic(roads):
+def calculate_delay_index_batch(speed, status, free_flow_speed):
     """
-    获取福州多个道路的交通状况
-    :param roads: 道路列表
-    :return: 道路交通信息字典
+    批量计算延时指数，结果与逐条调用 calculate_delay_index 完全一致
+    :param speed: 速度数组/Series，可以是字符串，缺失值为 None/NaN
+    :param status: 状态数组/Series
+    :param free_flow_speed: 自由流速度数组/Series
+    :return: numpy float64 数组
+    """
+    speed = pd.to_numeric(pd.Series(speed, copy=False).reset_index(drop=True), errors="coerce").to_numpy("float64")
+    free_flow = pd.to_numeric(pd.Series(free_flow_speed, copy=False).reset_index(drop=True),
+                              errors="coerce").to_numpy("float64")
+    # CSV 读回的状态可能是数字 1.0，统一转成 "1" 再查表
+    status = pd.Series(status, copy=False).reset_index(drop=True).astype("string").str.replace(r"\.0$", "", regex=True)
+    fallback = status.map(STATUS_DELAY_MAPPING).astype("float64").fillna(1.0).to_numpy()
+
+    valid = ~np.isnan(speed) & ~np.isnan(free_flow) & (free_flow != 0) & (speed != 0)
+    ratio = np.divide(free_flow, speed, out=np.ones_like(speed), where=valid)
+    rounded = np.round(ratio, 2)
+    # np.round 先乘100再取整，在恰好接近 0.005 的边界上可能与 Python round 不同，这些少数值改用 round 计算
+    scaled = ratio * 100
+    near_half = valid & (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in np.flatnonzero(near_half):
+        rounded[i] = round(float(ratio[i]), 2)
+    return np.where(valid, rounded, fallback)
+
+
+def parse_traffic_response(road, data, resolver=None):
     """
-    city = "福州市"
+    将单条道路的API响应转换为记录列表
+    :param road: 请求时使用的道路名
+    :param data: get_traffic_status 返回的 JSON 数据
+    :param resolver: 自由流速度解析器，默认使用基于 config.FREE_FLOW_SPEEDS 的共享解析器
+    :return: 记录列表，请求失败时返回一条 "error" 记录；
+             成功的记录带有 segment（路段的 lcodes，没有时为坐标串），只用于一次快照内识别同一路段，不写入存储
+    """
+    resolver = resolver or get_resolver()
     results = []
-    for road in roads:
-        data = get_traffic_status(city, road)
-        if data.get("status") == "1":
-            for r in data.get("trafficinfo", {}).get("roads", []):
-                # 获取自由流速度
-                free_flow_speed = get_free_flow_speed(r.get("name", road))
-
-                # 计算延时指数
-                delay_index = calculate_delay_index(
-                    r.get("speed"),
-                    r.get("status"),
-                    free_flow_speed
-                )
-
-                results.append({
-                    "road_name": r.get("name"),
-                    "direction": r.get("direction"),
-                    "speed": r.get("speed"),
-                    "status": r.get("status"),  # 0=未知,1=畅通,2=缓行,3=拥堵,4=严重拥堵
-                    "description": r.get("description"),
-                    "delay_index": delay_index,  # 新增延时指数
-                    "free_flow_speed": free_flow_speed  # 添加自由流速度用于调试
-                })
-        else:
-            # 对于请求失败的道路，使用默认自由流速度
-            free_flow_speed = get_free_flow_speed(road)
-            delay_index = calculate_delay_index(None, "error", free_flow_speed)
+    if data.get("status") == "1":
+        for r in data.get("trafficinfo", {}).get("roads", []):
+            # 获取自由流速度
+            free_flow_speed = resolver.resolve(r.get("name", road))
+
+            # 计算延时指数
+            delay_index = calculate_delay_index(
+                r.get("speed"),
+                r.get("status"),
+                free_flow_speed
+            )
 
             results.append({
-                "road_name": road,
-                "direction": None,
-                "speed": None,
-                "status": "error",
-                "description": data.get("info", "请求失败"),
-                "delay_index": delay_index,
-                "free_flow_speed": free_flow_speed
+                "road_name": r.get("name"),
+                "direction": r.get("direction"),
+                "speed": r.get("speed"),
+                "status": r.get("status"),  # 0=未知,1=畅通,2=缓行,3=拥堵,4=严重拥堵
+                "description": r.get("description"),
+                "delay_index": delay_index,  # 新增延时指数
+                "free_flow_speed": free_flow_speed,  # 添加自由流速度用于调试
+                "segment": r.get("lcodes") or r.get("polyline"),
             })
-    return results
\ No newline at end of file
+    else:
+        # 对于请求失败的道路，使用默认自由流速度
+        free_flow_speed = resolver.resolve(road)
+        delay_index = calculate_delay_index(None, "error", free_flow_speed)
+
+        results.append({
+            "road_name": road,
+            "direction": None,
+            "speed": None,
+            "status": "error",
+            "description": data.get("info", "请求失败"),
+            "delay_index": delay_index,
+            "free_flow_speed": free_flow_speed
+        })
+    return results
+
+
+def _get_with_key_pool(city, road, key_pool):
+    """从 Key 池取 Key 请求，见 KeyPool.request"""
+    return key_pool.request(lambda key, on_retry: get_traffic_status(city, road, key, on_retry))
+
+
+def fetch_road_traffic(city, road, limiter=None, key_pool=None, resolver=None):
+    """
+    获取单条道路的交通状况，任何异常都转换为 "error" 记录，不影响其他道路
+    :param city: 城市名
+    :param road: 道路名
+    :param limiter: 可选的令牌桶限流器，每次请求（包括重试）取一个令牌
+    :param key_pool: 可选的 Key 池，使用时由 Key 池按 Key 限流
+    :param resolver: 自由流速度解析器
+    :return: 记录列表
+    """
+    try:
+        if limiter is not None:
+            limiter.acquire()
+        if key_pool is None:
+            data = get_traffic_status(city, road, on_retry=limiter.acquire if limiter is not None else None)
+        else:
+            data = _get_with_key_pool(city, road, key_pool)
+    except Exception as e:
+        # 只记录异常类型，避免把带 key 的请求URL写进数据文件
+        metrics.inc("amap_request_errors_total", error=type(e).__name__)
+        data = {"status": "0", "info": f"请求异常: {type(e).__name__}"}
+    records = parse_traffic_response(road, data, resolver)
+    if metrics.active() is not None:
+        for record in records:
+            metrics.inc("traffic_records_total", status=record.get("status"))
+    return records
+
+
+def iter_in_order(fetch, roads, workers):
+    """
+    按输入顺序逐条道路（或逐个矩形）返回 (输入, 结果)；并发时最多提前提交 workers*4 个请求，已完成但未取走的结果不会无限堆积
+    """
+    if workers <= 1:
+        for road in roads:
+            yield road, fetch(road)
+        return
+    window = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for road in roads:
+                # 在提交时的上下文中执行，线程池中的请求沿用调用方的快照超时预算
+                pending.append((road, executor.submit(contextvars.copy_context().run, fetch, road)))
+                if len(pending) >= window:
+                    road, future = pending.popleft()
+                    yield road, future.result()
+            while pending:
+                road, future = pending.popleft()
+                yield road, future.result()
+        finally:
+            # 调用方中途停止（例如写入出错）时不再发起剩余请求
+            for _, future in pending:
+                future.cancel()
+
+
+def chain_observers(*observers):
+    """把多个 observer 串起来，前一个保留的记录交给下一个，None 会被忽略；全部为 None 时返回 None"""
+    observers = [observer for observer in observers if observer is not None]
+    if not observers:
+        return None
+
+    def observe(road, records):
+        for observer in observers:
+            records = observer(road, records)
+        return records
+    return observe
+
+
+def iter_city_traffic(city, roads, workers=None, qps=None, key_pool=None, resolver=None,
+                      batch_size=SNAPSHOT_BATCH_SIZE, observer=None):
+    """
+    分批获取指定城市多个道路的交通状况，每凑满 batch_size 条道路返回一批，供写入器边采集边写入
+    参数同 fetch_city_traffic
+    :param batch_size: 每批的道路数
+    :param observer: 可选回调 observer(道路, 记录列表)，返回实际保留的记录，按道路顺序在调用方线程中调用
+                     （见 road_catalog.SegmentTracker）
+    :return: 记录列表的生成器，按输入道路顺序
+    """
+    workers = FETCH_WORKERS if workers is None else workers
+    qps = AMAP_QPS if qps is None else qps
+    limiter = TokenBucket(qps) if qps and key_pool is None else None
+
+    def fetch(road):
+        return fetch_road_traffic(city, road, limiter, key_pool, resolver)
+
+    batch = []
+    batch_roads = 0
+    for road, records in iter_in_order(fetch, roads, workers):
+        if observer is not None:
+            records = observer(road, records)
+        batch.extend(records)
+        batch_roads += 1
+        if batch_roads >= batch_size:
+            yield batch
+            batch = []
+            batch_roads = 0
+    if batch:
+        yield batch
+
+
+def fetch_city_traffic(city, roads, workers=None, qps=None, key_pool=None, resolver=None):
+    """
+    获取指定城市多个道路的交通状况
+    :param city: 城市名，例如 "福州市"
+    :param roads: 道路列表
+    :param workers: 并发线程数，默认取 config.FETCH_WORKERS，1 表示顺序请求
+    :param qps: 每秒请求数上限，默认取 config.AMAP_QPS，0 表示不限流；使用 Key 池时由 Key 池按 Key 限流，忽略此参数
+    :param key_pool: 可选的 Key 池，默认使用 config.AMAP_KEY
+    :param resolver: 该城市的自由流速度解析器，默认使用 config.FREE_FLOW_SPEEDS
+    :return: 道路交通信息列表，顺序与输入道路顺序一致
+    """
+    results = []
+    for batch in iter_city_traffic(city, roads, workers, qps, key_pool, resolver):
+        results.extend(batch)
+    return results
+
+
+def fetch_fuzhou_traffic(roads, workers=None, qps=None):
+    """
+    获取福州多个道路的交通状况
+    :param roads: 道路列表
+    :param workers: 并发线程数，默认取 config.FETCH_WORKERS，1 表示顺序请求
+    :param qps: 每秒请求数上限，默认取 config.AMAP_QPS，0 表示不限流
+    :return: 道路交通信息列表，顺序与输入道路顺序一致
+    """
+    return fetch_city_traffic("福州市", roads, workers, qps)
+
+
+def iter_fuzhou_traffic(roads, workers=None, qps=None, batch_size=SNAPSHOT_BATCH_SIZE, observer=None):
+    """分批获取福州多个道路的交通状况，见 iter_city_traffic"""
+    return iter_city_traffic("福州市", roads, workers, qps, batch_size=batch_size, observer=observer)
+
+
+class SnapshotSummary:
+    """
+    一次快照的摘要，每批记录保存后调用 add 累加，不保留整次快照的记录（可作为 storage.save_snapshot_stream 的 consumers）
+    平均延时指数与延时指数最高的道路都不计 error 记录和没有延时指数的记录
+    :param top_k: 保留延时指数最高的记录数
+    """
+
+    def __init__(self, top_k=5):
+        self.top_k = top_k
+        self.timestamp = None
+        self.records = 0
+        self.errors = 0
+        self._delay_total = 0.0
+        self._delay_count = 0
+        # 小顶堆 [(延时指数, -序号, 记录)]，延时指数相同时先保存的记录排在前面
+        self._top = []
+
+    def add(self, records):
+        for record in records:
+            self.timestamp = record.get("timestamp", self.timestamp)
+            self.records += 1
+            if record.get("status") == "error":
+                self.errors += 1
+                continue
+            if record.get("delay_index") is None:
+                continue
+            delay = float(record["delay_index"])
+            self._delay_total += delay
+            self._delay_count += 1
+            item = (delay, -self.records, record)
+            if len(self._top) < self.top_k:
+                heapq.heappush(self._top, item)
+            elif item[:2] > self._top[0][:2]:
+                heapq.heapreplace(self._top, item)
+
+    @property
+    def average_delay_index(self):
+        """平均延时指数，保留两位小数，没有有效记录时为 0"""
+        if not self._delay_count:
+            return 0
+        return round(self._delay_total / self._delay_count, 2)
+
+    def highest(self):
+        """延时指数最高的 top_k 条记录，从高到低"""
+        return [record for *_, record in sorted(self._top, key=lambda item: item[:2], reverse=True)]
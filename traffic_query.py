@@ -0,0 +1,114 @@
+# traffic_query.py
+# 基于 SQLite 存储的常用查询：单条道路的时间序列、时间窗口内的道路排名、按小时统计，结果均为 DataFrame
+import argparse
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from config import SQLITE_FILE
+from sqlite_store import TIME_FORMAT, format_time, where_clause
+
+METRICS = ("delay_index", "speed")
+STATS = ("avg", "sum", "max", "min")
+
+
+def _connect(db):
+    if not os.path.exists(db):
+        raise FileNotFoundError(f"数据库 {db} 不存在")
+    # 只读打开，查询时不会与采集程序争用写锁
+    return sqlite3.connect(f"file:{db}?mode=ro", uri=True, timeout=30)
+
+
+def _query(db, sql, params):
+    conn = _connect(db)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def road_series(road, start=None, end=None, direction=None, db=SQLITE_FILE):
+    """
+    单条道路的时间序列（走 (road_name, timestamp) 索引）
+    :param road: 道路名
+    :param start: 起始时间（含）
+    :param end: 结束时间（不含）
+    :param direction: 只返回指定方向
+    :return: DataFrame，列为 timestamp、direction、speed、status、delay_index，按时间排序
+    """
+    where, params = where_clause(start, end, road, direction)
+    df = _query(db, f"SELECT timestamp, direction, speed, status, delay_index FROM traffic{where} "
+                    f"ORDER BY timestamp", params)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIME_FORMAT)
+    return df
+
+
+def window_ranking(start=None, end=None, n=10, metric="delay_index", stat="avg", db=SQLITE_FILE):
+    """
+    时间窗口内各道路的排名（走 timestamp 索引）
+    :param n: 返回前 n 名，None 表示全部
+    :param metric: "delay_index" 或 "speed"
+    :param stat: "avg"、"sum"、"max" 或 "min"
+    :return: DataFrame，列为 road_name、指标值、samples（有效记录数），按指标值从高到低排序
+    """
+    if metric not in METRICS or stat not in STATS:
+        raise ValueError(f"不支持的指标或统计方式: {metric} {stat}")
+    where, params = where_clause(start, end)
+    where += (" AND " if where else " WHERE ") + "road_name IS NOT NULL"
+    sql = (f"SELECT road_name, {stat.upper()}({metric}) AS {metric}, COUNT({metric}) AS samples "
+           f"FROM traffic{where} GROUP BY road_name ORDER BY 2 DESC")
+    if n is not None:
+        sql += " LIMIT ?"
+        params.append(int(n))
+    return _query(db, sql, params)
+
+
+def hourly_aggregate(start=None, end=None, road=None, db=SQLITE_FILE):
+    """
+    按小时统计拥堵指数和速度
+    :param road: 只统计指定道路，None 表示全部道路
+    :return: DataFrame，列为 hour、count、delay_index（总和，与 calculate_hourly_traffic_index 一致）、
+             delay_mean、speed_mean
+    """
+    where, params = where_clause(start, end, road)
+    sql = ("SELECT CAST(substr(timestamp, 12, 2) AS INTEGER) AS hour, COUNT(delay_index) AS count, "
+           "SUM(delay_index) AS delay_index, AVG(delay_index) AS delay_mean, AVG(speed) AS speed_mean "
+           f"FROM traffic{where} GROUP BY hour ORDER BY hour")
+    return _query(db, sql, params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 交通数据查询")
+    parser.add_argument("--db", default=SQLITE_FILE, help="数据库文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+    series = sub.add_parser("series", help="单条道路的时间序列")
+    series.add_argument("road", help="道路名")
+    series.add_argument("--direction", default=None, help="方向")
+    rank = sub.add_parser("rank", help="时间窗口内的道路排名")
+    rank.add_argument("-n", type=int, default=10, help="返回前 n 名")
+    rank.add_argument("--metric", default="delay_index", choices=METRICS, help="排名指标")
+    rank.add_argument("--stat", default="avg", choices=STATS, help="统计方式")
+    hourly = sub.add_parser("hourly", help="按小时统计")
+    hourly.add_argument("--road", default=None, help="只统计指定道路")
+    for command in (series, rank, hourly):
+        command.add_argument("--start", default=None, help="起始时间（含），例如 2024-05-01 08:00")
+        command.add_argument("--end", default=None, help="结束时间（不含）")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "series":
+        result = road_series(args.road, args.start, args.end, args.direction, args.db)
+    elif args.command == "rank":
+        result = window_ranking(args.start, args.end, args.n, args.metric, args.stat, args.db)
+    else:
+        result = hourly_aggregate(args.start, args.end, args.road, args.db)
+    elapsed = time.perf_counter() - started
+    print(result.to_string(index=False))
+    window = f"{format_time(args.start) or '...'} ~ {format_time(args.end) or '...'}"
+    print(f"\n{len(result)} 行，时间范围 {window}，查询耗时 {elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
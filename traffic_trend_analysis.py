@@ -1,23 +1,24 @@
 # traffic_trend_analysis.py
 # 交通拥堵指数时间序列分析与可视化
-import pandas as pd
 import numpy as np
 from pyecharts import options as opts
 from pyecharts.charts import Line
 from pyecharts.commons.utils import JsCode
+import argparse
 import os
-from datetime import datetime
+from storage import load_traffic, default_data_path
+from rollup_store import RollupStore
+from congestion_cube import CongestionCube, WEEKDAY_NAMES
+from parallel_analysis import aggregate_parallel
+from chart_render import downsample_series, render_if_changed
+from config import ROLLUP_FILE, CUBE_DIR, CHART_MAX_POINTS, ANALYSIS_WORKERS, DASHBOARD_DIR
+from dashboard import load_timeline
 
 
-def load_data(file_path="fuzhou_traffic.csv"):
-    """读取交通数据CSV文件"""
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"数据文件 {file_path} 不存在")
-
-    df = pd.read_csv(file_path)
-    # 转换时间戳列为datetime类型
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    return df
+def load_data(file_path="fuzhou_traffic.csv", start=None, end=None, columns=None):
+    """读取交通数据（CSV文件、分区存储目录、变化编码存储目录或SQLite数据库），可按时间范围和列筛选"""
+    # 时间戳列在读取时已转换为datetime类型
+    return load_traffic(file_path, start=start, end=end, columns=columns)
 
 
 def calculate_hourly_traffic_index(df):
@@ -35,7 +36,7 @@ def find_peak_hours(hourly_traffic, n=3):
     return peak_hours
 
 
-def create_traffic_trend_chart(hourly_traffic, peak_hours, title="福州交通拥堵指数24小时趋势"):
+def create_traffic_trend_chart(hourly_traffic, peak_hours, title="福州交通拥堵指数24小时趋势", y_name="拥堵指数总和"):
     """创建交通拥堵趋势折线图"""
     # 提取小时和拥堵指数
     hours = [f"{int(h):02d}:00" for h in hourly_traffic['hour']]
@@ -120,7 +121,7 @@ def create_traffic_trend_chart(hourly_traffic, peak_hours, title="福州交通
                 axislabel_opts=opts.LabelOpts(font_size=10)
             ),
             yaxis_opts=opts.AxisOpts(
-                name="拥堵指数总和",
+                name=y_name,
                 name_textstyle_opts=opts.TextStyleOpts(font_size=12),
                 splitline_opts=opts.SplitLineOpts(is_show=True)
             ),
@@ -147,16 +148,109 @@ def create_traffic_trend_chart(hourly_traffic, peak_hours, title="福州交通
     return line
 
 
-def main():
-    try:
-        # 1. 读取数据
-        print("正在读取数据...")
-        df = load_data("fuzhou_traffic.csv")
-        print(f"成功读取 {len(df)} 条记录")
+def create_timeline_chart(timeline, max_points=CHART_MAX_POINTS, title="福州交通拥堵指数时间序列"):
+    """
+    创建按快照时间的拥堵指数折线图
+    快照数量超过 max_points 时用 LTTB 降采样，保留峰谷形状，避免 HTML 中嵌入过多数据点
+    """
+    sampled = downsample_series(timeline, "timestamp", "delay_index", max_points)
+    times = sampled["timestamp"].dt.strftime("%Y-%m-%d %H:%M").tolist()
+    values = [round(val, 2) for val in sampled["delay_index"]]
+
+    subtitle = "数据来源: 高德地图API"
+    if len(sampled) < len(timeline):
+        subtitle += f"（{len(timeline)} 个快照降采样为 {len(sampled)} 个点）"
+
+    line = (
+        Line(init_opts=opts.InitOpts(
+            width="1200px",
+            height="600px",
+            bg_color="#FFFFFF"
+        ))
+            .add_xaxis(times)
+            .add_yaxis(
+            "拥堵指数",
+            values,
+            symbol="none",
+            linestyle_opts=opts.LineStyleOpts(width=2, color="#5470C6"),
+            itemstyle_opts=opts.ItemStyleOpts(color="#5470C6"),
+            label_opts=opts.LabelOpts(is_show=False)
+        )
+            .set_global_opts(
+            title_opts=opts.TitleOpts(
+                title=title,
+                subtitle=subtitle,
+                pos_left="center",
+                title_textstyle_opts=opts.TextStyleOpts(
+                    font_size=16,
+                    color="#333"
+                )
+            ),
+            xaxis_opts=opts.AxisOpts(
+                name="时间",
+                name_textstyle_opts=opts.TextStyleOpts(font_size=12),
+                axislabel_opts=opts.LabelOpts(font_size=10)
+            ),
+            yaxis_opts=opts.AxisOpts(
+                name="拥堵指数总和",
+                name_textstyle_opts=opts.TextStyleOpts(font_size=12),
+                splitline_opts=opts.SplitLineOpts(is_show=True)
+            ),
+            tooltip_opts=opts.TooltipOpts(trigger="axis"),
+            datazoom_opts=[opts.DataZoomOpts()],
+            toolbox_opts=opts.ToolboxOpts(
+                feature={
+                    "saveAsImage": {"title": "下载图片"},
+                    "restore": {"title": "还原"},
+                    "dataView": {"title": "数据视图"},
+                }
+            )
+        )
+    )
 
-        # 2. 计算每小时的总拥堵指数
-        print("正在计算每小时拥堵指数总和...")
-        hourly_traffic = calculate_hourly_traffic_index(df)
+    return line
+
+
+def main(road=None, direction=None, weekday=None, stat="sum", scan=False, workers=ANALYSIS_WORKERS):
+    """
+    :param road: 只统计指定道路（需要拥堵立方体）
+    :param direction: 只统计指定方向（需要拥堵立方体）
+    :param weekday: 只统计星期几，0=周一（需要拥堵立方体）
+    :param stat: "sum" 拥堵指数总和; "mean" 平均拥堵指数，不受各小时采样次数不同的影响（需要拥堵立方体或 scan）
+    :param scan: 不使用拥堵立方体和汇总统计，直接扫描全部历史数据
+    :param workers: 扫描历史数据时的进程数，None 表示CPU核数
+    """
+    try:
+        filters = {"road": road, "direction": direction, "weekday": weekday}
+        filtered = any(value is not None for value in filters.values())
+        sliced = filtered or stat != "sum"
+        title = "福州交通拥堵指数24小时趋势"
+        y_name = "拥堵指数总和" if stat == "sum" else "平均拥堵指数"
+        if scan and filtered:
+            raise ValueError("扫描历史数据时不支持按道路/方向/星期筛选，请使用拥堵立方体")
+        if os.path.isdir(CUBE_DIR) and not scan:
+            # 1-2. 从拥堵立方体切片汇总（逐天合并，不读取原始数据）
+            print(f"正在读取拥堵立方体 {CUBE_DIR}...")
+            hourly_traffic = CongestionCube.load(CUBE_DIR, keep_dates=False).hourly_delay(stat, **filters)
+            labels = [road, direction, WEEKDAY_NAMES[weekday] if weekday is not None else None]
+            if any(labels):
+                title += "（" + " ".join(label for label in labels if label) + "）"
+            timeline = load_timeline(DASHBOARD_DIR)
+        elif filtered:
+            raise ValueError("按道路/方向/星期筛选需要拥堵立方体，请先执行 python congestion_cube.py rebuild")
+        elif os.path.exists(ROLLUP_FILE) and not sliced and not scan:
+            # 1-2. 直接读取采集时增量维护的汇总统计，无需扫描历史数据
+            print(f"正在读取汇总统计 {ROLLUP_FILE}...")
+            store = RollupStore.load(ROLLUP_FILE)
+            hourly_traffic = store.hourly_delay()
+            timeline = load_timeline(DASHBOARD_DIR)
+        else:
+            # 1-2. 把历史数据切分为多个分片，在多个进程中分块读取并累加每小时的拥堵指数后合并（总和与记录数分别相加）
+            print("正在分块读取数据并计算每小时拥堵指数...")
+            aggregator = aggregate_parallel(default_data_path(), workers)
+            print(f"成功读取 {aggregator.rows} 条记录")
+            hourly_traffic = aggregator.hourly_traffic(stat)
+            timeline = aggregator.timeline()
 
         # 3. 找出高峰时段
         peak_hours = find_peak_hours(hourly_traffic, 3)
@@ -164,14 +258,26 @@ def main():
         for _, row in peak_hours.iterrows():
             print(f"  {int(row['hour']):02d}:00 - 拥堵指数: {row['delay_index']:.2f}")
 
-        # 4. 创建趋势图表
+        # 4-5. 创建并保存趋势图表（数据未变化时跳过渲染）
         print("正在生成趋势图表...")
-        line_chart = create_traffic_trend_chart(hourly_traffic, peak_hours)
-
-        # 5. 保存图表
         output_file = "traffic_trend_analysis.html"
-        line_chart.render(output_file)
-        print(f"趋势图表已保存至: {output_file}")
+        if render_if_changed(lambda: create_traffic_trend_chart(hourly_traffic, peak_hours, title, y_name),
+                             output_file, hourly_traffic, peak_hours, title, y_name):
+            print(f"趋势图表已保存至: {output_file}")
+        else:
+            print(f"数据未变化，跳过渲染: {output_file}")
+
+        # 时间序列为全市数据，切片查询时不绘制
+        timeline_file = "traffic_timeline.html"
+        if sliced:
+            print("切片查询不生成时间序列图表")
+        elif timeline.empty:
+            print("暂无快照时间序列数据（执行 python dashboard.py rebuild 生成看板分片，或加上 --scan 扫描历史数据）")
+        elif render_if_changed(lambda: create_timeline_chart(timeline), timeline_file,
+                               timeline, CHART_MAX_POINTS):
+            print(f"时间序列图表已保存至: {timeline_file}")
+        else:
+            print(f"数据未变化，跳过渲染: {timeline_file}")
 
         # 6. 保存统计数据
         stats_file = "hourly_traffic_summary.csv"
@@ -185,4 +291,12 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="交通拥堵指数24小时趋势分析")
+    parser.add_argument("--road", default=None, help="只统计指定道路")
+    parser.add_argument("--direction", default=None, help="只统计指定方向，例如 南向北")
+    parser.add_argument("--weekday", type=int, default=None, choices=range(7), help="只统计星期几，0=周一")
+    parser.add_argument("--stat", default="sum", choices=["sum", "mean"], help="sum: 总和; mean: 平均值")
+    parser.add_argument("--scan", action="store_true", help="不使用拥堵立方体和汇总统计，直接扫描全部历史数据")
+    parser.add_argument("--workers", type=int, default=ANALYSIS_WORKERS, help="扫描历史数据时的进程数，默认为CPU核数")
+    args = parser.parse_args()
+    main(args.road, args.direction, args.weekday, args.stat, args.scan, args.workers)
\ No newline at end of file